@@ -6,9 +6,10 @@ import time
 import uvicorn
 from dotenv import load_dotenv
 
-from prediction.domain import athlete, activity, route, model
+from prediction.domain import athlete, activity, route, model, training_load, route_prediction
 from prediction.infrastructure.elasticsearch import \
-    ElasticAthleteRepository, ElasticActivityRepository, ElasticRouteRepository, ElasticModelRepository
+    ElasticAthleteRepository, ElasticActivityRepository, ElasticRouteRepository, ElasticModelRepository, \
+    ElasticTrainingLoadRepository, ElasticRoutePredictionRepository
 from prediction.infrastructure.elasticsearch import Elasticsearch
 from prediction.infrastructure.webservice import app
 
@@ -38,5 +39,7 @@ if __name__ == "__main__":
     activity.repository = ElasticActivityRepository(args.local_connect)
     route.repository = ElasticRouteRepository(args.local_connect)
     model.repository = ElasticModelRepository(args.local_connect)
+    training_load.repository = ElasticTrainingLoadRepository(args.local_connect)
+    route_prediction.repository = ElasticRoutePredictionRepository(args.local_connect)
 
     uvicorn.run(app, port=8090, host='0.0.0.0', log_level='debug')
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 from prediction.domain.segment import Segment
 
@@ -44,6 +44,13 @@ class ActivityRepository:
         """
         raise NotImplementedError()
 
+    def get_chunks_desc(self, chunk_size: int = 500) -> Iterator[List[Activity]]:
+        """
+        all activities in desc order, by lists of chunk_size activities
+        read one after the other from the repository
+        """
+        raise NotImplementedError()
+
     def get_general_info(self) -> Optional[dict]:
         """
         Returns the number of activities in base, the name and
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import sklearn
+import xgboost as xgb
+
+
+class ArtifactStore:
+    """
+    Estimators stored in the format of their library, with a manifest :
+    - XGBoost models in the json format of xgboost, readable by any version of the library
+    - scikit-learn models with joblib, not compressed, so that their numpy arrays are
+      memory mapped at loading : the pages are read on demand and shared by the processes
+    The manifest (<id>.manifest.json) gives the file of the estimator, its checksum, its size and modification time,
+    the order of the features and the processing of the label.
+    At loading, the file is hashed only if its size or its modification time are not the ones of the manifest
+    (or if full_check is asked) : an unchanged file is read once.
+    Estimators saved before the manifests are bare pickles named by the id of the model.
+    """
+    xgboost_format = 'xgboost-json'
+    joblib_format = 'joblib'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def manifest_filename(self, id_) -> str:
+        return os.path.join(self.directory, f'{id_}.manifest.json')
+
+    @staticmethod
+    def checksum(filename: str) -> str:
+        file_hash = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+    def save(self, id_, estimator, features: List[str], processing: List[str]) -> Dict:
+        os.makedirs(self.directory, exist_ok=True)
+        if isinstance(estimator, xgb.XGBModel):
+            estimator_format = self.xgboost_format
+            filename = os.path.join(self.directory, f'{id_}.xgb.json')
+            estimator.save_model(filename)
+        else:
+            estimator_format = self.joblib_format
+            filename = os.path.join(self.directory, f'{id_}.joblib')
+            joblib.dump(estimator, filename)
+
+        manifest = {
+            'id': str(id_),
+            'format': estimator_format,
+            'estimator': type(estimator).__name__,
+            'filename': os.path.basename(filename),
+            'sha256': self.checksum(filename),
+            'bytes': os.path.getsize(filename),
+            'mtime_ns': os.stat(filename).st_mtime_ns,
+            'features': list(features),
+            'processing': list(processing),
+            'versions': {'xgboost': xgb.__version__, 'scikit-learn': sklearn.__version__},
+            'created_at': datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        # the manifest is written last, an artifact without manifest is incomplete
+        temporary_filename = self.manifest_filename(f'{id_}.{uuid.uuid4().hex}.tmp')
+        with open(temporary_filename, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary_filename, self.manifest_filename(id_))
+        return manifest
+
+    def get_manifest(self, id_) -> Optional[Dict]:
+        try:
+            with open(self.manifest_filename(id_), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def is_unchanged(filename: str, manifest: Dict) -> bool:
+        """
+        same size and modification time as when the artifact was saved
+        """
+        stat = os.stat(filename)
+        return stat.st_size == manifest['bytes'] and stat.st_mtime_ns == manifest.get('mtime_ns')
+
+    def load(self, id_, verify: bool = True, full_check: bool = False) -> Tuple[Any, Optional[Dict]]:
+        """
+        Returns the estimator and its manifest, None for an old pickle.
+        full_check : the checksum is verified even if the file looks unchanged
+        Raises FileNotFoundError if there is no artifact and ValueError if the checksum is wrong
+        """
+        manifest = self.get_manifest(id_)
+        if manifest is None:
+            with open(os.path.join(self.directory, str(id_)), 'rb') as file:
+                return pickle.load(file), None
+
+        filename = os.path.join(self.directory, manifest['filename'])
+        if verify and (full_check or not self.is_unchanged(filename, manifest)) \
+                and self.checksum(filename) != manifest['sha256']:
+            raise ValueError(f'Checksum of the artifact {filename} is wrong')
+
+        if manifest['format'] == self.xgboost_format:
+            estimator = getattr(xgb, manifest['estimator'])()
+            estimator.load_model(filename)
+        else:
+            estimator = joblib.load(filename, mmap_mode='r')
+        logging.info(f"Artifact {manifest['filename']} loaded ({manifest['bytes']} bytes)")
+        return estimator, manifest
+
+    def size(self, id_) -> int:
+        """
+        number of bytes of the artifact
+        """
+        manifest = self.get_manifest(id_)
+        if manifest is None:
+            return os.path.getsize(os.path.join(self.directory, str(id_)))
+        return manifest['bytes']
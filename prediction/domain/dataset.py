@@ -0,0 +1,206 @@
+import os
+from statistics import mean
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from prediction.domain import activity
+from prediction.domain.activity import Activity
+from prediction.domain.profiler import Profiler
+
+
+class Dataset:
+    """
+    Activities and segment efforts of the athlete as columns (pandas DataFrame).
+    Built once from the repository and shared by the training and the prediction.
+    Dates are parsed (start_date at midnight, start_time since midnight)
+    and rows are sorted by date in descending order.
+    The activities are read by chunks of chunk_size, each chunk is converted in columns
+    before the next one is read : only the columns are kept for the whole history.
+    profile : measures of the stages of the loading
+    """
+    chunk_size = int(os.getenv("DATASET_CHUNK_SIZE", 500))
+
+    def __init__(self, activities: pd.DataFrame, segments: pd.DataFrame, profile: Optional[List[Dict]] = None):
+        self.activities = activities
+        self.segments = segments
+        self.profile = profile or []
+
+    @classmethod
+    def load(cls) -> 'Dataset':
+        return cls.from_chunks(activity.repository.get_chunks_desc(cls.chunk_size))
+
+    @classmethod
+    def from_activities(cls, activities: List[Activity]) -> 'Dataset':
+        return cls.from_chunks([activities])
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[List[Activity]]) -> 'Dataset':
+        profiler = Profiler()
+        activities_frames, segments_frames = [], []
+        with profiler.stage('load_activities') as stage:
+            for activities in chunks:
+                segments = [segment for activity_ in activities for segment in activity_.segment_efforts]
+                activities_frames.append(cls.format_date(cls.to_frame(activities, exclude=('segment_efforts',))))
+                segments_frames.append(cls.format_date(cls.to_frame(segments)))
+            stage['rows_out'] = sum(len(frame) for frame in activities_frames)
+        with profiler.stage('concat', rows_in=len(segments_frames)) as stage:
+            activities_df, segments_df = cls.concat(activities_frames), cls.concat(segments_frames)
+            stage['rows_out'] = len(segments_df)
+        return cls(activities_df, segments_df, profile=profiler.stages)
+
+    def version(self) -> dict:
+        """
+        Version of the data : number of activities and id of the last one imported
+        (Strava ids are given in increasing order)
+        """
+        ids = self.activities['id'].dropna()
+        return {
+            'activities': len(self.activities),
+            'segments': len(self.segments),
+            'last_activity_id': int(ids.max()) if len(ids) else None
+        }
+
+    @staticmethod
+    def to_frame(items: List, exclude: Tuple = ()) -> pd.DataFrame:
+        """
+        one column per attribute of the items, without the intermediate list of dicts
+        """
+        if not items:
+            return pd.DataFrame(columns=['id', 'start_date_local'])
+        columns = [key for key in vars(items[0]) if key not in exclude]
+        frame = pd.DataFrame({
+            key: [vars(item).get(key) for item in items]
+            for key in columns
+        })
+        # repeated strings stored once
+        for key in ('name', 'type'):
+            if key in frame:
+                frame[key] = frame[key].astype('category')
+        return frame
+
+    @classmethod
+    def concat(cls, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        frames of the chunks in one, sorted by date in descending order
+        """
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return cls.format_date(cls.to_frame([]))
+        if len(frames) == 1:
+            return frames[0]
+        for key in ('name', 'type'):
+            if key in frames[0]:
+                categories = union_categoricals([frame[key] for frame in frames], sort_categories=True).categories
+                frames = [frame.assign(**{key: frame[key].cat.set_categories(categories)}) for frame in frames]
+        frame = pd.concat(frames, ignore_index=True).infer_objects()
+        return frame.sort_values('start_date', ascending=False, kind='stable').reset_index(drop=True)
+
+    @staticmethod
+    def format_date(frame: pd.DataFrame) -> pd.DataFrame:
+        date_time = pd.to_datetime(frame['start_date_local'], format='%Y-%m-%dT%H:%M:%SZ')
+        frame = frame.drop(columns='start_date_local')
+        frame['start_date'] = date_time.dt.normalize()
+        frame['start_time'] = date_time - frame['start_date']
+        return frame.sort_values('start_date', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def design_matrix(frame: pd.DataFrame, features: List[str]) -> np.ndarray:
+    """
+    features in this order as float32, the type used by xgboost and by the trees of scikit-learn,
+    filled column by column without an intermediate float64 matrix
+    """
+    matrix = np.empty((len(frame), len(features)), dtype=np.float32)
+    for index, feature in enumerate(features):
+        matrix[:, index] = frame[feature].to_numpy(dtype=np.float32)
+    return matrix
+
+
+def last_30d_bounds(ascending_dates: np.ndarray, dates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    From dates sorted in ascending order, returns for each date the indexes [start, end[
+    of the ones in the 30 days before it (the date itself excluded)
+    """
+    end_dates = dates - np.timedelta64(1, 'D')
+    start_dates = end_dates - np.timedelta64(30, 'D')
+    return (np.searchsorted(ascending_dates, start_dates, side='left'),
+            np.searchsorted(ascending_dates, end_dates, side='right'))
+
+
+def sorted_by_date(frame: pd.DataFrame, column: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    dates and values of the column, sorted by date in ascending order
+    """
+    order = np.argsort(frame['start_date'].to_numpy(), kind='stable')
+    return frame['start_date'].to_numpy()[order], frame[column].to_numpy()[order]
+
+
+def unique_dates(dates) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The features of the last 30 days only depend on the date, they are computed once per date.
+    Returns the unique dates and the index of each date in them
+    """
+    unique, inverse = np.unique(np.asarray(dates, dtype='datetime64[ns]'), return_inverse=True)
+    return unique, inverse.reshape(-1)
+
+
+def time_activities_last_30d(activities: pd.DataFrame, dates) -> np.ndarray:
+    """
+    time in minutes of the activities of the last 30 days before each date
+    """
+    dates, inverse = unique_dates(dates)
+    activities_dates, elapsed_times = sorted_by_date(activities, 'elapsed_time')
+    prefix_sums = [0] + np.cumsum(elapsed_times.astype(np.int64)).tolist()
+    starts, ends = last_30d_bounds(activities_dates, dates)
+    results = [
+        round((prefix_sums[end] - prefix_sums[start]) / 60, 2)
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+    return np.array(results, dtype=np.float64)[inverse]
+
+
+def average_speed_last_30d(activities: pd.DataFrame, dates) -> np.ndarray:
+    """
+    mean of the average speeds of the activities of the last 30 days before each date,
+    0 if there is none
+    """
+    dates, inverse = unique_dates(dates)
+    activities_dates, average_speeds = sorted_by_date(activities, 'average_speed')
+    average_speeds = average_speeds.tolist()
+    starts, ends = last_30d_bounds(activities_dates, dates)
+    results = [
+        round(mean(average_speeds[start:end]), 2) if end > start else 0
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+    return np.array(results, dtype=np.float64)[inverse]
+
+
+def average_climb_cat_last_30d(segments: pd.DataFrame, dates) -> np.ndarray:
+    """
+    mean of the climb categories of the segments of the last 30 days before each date,
+    0 if there is none
+    """
+    dates, inverse = unique_dates(dates)
+    segments_dates, climb_categories = sorted_by_date(segments, 'climb_category')
+    prefix_sums = [0] + np.cumsum(climb_categories.astype(np.int64)).tolist()
+    starts, ends = last_30d_bounds(segments_dates, dates)
+    results = [
+        round((prefix_sums[end] - prefix_sums[start]) / (end - start), 2) if end > start else 0
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+    return np.array(results, dtype=np.float64)[inverse]
+
+
+def days_since_last_activity(activities: pd.DataFrame, activity_ids: pd.Series) -> pd.Series:
+    """
+    days between the activity of each id and the previous activity, 0 for the first activity.
+    An id without activity keeps the value of the previous one.
+    """
+    # activities are sorted by date in descending order
+    start_dates = activities['start_date']
+    gaps = (start_dates - start_dates.shift(-1)).dt.days.fillna(0).astype(np.int64)
+    gaps.index = activities['id']
+    gaps = gaps[~gaps.index.duplicated(keep='last')]
+    return activity_ids.map(gaps).ffill()
@@ -1,247 +1,231 @@
+import copy
+import hashlib
+import json
 import logging
 import os
 import glob
-import pickle
 import random
 import time
 import uuid
-from datetime import timedelta, date, datetime
+from datetime import timedelta, datetime
 from enum import Enum
-from statistics import mean, StatisticsError
-from typing import List, Dict, Optional
+from typing import List, Optional
 
 import numpy as np
+import pandas as pd
 import xgboost as xgb
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, mean_absolute_percentage_error, mean_squared_error
 
-from prediction.domain import activity
-from prediction.utils.functions import transforms_date_in_str, transforms_time_in_str
+from prediction.domain import dataset
+from prediction.domain.artifact_store import ArtifactStore
+from prediction.domain.dataset import Dataset
+from prediction.domain.profiler import Profiler
 
 
 class TypeModel(Enum):
     XGB = xgb.XGBRegressor()
     RFORREST = RandomForestRegressor()
 
+    def new_estimator(self, n_jobs: Optional[int] = None, params: Optional[dict] = None):
+        """
+        Unfitted copy of the estimator, the instance of the enum is shared by all the trainings.
+        n_jobs : number of threads used by the estimator
+        params : hyperparameters replacing the default ones
+        """
+        estimator = clone(self.value)
+        if params:
+            estimator.set_params(**params)
+        if n_jobs is not None:
+            estimator.set_params(n_jobs=n_jobs)
+        return estimator
+
 
 class Model:
     directory_models = './models/'
+    # part of the calendar days in the test set
+    test_ratio = 0.2
+    # the training set is kept in a compressed file next to the estimators, one for the models trained on it
+    keep_training_set = os.getenv("KEEP_TRAINING_SET", "true").lower() == "true"
 
-    def __init__(self, model: TypeModel):
+    def __init__(self, model: TypeModel, dataset_: Optional[Dataset] = None):
+        """
+        dataset_ : activities and segments used for the training,
+        loaded from the repository if not given
+        """
         self.model = model
         self.id = uuid.uuid4()
-        self.activities, self.segments = self.load_data()
+        dataset_ = dataset_ or Dataset.load()
+        # the segments are modified by the training, the dataset can be shared
+        self.activities, self.segments = dataset_.activities, dataset_.segments.copy()
         self.label = 'elapsed_time'
         self.features = ['distance', 'climb_category']
         self.cleaning_result = {}
         self.features_added = []
         self.ratio_train_total = None
+        # calendar days of the test set, kept by the incremental trainings continuing the model
+        self.test_days = None
         self.features_train = []
         self.processing = []
+        # hyperparameters of the estimator different from the default ones, and result of their search
+        self.params = {}
+        self.tuning = None
         self.mae = None
         self.mape = None
         self.rmse = None
         self.training_time = None
         self.training_date = datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+        # file of the training set, None if not kept
+        self.training_set = None
+        # data trained on, and model continued by an incremental training
+        self.data_version = dataset_.version()
+        self.training_mode = 'full'
+        self.parent_id = None
+        # measures of each stage of the training, from the loading of the data
+        self.profile = list(dataset_.profile)
+
+    def copy_for(self, model: TypeModel) -> 'Model':
+        """
+        Model of another type, with the same data already cleaned and prepared
+        """
+        model_ = copy.copy(self)
+        model_.model = model
+        model_.id = uuid.uuid4()
+        model_.cleaning_result = dict(self.cleaning_result)
+        model_.features_added = list(self.features_added)
+        model_.features_train = list(self.features_train)
+        model_.processing = list(self.processing)
+        model_.params = dict(self.params)
+        model_.profile = list(self.profile)
+        return model_
 
     @classmethod
     def delete_all(cls) -> None:
         """
-        Deletion of all registered pickle models
+        Deletion of all registered models (estimators, manifests and training sets)
         """
         files = glob.glob(f'{cls.directory_models}*')
         for file in files:
             os.remove(file)
 
-    @staticmethod
-    def load_data():
-        activities = activity.repository.get_all_desc()
-        segments = [segment.__dict__ for activity_ in activities for segment in activity_.segment_efforts]
-        activities = [activity_.__dict__ for activity_ in activities]
-
-        for activity_ in activities:
-            del activity_['segment_efforts']
-
-        return activities, segments
-
-    @staticmethod
-    def format_date(item_list: List):
-
-        for item in item_list:
-            date_time_obj = datetime.strptime(item.get("start_date_local"), '%Y-%m-%dT%H:%M:%SZ')
-            item['start_date'] = date_time_obj.date()
-            item['start_time'] = date_time_obj.time()
-            del item['start_date_local']
-
-        item_list = sorted(item_list, key=lambda x: x['start_date'], reverse=True)
-        return item_list
-
-    @staticmethod
-    def format_date_to_str(item_list: List):
+    def clean_data(self):
         """
-        Use to reformat dates into a string at the end of the training for storage in Elastic
+        Removes in a single pass, in this order :
+        - segments with a maximum_grade too high
+        - double segments in the same activity
+        - segments too long
+        - segments with a low heart_rate
+        and counts how many segments each rule removed.
+        The rules are masks on the columns, the segments are selected once
         """
-        for item in item_list:
-            item['start_date'] = transforms_date_in_str(item.get("start_date"))
-            item['start_time'] = transforms_time_in_str(item.get("start_time"))
-        return item_list
-
-    def clean_data(self):
-        initial_shape = (len(self.segments), len(self.segments[0]))
+        segments = self.segments
+        initial_shape = segments.shape
 
         # maximum_grade
-        self.segments = [
-            segment_ for segment_ in self.segments if segment_.get('maximum_grade') < 50
-        ]
+        is_kept = (segments['maximum_grade'] < 50).to_numpy()
+        dropped = {'maximum_grade': int((~is_kept).sum())}
 
-        # double segment in same activity
-        unique_segments = []
-        for segment_ in self.segments:
-            if segment_ not in unique_segments:
-                unique_segments.append(segment_)
+        # double segment in same activity : same values for all the columns,
+        # among the segments kept by the previous rule
+        is_duplicate = np.zeros(len(segments), dtype=bool)
+        is_duplicate[is_kept] = segments[is_kept].duplicated().to_numpy()
+        dropped['duplicate'] = int(is_duplicate.sum())
+        is_kept &= ~is_duplicate
 
-        self.segments = unique_segments
-
-        # self.segments too long
-        self.segments = [
-            segment_ for segment_ in self.segments if segment_.get('distance') < 25000
-        ]
+        # segments too long
+        is_too_long = is_kept & ~(segments['distance'] < 25000).to_numpy()
+        dropped['distance'] = int(is_too_long.sum())
+        is_kept &= ~is_too_long
 
         # low heart_rate
         # We keep the None, which are activities performed without a cardiac sensor.
+        is_low_heart_rate = is_kept & ~(segments['average_heart_rate'].isna()
+                                        | (segments['average_heart_rate'] > 100)).to_numpy()
+        dropped['heart_rate'] = int(is_low_heart_rate.sum())
+        is_kept &= ~is_low_heart_rate
 
-        self.segments = [
-            segment_ for segment_ in self.segments
-            if segment_.get('average_heart_rate') is None or segment_.get('average_heart_rate') > 100
-        ]
-
-        end_shape = (len(self.segments), len(self.segments[0]))
+        self.segments = segments[is_kept].reset_index(drop=True)
 
         self.cleaning_result = {
             'initial_shape': initial_shape,
-            'end_shape': end_shape
+            'end_shape': self.segments.shape,
+            'dropped': dropped
         }
 
-    def activities_last_30d(self, date_: date) -> List[Dict]:
-        end_date = date_ - timedelta(days=1)
-        start_date = end_date - timedelta(days=30)
-        return [
-            activity_ for activity_ in self.activities if start_date <= activity_.get("start_date") <= end_date
-        ]
-
-    def segments_last_30d(self, date_: date) -> List[Dict]:
-        end_date = date_ - timedelta(days=1)
-        start_date = end_date - timedelta(days=30)
-        return [
-            segment_ for segment_ in self.segments if start_date <= segment_.get("start_date") <= end_date
-        ]
-
     def time_activities_last_30d(self) -> None:
-
-        for segment_ in self.segments:
-            activities_last_30d = self.activities_last_30d(segment_.get("start_date"))
-            time_activities = sum(activity_['elapsed_time'] for activity_ in activities_last_30d)
-            time_activities = round((time_activities / 60), 2)
-            segment_['time_activities_last_30d'] = time_activities
-
+        self.segments['time_activities_last_30d'] = \
+            dataset.time_activities_last_30d(self.activities, self.segments['start_date'])
         self.features_added.append('time_activities_last_30d')
 
     def type_virtual_ride(self) -> None:
-        for segment_ in self.segments:
-            if segment_.get("type") == "VirtualRide":
-                segment_['type_virtual_ride'] = 1
-            else:
-                segment_['type_virtual_ride'] = 0
-            del segment_['type']
+        self.segments['type_virtual_ride'] = (self.segments['type'] == "VirtualRide").astype(np.int64)
+        self.segments = self.segments.drop(columns='type')
         self.features_added.append('type_virtual_ride')
 
     def days_since_last_activity(self) -> None:
-        result = None
-        for segment_ in self.segments:
-            for activity_ in self.activities:
-                if activity_.get("id") == segment_.get('activity_id'):
-                    index_activity = self.activities.index(activity_)
-                    try:
-                        result = self.activities[index_activity]['start_date'] \
-                                 - self.activities[index_activity + 1]['start_date']
-                        result = result.days
-                    except IndexError:
-                        result = 0
-            segment_['days_since_last_activity'] = result
+        self.segments['days_since_last_activity'] = \
+            dataset.days_since_last_activity(self.activities, self.segments['activity_id'])
         self.features_added.append('days_since_last_activity')
 
     def average_climb_cat_last_30d(self) -> None:
-        for segment_ in self.segments:
-            segments_last_30d = self.segments_last_30d(segment_.get("start_date"))
-            try:
-                avg_climb_cat = mean(seg_['climb_category'] for seg_ in segments_last_30d)
-                avg_climb_cat = round(avg_climb_cat, 2)
-            # If there are no segments in the last 30 days
-            except StatisticsError:
-                avg_climb_cat = 0
-            segment_['average_climb_cat_last_30d'] = avg_climb_cat
+        self.segments['average_climb_cat_last_30d'] = \
+            dataset.average_climb_cat_last_30d(self.segments, self.segments['start_date'])
         self.features_added.append('average_climb_cat_last_30d')
 
     # TODO : Par Climb Category ?
     def average_speed_last_30d(self) -> None:
-        for segment_ in self.segments:
-            activities_last_30d = self.activities_last_30d(segment_.get("start_date"))
-            try:
-                avg_speed_last_30d = mean(activity_['average_speed'] for activity_ in activities_last_30d)
-                avg_speed_last_30d = round(avg_speed_last_30d, 2)
-            except StatisticsError:
-                avg_speed_last_30d = 0
-            segment_['average_speed_last_30d'] = avg_speed_last_30d
+        self.segments['average_speed_last_30d'] = \
+            dataset.average_speed_last_30d(self.activities, self.segments['start_date'])
         self.features_added.append('average_speed_last_30d')
 
-    def split_train_test(self, ratio: float):
-
-        for segment_ in self.segments:
-            segment_['calendar_day'] = segment_.get("start_date").strftime('%j%Y')
-
-        #
+    def is_test_set(self, ratio: float, since: Optional[dict] = None,
+                    test_days: Optional[List[str]] = None) -> np.ndarray:
+        """
+        segments of the calendar days drawn for the test set
+        since, test_days : data version and test days of a previous training, its test days are kept
+        and only the days without segment in its data are drawn : a day it trained on is never tested
+        """
+        calendar_day = self.segments['start_date'].dt.strftime('%j%Y')
 
-        dates_unique = []
-        for segment_ in self.segments:
-            if segment_.get('calendar_day') not in dates_unique:
-                dates_unique.append(segment_.get('calendar_day'))
+        # in order of appearance, as the random sample depends on it
+        dates_unique = list(calendar_day.unique())
+        if test_days is not None:
+            is_previous = (self.segments['activity_id'] <= since['last_activity_id']).to_numpy()
+            previous_days = set(calendar_day[is_previous])
+            dates_unique = [date_ for date_ in dates_unique if date_ not in previous_days]
 
         ratio_train_test = len(dates_unique) * ratio
 
         random.seed(42)
         dates_test_set = random.sample(dates_unique, int(ratio_train_test))
+        if test_days is not None:
+            dates_test_set = list(test_days) + dates_test_set
+        self.test_days = sorted(dates_test_set)
 
-        test_set = [
-            segment_ for segment_ in self.segments if segment_.get('calendar_day') in dates_test_set
-        ]
-
-        train_set = [
-            segment_ for segment_ in self.segments if segment_.get('calendar_day') not in dates_test_set
-        ]
+        return calendar_day.isin(dates_test_set).to_numpy()
 
-        x_train = [
-            [value for key, value in segment_.items() if key in self.features_train] for segment_ in train_set
-        ]
+    def split_train_test(self, ratio: float, since: Optional[dict] = None, test_days: Optional[List[str]] = None):
+        """
+        since : data version of a previous training, the train set is then
+        limited to the segments of the activities added after it
+        test_days : test days of the previous training, kept in the test set
+        """
+        has_since = since is not None and since.get('last_activity_id') is not None
+        is_test = self.is_test_set(ratio, since, test_days if has_since else None)
 
-        y_train = [
-            segment_.get(self.label) for segment_ in train_set
-        ]
+        is_train = ~is_test
+        if has_since:
+            is_train &= (self.segments['activity_id'] > since['last_activity_id']).to_numpy()
 
-        x_test = [
-            [value for key, value in segment_.items() if key in self.features_train] for segment_ in test_set
-        ]
+        x = dataset.design_matrix(self.segments, self.features_train)
+        y = self.segments[self.label].to_numpy()
 
-        y_test = [
-            segment_.get(self.label) for segment_ in test_set
-        ]
-
-        self.ratio_train_total = round(len(train_set) / len(self.segments), 2)
-        return np.array(x_train), np.array(y_train), np.array(x_test), np.array(y_test)
+        self.ratio_train_total = round(int(is_train.sum()) / len(self.segments), 2)
+        return x[is_train], y[is_train], x[is_test], y[is_test]
 
     def log_label(self, y_train: np.array) -> np.array:
-        y_train_log = [
-            np.log(value) for value in y_train
-        ]
+        y_train_log = np.log(y_train)
         self.processing.append("log_label")
         return y_train_log
 
@@ -250,78 +234,175 @@ class Model:
         y_pred = model.predict(x_test)
         return y_pred
 
+    def predict(self, estimator, x) -> np.ndarray:
+        """
+        predictions of the estimator in the unit of the label
+        """
+        y_pred = estimator.predict(x)
+        if "log_label" in self.processing:
+            y_pred = np.exp(y_pred)
+        return y_pred
+
     def metrics(self, y_test, y_pred) -> None:
         if "log_label" in self.processing:
             y_pred = np.exp(y_pred)
 
-        # convert numpy dtypes to native python types with val.item()
-        self.mae = (mean_absolute_error(y_test, y_pred)).item()
-        self.mape = (mean_absolute_percentage_error(y_test, y_pred)).item()
-        self.rmse = (np.sqrt(mean_squared_error(y_test, y_pred))).item()
+        # convert numpy dtypes to native python types
+        self.mae = float(mean_absolute_error(y_test, y_pred))
+        self.mape = float(mean_absolute_percentage_error(y_test, y_pred))
+        self.rmse = float(np.sqrt(mean_squared_error(y_test, y_pred)))
+
+    def dump_estimator(self, estimator) -> None:
+        ArtifactStore(self.directory_models).save(self.id, estimator, self.features_train, self.processing)
 
-    def pickle_dump(self, model) -> None:
-        filename = self.directory_models + str(self.id)
+    def load_estimator(self):
+        """
+        Raises FileNotFoundError if the estimator was removed, ValueError if it is corrupted
+        or if it was trained on other features
+        """
+        estimator, manifest = ArtifactStore(self.directory_models).load(self.id)
+        if manifest is not None and manifest['features'] != self.features_train:
+            raise ValueError(f"Features of the model {self.id} {self.features_train} "
+                             f"are not the ones of its estimator {manifest['features']}")
+        return estimator
+
+    def estimator_size(self) -> int:
+        return ArtifactStore(self.directory_models).size(self.id)
+
+    def dump_training_set(self) -> str:
+        """
+        segments with their features, compressed, outside of the metadata of the model.
+        The file is named by the version of the data and the features : the models trained on the same
+        data (all the types of a training) share one file, written by the first of them
+        """
+        key = json.dumps({'data_version': self.data_version, 'features': self.features_train}, sort_keys=True)
+        filename = f'{self.directory_models}training_set_{hashlib.sha1(key.encode()).hexdigest()[:16]}.pkl.gz'
+        if os.path.exists(filename):
+            return filename
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-        pickle.dump(model, open(filename, 'wb'))
+        # written under another name, a partial file is never shared
+        temporary_filename = f'{filename}.{uuid.uuid4().hex}.tmp'
+        self.segments.to_pickle(temporary_filename, compression='gzip')
+        os.replace(temporary_filename, filename)
+        return filename
+
+    def load_training_set(self) -> Optional[pd.DataFrame]:
+        if self.training_set is None:
+            return None
+        return pd.read_pickle(self.training_set, compression='gzip')
 
     def logging_meta_data(self) -> None:
         logging.info(f'Initial Features -  {self.features}')
         logging.info(f"Data Cleaning - initial shape :  {self.cleaning_result['initial_shape']}"
-                     f" end shape: {self.cleaning_result['end_shape']}")
+                     f" end shape: {self.cleaning_result['end_shape']}"
+                     f" dropped: {self.cleaning_result['dropped']}")
         logging.info(f'Features added -  {self.features_added}')
         logging.info(f'Ratio train_set/total -  {self.ratio_train_total}')
         logging.info(f'Label -  {self.label}')
         logging.info(f'Features Train -  {self.features_train}')
         logging.info(f'Processing -  {self.processing}')
         logging.info(f'Model -  {self.model}')
+        logging.info(f'Params -  {self.params}')
+        if self.tuning is not None:
+            logging.info(f'Tuning -  {self.tuning}')
         logging.info(f'Metrics - MAE :  {self.mae} , MAPE : {self.mape} , RMSE : {self.rmse} ')
         logging.info(f'Training Time : {self.training_time}')
+        logging.info(f'Data Version : {self.data_version} , Training Mode : {self.training_mode} , '
+                     f'Parent : {self.parent_id}')
+        Profiler.log(self.profile)
 
-    def train(self):
-        start_train = time.perf_counter()
-
-        # format date_str to date
-        self.activities = self.format_date(self.activities)
-        self.segments = self.format_date(self.segments)
+    def get_profile(self) -> dict:
+        """
+        measures of the stages of the training, with what identifies the training
+        """
+        return {
+            'id': str(self.id),
+            'model': self.model if isinstance(self.model, str) else self.model.name,
+            'training_date': self.training_date,
+            'training_mode': getattr(self, 'training_mode', None),
+            'data_version': getattr(self, 'data_version', None),
+            'stages': getattr(self, 'profile', [])
+        }
 
-        # cleaning
-        self.clean_data()
+    def export_profile(self, filename: Optional[str] = None) -> str:
+        """
+        profile as json, to compare the trainings between releases
+        """
+        return Profiler.to_json(self.get_profile(), filename)
 
-        # features engineering
-        self.time_activities_last_30d()
-        self.days_since_last_activity()
-        self.type_virtual_ride()
-        self.average_climb_cat_last_30d()
-        self.average_speed_last_30d()
+    def prepare_data(self, since: Optional[dict] = None, test_days: Optional[List[str]] = None):
+        """
+        cleaning, features engineering, split and processing of the label
+        since : data version of a previous training, only the newer segments are in the train set
+        test_days : test days of the previous training, the test set only grows with the new days
+        """
+        profiler = Profiler(self.profile)
+        steps = [
+            # cleaning
+            ('clean_data', self.clean_data),
+            # features engineering
+            ('time_activities_last_30d', self.time_activities_last_30d),
+            ('days_since_last_activity', self.days_since_last_activity),
+            ('type_virtual_ride', self.type_virtual_ride),
+            ('average_climb_cat_last_30d', self.average_climb_cat_last_30d),
+            ('average_speed_last_30d', self.average_speed_last_30d)
+        ]
+        for name, step in steps:
+            with profiler.stage(name, rows_in=len(self.segments)) as stage:
+                step()
+                stage['rows_out'] = len(self.segments)
 
         # split train/test
-        self.features_train = self.features + self.features_added
-        x_train, y_train, x_test, y_test = self.split_train_test(0.2)
+        with profiler.stage('split_train_test', rows_in=len(self.segments)) as stage:
+            self.features_train = self.features + self.features_added
+            x_train, y_train, x_test, y_test = self.split_train_test(self.test_ratio, since=since,
+                                                                      test_days=test_days)
+            stage['rows_out'] = len(x_train)
 
         # log label
-        y_train = self.log_label(y_train)
+        with profiler.stage('log_label', rows_in=len(y_train)) as stage:
+            y_train = self.log_label(y_train)
+            stage['rows_out'] = len(y_train)
 
-        # algo fit predict
-        y_pred = self.fit_predict(self.model.value,
-                                  x_train,
-                                  y_train,
-                                  x_test)
+        return x_train, y_train, x_test, y_test
 
+    def end_training(self, estimator, y_test, y_pred, training_seconds: float) -> None:
+        profiler = Profiler(self.profile)
         # metrics
-        self.metrics(y_test, y_pred)
-        end_train = time.perf_counter()
-        self.training_time = timedelta(seconds=int(end_train - start_train))
+        with profiler.stage('metrics', rows_in=len(y_test)):
+            self.metrics(y_test, y_pred)
+        self.training_time = timedelta(seconds=int(training_seconds))
 
         # save
-        self.pickle_dump(self.model.value)
+        with profiler.stage('dump_estimator'):
+            self.dump_estimator(estimator)
+
+        if self.keep_training_set:
+            with profiler.stage('dump_training_set', rows_in=len(self.segments)):
+                self.training_set = self.dump_training_set()
 
         # TODO Ugly method for not to encode the model in json
-        self.model = type(self.model.value).__name__
+        self.model = type(estimator).__name__
         self.logging_meta_data()
 
-        # format date to str for elastic
-        self.activities = self.format_date_to_str(self.activities)
-        self.segments = self.format_date_to_str(self.segments)
+        # only the metadata and the metrics are stored in elastic
+        del self.activities, self.segments
+
+    def train(self):
+        start_train = time.perf_counter()
+
+        x_train, y_train, x_test, y_test = self.prepare_data()
+
+        # algo fit predict
+        estimator = self.model.new_estimator()
+        with Profiler(self.profile).stage('fit_predict', rows_in=len(x_train)) as stage:
+            y_pred = self.fit_predict(estimator,
+                                      x_train,
+                                      y_train,
+                                      x_test)
+            stage['rows_out'] = len(y_pred)
+
+        self.end_training(estimator, y_test, y_pred, time.perf_counter() - start_train)
 
 
 class ModelRepository:
@@ -332,7 +413,26 @@ class ModelRepository:
     def get(self, id_) -> Model:
         raise NotImplementedError()
 
-    def get_better_mape(self) -> Model:
+    def get_champion(self) -> Optional[Model]:
+        """
+        Returns the champion, the model with the best MAPE, from a pointer updated
+        when a better model is saved
+        Or None if there is no model
+        """
+        raise NotImplementedError()
+
+    def elect_champion(self, excluded_ids: List[str] = ()) -> Optional[Model]:
+        """
+        Points the champion to the model with the best MAPE, the models
+        of excluded_ids (estimator removed...) excepted, and returns it
+        """
+        raise NotImplementedError()
+
+    def get_last_trained(self, model_name: str) -> Optional[Model]:
+        """
+        Returns the last model trained of this estimator (XGBRegressor...)
+        Or None if there is none
+        """
         raise NotImplementedError()
 
     def get_general_info(self) -> Optional[dict]:
@@ -347,6 +447,9 @@ class ModelRepository:
         raise NotImplementedError()
 
     def save(self, model: Model):
+        """
+        saves the model and makes it the champion if its MAPE is the best
+        """
         raise NotImplementedError()
 
     def delete_recreates_index(self) -> None:
@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from prediction.domain import model
+from prediction.domain.model import Model
+
+
+class ModelCache:
+    """
+    Models loaded in memory, shared by all the predictions of the process.
+    Each entry is the estimator loaded from its artifact and the metadata of the Model, by id.
+    When there are more than max_models entries or when their artifacts are larger than max_bytes,
+    the least recently used ones are removed.
+    The id of the champion is also kept. The champion pointer of the repository is read again
+    after refresh_seconds, as other processes may train models, or after clear() : when models
+    are trained or deleted by this process.
+    """
+
+    def __init__(self, max_models: Optional[int] = None, max_bytes: Optional[int] = None,
+                 refresh_seconds: Optional[float] = None):
+        self.max_models = max_models or int(os.getenv("MODEL_CACHE_MAX_MODELS", 8))
+        self.max_bytes = max_bytes or int(os.getenv("MODEL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else \
+            float(os.getenv("CHAMPION_REFRESH_SECONDS", 10))
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.champion_id = None
+        self.champion_read_at = None
+        self.lock = threading.RLock()
+
+    def get(self, id_) -> Optional[Tuple[Model, Any]]:
+        with self.lock:
+            entry = self.entries.get(str(id_))
+            if entry is None:
+                return None
+            self.entries.move_to_end(str(id_))
+            model_, estimator, _ = entry
+            return model_, estimator
+
+    def put(self, model_: Model, estimator, size: int) -> None:
+        """
+        size : number of bytes of the artifact of the estimator
+        """
+        with self.lock:
+            self.remove(model_.id)
+            self.entries[str(model_.id)] = (model_, estimator, size)
+            self.total_bytes += size
+            # the last entry is kept even if alone it is larger than max_bytes
+            while len(self.entries) > 1 and \
+                    (len(self.entries) > self.max_models or self.total_bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def remove(self, id_) -> None:
+        with self.lock:
+            entry = self.entries.pop(str(id_), None)
+            if entry is not None:
+                self.total_bytes -= entry[2]
+
+    def get_estimator(self, model_: Model):
+        """
+        estimator of the model, loaded from its artifact if not in the cache
+        """
+        with self.lock:
+            entry = self.get(model_.id)
+            if entry is not None:
+                return entry[1]
+            estimator = model_.load_estimator()
+            self.put(model_, estimator, model_.estimator_size())
+            logging.info(f'Model cache - model {model_.id} loaded, {len(self.entries)} models '
+                         f'of {self.total_bytes} bytes in cache')
+            return estimator
+
+    def get_champion(self) -> Optional[Tuple[Model, Any]]:
+        """
+        champion and its estimator, None if there is no model with an estimator.
+        A champion whose estimator was removed or corrupted is replaced by the next best model.
+        """
+        with self.lock:
+            if self.champion_id is not None and time.monotonic() - self.champion_read_at < self.refresh_seconds:
+                entry = self.get(self.champion_id)
+                if entry is not None:
+                    return entry
+
+            champion = model.repository.get_champion()
+            excluded_ids = []
+            while champion is not None:
+                try:
+                    estimator = self.get_estimator(champion)
+                except (FileNotFoundError, ValueError) as error:
+                    logging.warning(f'Model cache - estimator of the champion {champion.id} not loaded : {error}')
+                    self.remove(champion.id)
+                    excluded_ids.append(str(champion.id))
+                    champion = model.repository.elect_champion(excluded_ids=excluded_ids)
+                    continue
+                self.champion_id, self.champion_read_at = champion.id, time.monotonic()
+                return champion, estimator
+
+            self.champion_id = None
+            return None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.champion_id = None
+
+
+cache = ModelCache()
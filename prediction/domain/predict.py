@@ -1,201 +1,170 @@
-import pickle
-from datetime import timedelta, date, datetime
-from statistics import mean, StatisticsError
-from typing import Dict, List, Tuple
+import hashlib
+import json
+from datetime import date
+from typing import Dict, List, Optional, Sequence
 
 import numpy as np
+import pandas as pd
 
-from prediction.domain import activity
+from prediction.domain import dataset, model_cache
+from prediction.domain.dataset import Dataset
 from prediction.domain.model import Model
 from prediction.domain.route import Route
-from prediction.utils.functions import convert_seconds_in_hms
+from prediction.domain.training_load import TrainingLoad
+from prediction.utils.functions import convert_seconds_in_hms, climb_category
 
 
 class Predict:
-    directory_models = './models/'
 
-    def __init__(self, model: Model, route: Route, virtual_ride):
+    def __init__(self, model: Model, route: Route, virtual_ride, dataset_: Optional[Dataset] = None,
+                 training_load_: Optional[TrainingLoad] = None):
+        """
+        training_load_ : ledger of the training load of the athlete, the features of the last 30 days are read from it
+        dataset_ : activities and segments of the athlete, used without ledger,
+        loaded from the repository if not given
+        """
         self.model = model
         self.route = route
         self.virtual_ride = virtual_ride
-        self.activities, self.segments = self.load_data()
+        self.training_load = training_load_
+        self.dataset = dataset_ if dataset_ is not None or training_load_ is not None else Dataset.load()
+        self._athlete_features = None
         self.loaded_model = self.load_model()
 
     def load_model(self):
-        filename = self.directory_models + str(self.model.id)
-        loaded_model = pickle.load(open(filename, 'rb'))
-        return loaded_model
-
-    @staticmethod
-    def load_data() -> Tuple[List[Dict], List[Dict]]:
-        activities = activity.repository.get_all_desc()
-        segments = [segment.__dict__ for activity_ in activities for segment in activity_.segment_efforts]
-        activities = [activity_.__dict__ for activity_ in activities]
-        for activity_ in activities:
-            del activity_['segment_efforts']
-        return activities, segments
+        """
+        estimator of the model, from the cache of the process
+        """
+        return model_cache.cache.get_estimator(self.model)
 
     @staticmethod
-    def format_date(item_list: List):
-        for item in item_list:
-            date_time_obj = datetime.strptime(item.get("start_date_local"), '%Y-%m-%dT%H:%M:%SZ')
-            item['start_date'] = date_time_obj.date()
-            item['start_time'] = date_time_obj.time()
-            del item['start_date_local']
-        item_list = sorted(item_list, key=lambda x: x['start_date'], reverse=True)
-        return item_list
-
-    def activities_last_30d(self, date_: date) -> List[Dict]:
-        end_date = date_ - timedelta(days=1)
-        start_date = end_date - timedelta(days=30)
-        return [
-            activity_ for activity_ in self.activities if start_date <= activity_.get("start_date") <= end_date
-        ]
-
-    def segments_last_30d(self, date_: date) -> List[Dict]:
-        end_date = date_ - timedelta(days=1)
-        start_date = end_date - timedelta(days=30)
-        return [
-            segment_ for segment_ in self.segments if start_date <= segment_.get("start_date") <= end_date
-        ]
-
-    def compute_time_activities_last_30d(self, data_to_predict: List[Dict]):
-        activities_last_30d = self.activities_last_30d(date.today())
-        time_activities_last_30d = sum(activity_['elapsed_time'] for activity_ in activities_last_30d)
-        time_activities_last_30d = round((time_activities_last_30d / 60), 2)
-
-        for segment in data_to_predict:
-            segment['time_activities_last_30d'] = time_activities_last_30d
+    def today() -> np.ndarray:
+        return np.array([date.today()], dtype='datetime64[ns]')
 
+    def compute_time_activities_last_30d(self, data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        if self.training_load is not None:
+            data_to_predict['time_activities_last_30d'] = self.training_load.time_activities_last_30d(date.today())
+        else:
+            data_to_predict['time_activities_last_30d'] = \
+                dataset.time_activities_last_30d(self.dataset.activities, self.today())[0]
         return data_to_predict
 
-    def compute_days_since_last_activity(self, data_to_predict: List[Dict]):
-        last_activity = self.activities[0]
-        time_since_last_activity = date.today() - last_activity.get("start_date")
-        for segment in data_to_predict:
-            segment['days_since_last_activity'] = time_since_last_activity.days
+    def compute_days_since_last_activity(self, data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        if self.training_load is not None:
+            data_to_predict['days_since_last_activity'] = self.training_load.days_since_last_activity(date.today())
+        else:
+            last_activity_date = self.dataset.activities['start_date'].max()
+            data_to_predict['days_since_last_activity'] = (pd.Timestamp(date.today()) - last_activity_date).days
         return data_to_predict
 
-    def compute_average_climb_cat_last_30d(self, data_to_predict: List[Dict]):
-        segments_last_30d = self.segments_last_30d(date.today())
-        try:
-            avg_climb_cat_last_30d = mean(segment_['climb_category'] for segment_ in segments_last_30d)
-            avg_climb_cat_last_30d = round(avg_climb_cat_last_30d, 2)
-        except StatisticsError:
-            avg_climb_cat_last_30d = 0
-
-        for segment in data_to_predict:
-            segment['average_climb_cat_last_30d'] = avg_climb_cat_last_30d
-
+    def compute_average_climb_cat_last_30d(self, data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        if self.training_load is not None:
+            data_to_predict['average_climb_cat_last_30d'] = \
+                self.training_load.average_climb_cat_last_30d(date.today())
+        else:
+            data_to_predict['average_climb_cat_last_30d'] = \
+                dataset.average_climb_cat_last_30d(self.dataset.segments, self.today())[0]
         return data_to_predict
 
-    def compute_average_speed_last_30d(self, data_to_predict: List[Dict]):
-        activities_last_30d = self.activities_last_30d(date.today())
-        try:
-            avg_speed_last_30d = mean(segment_['average_speed'] for segment_ in activities_last_30d)
-            avg_speed_last_30d = round(avg_speed_last_30d, 2)
-        except StatisticsError:
-            avg_speed_last_30d = 0
-
-        for segment in data_to_predict:
-            segment['average_speed_last_30d'] = avg_speed_last_30d
-
+    def compute_average_speed_last_30d(self, data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        if self.training_load is not None:
+            data_to_predict['average_speed_last_30d'] = self.training_load.average_speed_last_30d(date.today())
+        else:
+            data_to_predict['average_speed_last_30d'] = \
+                dataset.average_speed_last_30d(self.dataset.activities, self.today())[0]
         return data_to_predict
 
-    def compute_virtual_ride(self, data_to_predict: List[Dict]):
-        for segment in data_to_predict:
-            if self.virtual_ride:
-                segment['type_virtual_ride'] = 1
-            else:
-                segment['type_virtual_ride'] = 0
+    def compute_virtual_ride(self, data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        data_to_predict['type_virtual_ride'] = 1 if self.virtual_ride else 0
         return data_to_predict
 
     @staticmethod
-    def compute_climb_category(data_to_predict: List[Dict]) -> List[Dict]:
-        """
-        Climb category is a feature of Strava
-        https://support.strava.com/hc/en-us/articles/216917057-Climb-Categorization
-        """
-        climb_cat = None
-        for segment in data_to_predict:
-            result = segment.get("average_grade") * segment.get("distance")
-            if result <= 8000:
-                climb_cat = 0
-            elif 8000 < result <= 16000:
-                climb_cat = 1
-            elif 16000 < result <= 32000:
-                climb_cat = 2
-            elif 32000 < result <= 64000:
-                climb_cat = 3
-            elif 64000 < result <= 80000:
-                climb_cat = 4
-            elif result > 80000:
-                climb_cat = 5
-            segment['climb_category'] = climb_cat
+    def compute_climb_category(data_to_predict: pd.DataFrame) -> pd.DataFrame:
+        data_to_predict['climb_category'] = climb_category(data_to_predict['average_grade'],
+                                                           data_to_predict['distance'])
         return data_to_predict
 
-    def ordered_data(self, data_to_predict: List[Dict]) -> List[Dict]:
+    def features_matrix(self, data_to_predict: pd.DataFrame) -> np.ndarray:
         """
-        orders the keys of each dict in the same order as during training
+        features of the segments, in the same order as during training
         """
-        ordered_data = []
-        for segment in data_to_predict:
-            ordered_segment = {}
-            for key in self.model.features_train:
-                ordered_segment[key] = segment.get(key)
-            ordered_data.append(ordered_segment)
-        return ordered_data
-
-    @staticmethod
-    def data_formatting(data_to_predict: List[Dict]) -> np.array:
-        formatted_data = [
-            [value for value in segment_.values()] for segment_ in data_to_predict
-        ]
-        return np.array(formatted_data)
-
-    def prepare_data(self):
-
-        # format date_str to date
-        self.activities = self.format_date(self.activities)
-        self.segments = self.format_date(self.segments)
-
-        # Remove all_points for dict_segment
-        data_to_predict = [
-            {key: value for key, value in segment.items() if key != "all_points"}
-            for segment in self.route.segmentation
-        ]
-
         # en fonction des features train
 
         if "climb_category" in self.model.features_train:
             data_to_predict = self.compute_climb_category(data_to_predict)
         if "type_virtual_ride" in self.model.features_train:
             data_to_predict = self.compute_virtual_ride(data_to_predict)
-        if "time_activities_last_30d" in self.model.features_train:
-            data_to_predict = self.compute_time_activities_last_30d(data_to_predict)
-        if "days_since_last_activity" in self.model.features_train:
-            data_to_predict = self.compute_days_since_last_activity(data_to_predict)
-        if "average_climb_cat_last_30d" in self.model.features_train:
-            data_to_predict = self.compute_average_climb_cat_last_30d(data_to_predict)
-        if "average_speed_last_30d" in self.model.features_train:
-            data_to_predict = self.compute_average_speed_last_30d(data_to_predict)
-
-        data_to_predict = self.ordered_data(data_to_predict)
-        data_to_predict = self.data_formatting(data_to_predict)
+        for feature, value in self.athlete_features().items():
+            data_to_predict[feature] = value
 
-        return data_to_predict
+        return dataset.design_matrix(data_to_predict, self.model.features_train)
 
-    def get_prediction(self):
+    def athlete_features(self) -> Dict:
+        """
+        features of the athlete of today used by the model, the same for all the segments.
+        Computed once
+        """
+        if self._athlete_features is None:
+            athlete_data = pd.DataFrame(index=[0])
+            if "time_activities_last_30d" in self.model.features_train:
+                athlete_data = self.compute_time_activities_last_30d(athlete_data)
+            if "days_since_last_activity" in self.model.features_train:
+                athlete_data = self.compute_days_since_last_activity(athlete_data)
+            if "average_climb_cat_last_30d" in self.model.features_train:
+                athlete_data = self.compute_average_climb_cat_last_30d(athlete_data)
+            if "average_speed_last_30d" in self.model.features_train:
+                athlete_data = self.compute_average_speed_last_30d(athlete_data)
+            self._athlete_features = {
+                feature: np.nan if pd.isna(value) else float(value)
+                for feature, value in athlete_data.iloc[0].items()
+            }
+        return self._athlete_features
+
+    def fingerprint(self) -> str:
+        """
+        hash of the features of the athlete : the predictions are the same while they do not change
+        """
+        features = json.dumps(self.athlete_features(), sort_keys=True)
+        return hashlib.sha1(features.encode()).hexdigest()
 
-        data = self.prepare_data()
-        prediction_segments = self.loaded_model.predict(data)
+    def has_route_features(self) -> bool:
+        """
+        True if the features of the model are the ones of the route, of the ride and of the athlete
+        """
+        return all(feature in Route.feature_columns or feature == "type_virtual_ride"
+                   or feature in self.athlete_features()
+                   for feature in self.model.features_train)
 
-        if "log_label" in self.model.processing:
-            prediction = sum(np.exp(prediction_segments))
-        else:
-            prediction = sum(prediction_segments)
+    def append_features(self, route_features: np.ndarray) -> np.ndarray:
+        """
+        matrix of the model from the features of the segments computed at the import of the route,
+        the features of the ride and of the athlete are appended
+        """
+        values = dict(self.athlete_features(), type_virtual_ride=1 if self.virtual_ride else 0)
+        matrix = np.empty((len(route_features), len(self.model.features_train)), dtype=np.float32)
+        for index, feature in enumerate(self.model.features_train):
+            if feature in Route.feature_columns:
+                matrix[:, index] = route_features[:, Route.feature_columns.index(feature)]
+            else:
+                matrix[:, index] = values[feature]
+        return matrix
+
+    def prepare_data(self) -> np.ndarray:
+        if self.has_route_features():
+            return self.append_features(self.route.get_features())
+
+        # segments of the route without all_points
+        data_to_predict = pd.DataFrame(self.route.get_segmentation('prediction'))
+        return self.features_matrix(data_to_predict)
+
+    @staticmethod
+    def summary(route: Route, prediction_segments: np.ndarray) -> Dict:
+        """
+        time and average speed of the route from the times of its segments
+        """
+        prediction = float(np.sum(prediction_segments))
 
-        avg_speed_kmh = (self.route.distance / prediction) * 3.6
+        avg_speed_kmh = (route.distance / prediction) * 3.6 if prediction > 0 else 0
         avg_speed_kmh = round(avg_speed_kmh, 2)
         hours, minutes, seconds = convert_seconds_in_hms(prediction)
 
@@ -205,3 +174,82 @@ class Predict:
             "seconds": seconds,
             "avg_speed_kmh": avg_speed_kmh
         }
+
+    def predict_segments(self, data: np.ndarray) -> np.ndarray:
+        """
+        time of each segment, none without segment (route without segmentation)
+        """
+        if len(data) == 0:
+            return np.empty(0)
+        return self.model.predict(self.loaded_model, data)
+
+    def get_prediction(self):
+
+        data = self.prepare_data()
+        prediction_segments = self.predict_segments(data)
+        return self.summary(self.route, prediction_segments)
+
+
+class BatchPredict(Predict):
+    """
+    Predictions of many routes in each virtual_ride mode.
+    The segments of all the routes are stacked in one matrix, the features of the athlete
+    are computed once for all of them and the estimator is called once.
+    """
+
+    def __init__(self, model: Model, routes: List[Route], virtual_rides: Sequence[bool] = (False, True),
+                 dataset_: Optional[Dataset] = None, training_load_: Optional[TrainingLoad] = None):
+        super().__init__(model=model, route=None, virtual_ride=False, dataset_=dataset_,
+                         training_load_=training_load_)
+        self.routes = routes
+        self.virtual_rides = list(virtual_rides)
+        # number of segments of each route
+        self.segments_count = []
+
+    def prepare_data(self) -> np.ndarray:
+        """
+        segments of all the routes, for each virtual_ride mode one after the other
+        """
+        if self.has_route_features():
+            routes_features = [route_.get_features() for route_ in self.routes]
+            self.segments_count = [len(route_features) for route_features in routes_features]
+            matrix = self.append_features(np.vstack(routes_features))
+        else:
+            segmentations = [route_.get_segmentation('prediction') for route_ in self.routes]
+            self.segments_count = [len(segmentation) for segmentation in segmentations]
+            data_to_predict = pd.DataFrame([segment for segmentation in segmentations for segment in segmentation])
+            matrix = self.features_matrix(data_to_predict)
+        if "type_virtual_ride" not in self.model.features_train:
+            return np.vstack([matrix] * len(self.virtual_rides))
+
+        column = self.model.features_train.index("type_virtual_ride")
+        matrices = []
+        for virtual_ride in self.virtual_rides:
+            matrix_ = matrix.copy()
+            matrix_[:, column] = 1 if virtual_ride else 0
+            matrices.append(matrix_)
+        return np.vstack(matrices)
+
+    def get_predictions(self) -> List[Dict]:
+        """
+        For each route and virtual_ride mode, its time, average speed and the time in seconds of each segment
+        """
+        if not self.routes:
+            return []
+        data = self.prepare_data()
+        prediction_segments = self.predict_segments(data)
+
+        # bounds of the segments of each route in a virtual_ride mode
+        bounds = np.cumsum([0] + self.segments_count * len(self.virtual_rides)).tolist()
+        predictions = []
+        for index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            route_ = self.routes[index % len(self.routes)]
+            virtual_ride = self.virtual_rides[index // len(self.routes)]
+            prediction = self.summary(route_, prediction_segments[start:end])
+            prediction.update({
+                "route_id": route_.id,
+                "virtual_ride": virtual_ride,
+                "segments_seconds": [round(float(seconds), 2) for seconds in prediction_segments[start:end]]
+            })
+            predictions.append(prediction)
+        return predictions
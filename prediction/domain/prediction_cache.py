@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from prediction.domain.predict import Predict
+
+
+class PredictionCache:
+    """
+    Predictions of the routes already computed by the process.
+    The key is the route, the model, the virtual_ride mode and the fingerprint of the features of the athlete :
+    a prediction is the same while none of them changes.
+    The entries are kept ttl_seconds, the least recently used ones are removed when there are more than max_entries.
+    The cache is cleared when models are trained or deleted and when activities are imported or deleted.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries or int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", 4096))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", 6 * 3600))
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def key(predict_: Predict) -> Tuple:
+        return str(predict_.route.id), str(predict_.model.id), bool(predict_.virtual_ride), predict_.fingerprint()
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: Tuple, prediction: Dict) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), dict(prediction))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_prediction(self, predict_: Predict) -> Dict:
+        """
+        prediction of the cache, computed and stored if it is not there
+        """
+        key = self.key(predict_)
+        prediction = self.get(key)
+        if prediction is None:
+            prediction = predict_.get_prediction()
+            self.put(key, prediction)
+        return prediction
+
+    def clear(self) -> None:
+        with self.lock:
+            if self.entries:
+                logging.info(f'Prediction cache - {len(self.entries)} predictions removed '
+                             f'({self.hits} hits, {self.misses} misses)')
+            self.entries.clear()
+
+
+cache = PredictionCache()
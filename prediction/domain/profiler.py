@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Profiler:
+    """
+    Measures the stages of a training : wall time, cpu time of the process,
+    peak memory and number of rows before and after the stage.
+    The records are appended to the list given, which is stored on the Model.
+    The peak memory of a stage is traced with tracemalloc only if PROFILE_MEMORY is true,
+    as tracing slows down the training. The maximum resident memory of the process is always given.
+    """
+    trace_memory = os.getenv("PROFILE_MEMORY", "false").lower() == "true"
+
+    def __init__(self, stages: Optional[List[Dict]] = None):
+        self.stages = stages if stages is not None else []
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None):
+        """
+        The record is yielded so that rows_out can be set by the stage
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # the peak is the one of the allocations of the stage
+            tracemalloc.clear_traces()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - start_wall, 4)
+            record['cpu_seconds'] = round(time.process_time() - start_cpu, 4)
+            record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+            # kilobytes on linux
+            record['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            self.stages.append(record)
+
+    @staticmethod
+    def log(stages: List[Dict]) -> None:
+        for record in stages:
+            logging.info(f"Stage {record['stage']} - wall : {record['wall_seconds']}s , "
+                         f"cpu : {record['cpu_seconds']}s , peak memory : {record['peak_memory_bytes']} , "
+                         f"max rss : {record['max_rss_bytes']} , rows : {record['rows_in']} -> {record['rows_out']}")
+
+    @staticmethod
+    def to_json(profile: Dict, filename: Optional[str] = None) -> str:
+        """
+        profile as json, written in filename if given
+        """
+        profile_json = json.dumps(profile, indent=2, default=str)
+        if filename is not None:
+            with open(filename, 'w') as file:
+                file.write(profile_json)
+        return profile_json
@@ -1,10 +1,23 @@
 from typing import List, Optional, Dict
 
 import folium
+import numpy as np
 from folium import plugins
 
+from prediction.utils.functions import simplify_polyline, simplify_segmentation, climb_category, \
+    encode_gpx, decode_gpx, encode_segmentation, decode_segmentation, encode_matrix, decode_matrix
+
 
 class Route:
+    # Douglas-Peucker tolerance in meters of the points of the segments for each use
+    # None : the points are not needed
+    simplification_tolerances = {
+        'storage': 1.0,
+        'map': 5.0,
+        'prediction': None
+    }
+    # features of the segments which do not depend on the athlete, computed at import
+    feature_columns = ['distance', 'average_grade', 'climb_category']
 
     def __init__(self, id_: int, athlete_id: int, description: str, distance: int, elevation_gain: int,
                  name: str, created_at: str, estimated_moving_time: int, gpx: List[Dict],
@@ -19,6 +32,86 @@ class Route:
         self.estimated_moving_time = estimated_moving_time
         self.gpx = gpx
         self.segmentation = segmentation
+        self.features = None
+
+    # The geometry of the route is stored encoded (see encode_gpx / encode_segmentation)
+    # and only decoded when it is accessed
+
+    @property
+    def gpx(self) -> List[Dict]:
+        if self._gpx is None and self._gpx_encoded is not None:
+            self._gpx = decode_gpx(self._gpx_encoded)
+        return self._gpx
+
+    @gpx.setter
+    def gpx(self, gpx: List[Dict]):
+        self._gpx = gpx
+        self._gpx_encoded = None
+
+    @property
+    def segmentation(self) -> List[Dict]:
+        if self._segmentation is None and self._segmentation_encoded is not None:
+            self._segmentation = decode_segmentation(self._segmentation_encoded)
+        return self._segmentation
+
+    @segmentation.setter
+    def segmentation(self, segmentation: List[Dict]):
+        self._segmentation = segmentation
+        self._segmentation_encoded = None
+
+    def get_gpx_encoded(self) -> Optional[Dict]:
+        """
+        None if the route has no gpx
+        """
+        if self._gpx_encoded is None and self._gpx is not None:
+            self._gpx_encoded = encode_gpx(self._gpx)
+        return self._gpx_encoded
+
+    def set_gpx_encoded(self, gpx_encoded: Dict) -> None:
+        self._gpx = None
+        self._gpx_encoded = gpx_encoded
+
+    def get_segmentation_encoded(self) -> Optional[Dict]:
+        """
+        None if the route has no segmentation
+        """
+        if self._segmentation_encoded is None and self._segmentation is not None:
+            self._segmentation_encoded = encode_segmentation(self._segmentation)
+        return self._segmentation_encoded
+
+    def set_segmentation_encoded(self, segmentation_encoded: Dict) -> None:
+        self._segmentation = None
+        self._segmentation_encoded = segmentation_encoded
+
+    def segments_features(self) -> np.ndarray:
+        """
+        matrix of the feature_columns of the segments, in float32 as the matrix of the model
+        """
+        segments = self.get_segmentation('prediction')
+        columns = {
+            key: np.array([segment.get(key) for segment in segments], dtype=np.float64)
+            for key in ('distance', 'average_grade')
+        }
+        columns['climb_category'] = climb_category(columns['average_grade'], columns['distance'])
+        matrix = np.empty((len(segments), len(self.feature_columns)), dtype=np.float32)
+        for index, column in enumerate(self.feature_columns):
+            matrix[:, index] = columns[column]
+        return matrix
+
+    def compute_features(self) -> None:
+        """
+        features of the segments stored with the route
+        """
+        self.features = encode_matrix(self.segments_features(), self.feature_columns)
+
+    def get_features(self) -> np.ndarray:
+        """
+        features of the segments (see feature_columns), computed if the route was stored without them
+        """
+        features = getattr(self, 'features', None)
+        if features is None or features['columns'] != self.feature_columns:
+            return self.segments_features()
+        return decode_matrix(features)
 
     def get_middle_point(self) -> List:
         middle_value = round(len(self.gpx) / 2)
@@ -34,6 +127,19 @@ class Route:
             for point in self.gpx
         ]
 
+    def get_segmentation(self, use: str) -> List[Dict]:
+        """
+        segmentation with the points of the segments simplified
+        according to the use : storage, map or prediction, empty if the route has no segmentation
+        """
+        if self._segmentation is None and self._segmentation_encoded is None:
+            return []
+        tolerance = self.simplification_tolerances[use]
+        # the points are not needed, no need to decode them
+        if tolerance is None and self._segmentation is None:
+            return [dict(segment) for segment in self._segmentation_encoded['segments']]
+        return simplify_segmentation(self.segmentation, tolerance)
+
     def get_map(self) -> str:
         """
         from points of geographical coordinates returns a map of the route as a string html
@@ -44,7 +150,7 @@ class Route:
             zoom_start=13
         )
         folium.plugins.AntPath(
-            locations=self.get_all_points(),
+            locations=simplify_polyline(self.get_all_points(), self.simplification_tolerances['map']),
             dash_array=[10, 35],
             color="#FC4C02",
             pulse_color="black",
@@ -64,7 +170,7 @@ class Route:
             zoom_start=13
         )
 
-        for segment in self.segmentation:
+        for segment in self.get_segmentation('map'):
             if segment.get("average_grade") < 0:
 
                 line = folium.PolyLine(
@@ -107,6 +213,12 @@ class RouteRepository:
         """
         raise NotImplementedError()
 
+    def get_by_ids(self, ids: List) -> List[Route]:
+        """
+        routes of the ids in one request, the ids without route are ignored
+        """
+        raise NotImplementedError()
+
     def get_general_info(self) -> Optional[dict]:
         """
         Returns the number of routes in base, the name and
@@ -0,0 +1,153 @@
+import logging
+import threading
+from datetime import date
+from typing import Callable, Dict, List, Optional
+
+from prediction.domain import model_cache, route, training_load
+from prediction.domain.predict import BatchPredict
+from prediction.domain.training_load import TrainingLoad
+
+
+class RoutePrediction:
+    """
+    Predictions of a route in both virtual_ride modes, computed in advance by the champion.
+    They are valid the day they were computed (the features of the athlete depend on the date),
+    while the model which computed them is the champion and while no activity is added to the ledger.
+    """
+
+    def __init__(self, route_id: int, athlete_id: int, model_id: str, date_: str, predictions: Dict[str, Dict],
+                 training_load_version: Optional[Dict] = None):
+        """
+        predictions : prediction of get_prediction by virtual_ride mode ('true' / 'false')
+        training_load_version : version of the ledger of the athlete used, None without ledger
+        """
+        self.route_id = route_id
+        self.athlete_id = athlete_id
+        self.model_id = model_id
+        self.date = date_
+        self.predictions = predictions
+        self.training_load_version = training_load_version
+
+    @staticmethod
+    def mode(virtual_ride: bool) -> str:
+        return 'true' if virtual_ride else 'false'
+
+    def get(self, virtual_ride: bool) -> Optional[Dict]:
+        return self.predictions.get(self.mode(virtual_ride))
+
+    @staticmethod
+    def version_of(training_load_: Optional[TrainingLoad]) -> Optional[Dict]:
+        return training_load_.version() if training_load_ is not None else None
+
+    def is_valid(self, model_id, training_load_: Optional[TrainingLoad]) -> bool:
+        """
+        training_load_ : current ledger of the athlete
+        """
+        return str(self.model_id) == str(model_id) and self.date == date.today().isoformat() \
+            and getattr(self, 'training_load_version', None) == self.version_of(training_load_)
+
+
+class RoutePredictionRepository:
+
+    def get(self, route_id) -> Optional[RoutePrediction]:
+        """
+        None if the route was not predicted
+        """
+        raise NotImplementedError()
+
+    def get_all(self) -> List[RoutePrediction]:
+        raise NotImplementedError()
+
+    def save_all(self, route_predictions: List[RoutePrediction]) -> None:
+        raise NotImplementedError()
+
+    def delete_recreates_index(self) -> None:
+        raise NotImplementedError()
+
+
+repository: RoutePredictionRepository
+
+
+class SerialRuns:
+    """
+    Runs of a computation one at a time : a run asked while another one is running is not started,
+    the running one computes again once finished. The last results stored are then the ones of the last data,
+    an older run can not overwrite them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.requested = False
+
+    def run(self, function: Callable[[], int]) -> int:
+        """
+        Returns the result of the last computation, 0 if the running one will do it
+        """
+        with self.lock:
+            if self.running:
+                self.requested = True
+                return 0
+            self.running = True
+        try:
+            while True:
+                with self.lock:
+                    self.requested = False
+                result = function()
+                with self.lock:
+                    if not self.requested:
+                        self.running = False
+                        return result
+                logging.info('Computed again with the data changed during the run')
+        except Exception:
+            with self.lock:
+                self.running = False
+            raise
+
+
+serial_runs = SerialRuns()
+
+
+def predict_all_routes(progress: Optional[Callable[[str, float], None]] = None) -> int:
+    """
+    Predictions of all the routes by the champion, stored so that they are read without computation.
+    The routes of an athlete are predicted with one call of the model (see BatchPredict).
+    The jobs run one at a time (see SerialRuns).
+    Returns the number of routes predicted
+    """
+    return serial_runs.run(lambda: predict_and_store(progress))
+
+
+def predict_and_store(progress: Optional[Callable[[str, float], None]] = None) -> int:
+    progress = progress or (lambda stage, percent: None)
+    progress('loading champion', 0)
+    champion = model_cache.cache.get_champion()
+    if champion is None:
+        return 0
+    model_, _ = champion
+
+    progress('loading routes', 10)
+    routes_by_athlete = {}
+    for route_ in route.repository.get_all_desc() or []:
+        routes_by_athlete.setdefault(route_.athlete_id, []).append(route_)
+
+    route_predictions = []
+    for done, (athlete_id, routes) in enumerate(routes_by_athlete.items()):
+        progress('predicting routes', 10 + (done * 80) / len(routes_by_athlete))
+        training_load_ = training_load.repository.get(athlete_id)
+        batch_predict = BatchPredict(model=model_, routes=routes, training_load_=training_load_)
+        today = date.today().isoformat()
+        predictions_by_route = {}
+        for prediction in batch_predict.get_predictions():
+            predictions_by_route.setdefault(prediction.pop('route_id'), {})[
+                RoutePrediction.mode(prediction.pop('virtual_ride'))] = prediction
+        route_predictions.extend(
+            RoutePrediction(route_id, athlete_id, model_.id, today, predictions,
+                            training_load_version=RoutePrediction.version_of(training_load_))
+            for route_id, predictions in predictions_by_route.items()
+        )
+
+    progress('storing predictions', 90)
+    repository.save_all(route_predictions)
+    logging.info(f'{len(route_predictions)} routes predicted by the model {model_.id}')
+    return len(route_predictions)
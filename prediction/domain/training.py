@@ -0,0 +1,153 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Callable
+
+import numpy as np
+from sklearn.metrics import mean_absolute_percentage_error
+
+from prediction.domain import model
+from prediction.domain.dataset import Dataset
+from prediction.domain.model import Model, TypeModel
+from prediction.domain.profiler import Profiler
+
+
+def fit_predict(estimator, x_train: np.ndarray, y_train: np.ndarray, x_test: np.ndarray):
+    """
+    Fit of an estimator in a worker process.
+    Returns the fitted estimator, its predictions on the test set and the measures of the fit
+    """
+    profiler = Profiler()
+    with profiler.stage('fit_predict', rows_in=len(x_train)) as stage:
+        estimator.fit(x_train, y_train)
+        y_pred = estimator.predict(x_test)
+        stage['rows_out'] = len(y_pred)
+    return estimator, y_pred, profiler.stages[0]
+
+
+class Training:
+    """
+    Training of all the types of models on the same data :
+    the activities are loaded and prepared once, then the models
+    are fitted at the same time in a pool of processes.
+
+    The incremental training (update) continues the boosting of the last XGBoost model
+    on the segments of the activities added since its training.
+    """
+    # rounds of boosting added by an incremental training
+    incremental_rounds = int(os.getenv("INCREMENTAL_ROUNDS", 20))
+    # relative increase of the MAPE on the new segments above which all the models are trained again
+    drift_threshold = float(os.getenv("DRIFT_THRESHOLD", 0.2))
+
+    def __init__(self, type_models: Optional[List[TypeModel]] = None, workers: Optional[int] = None,
+                 dataset_: Optional[Dataset] = None):
+        """
+        workers : number of models fitted at the same time,
+        TRAINING_WORKERS env variable or one per type of model by default.
+        The cpus are shared between the workers.
+        """
+        self.type_models = type_models or list(TypeModel)
+        cpus = os.cpu_count() or 1
+        self.workers = workers or int(os.getenv("TRAINING_WORKERS", min(len(self.type_models), cpus)))
+        self.threads_per_job = max(1, cpus // self.workers)
+        self.dataset = dataset_
+
+    def run(self, progress: Optional[Callable[[str, float], None]] = None) -> List[Model]:
+        """
+        progress : called with the stage and the percentage done
+        """
+        progress = progress or (lambda stage, percent: None)
+        start_train = time.perf_counter()
+        progress('loading activities', 0)
+        dataset_ = self.dataset or Dataset.load()
+
+        progress('preparing data', 10)
+        first_model = Model(model=self.type_models[0], dataset_=dataset_)
+        x_train, y_train, x_test, y_test = first_model.prepare_data()
+        models = [first_model] + [first_model.copy_for(type_model) for type_model in self.type_models[1:]]
+        preparation_time = time.perf_counter() - start_train
+        logging.info(f'Training - data prepared in {round(preparation_time, 2)}s, '
+                     f'{len(models)} models fitted with {self.workers} workers '
+                     f'of {self.threads_per_job} threads')
+
+        progress('fitting models', 30)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(fit_predict,
+                                model_.model.new_estimator(n_jobs=self.threads_per_job),
+                                x_train,
+                                y_train,
+                                x_test)
+                for model_ in models
+            ]
+            results = []
+            for future in futures:
+                results.append(future.result())
+                progress('fitting models', 30 + (len(results) * 60) / len(futures))
+
+        progress('saving models', 90)
+        for model_, (estimator, y_pred, fit_stage) in zip(models, results):
+            model_.profile.append(fit_stage)
+            model_.end_training(estimator, y_test, y_pred, preparation_time + fit_stage['wall_seconds'])
+            model.repository.save(model_)
+
+        return models
+
+    def update(self, progress: Optional[Callable[[str, float], None]] = None) -> List[Model]:
+        """
+        Incremental training of the last XGBoost model trained.
+        Full training (run) when there is no such model, when the features changed
+        or when the error of the model on the new segments drifted.
+        Returns the new models, none if no activity was added since the last XGBoost model.
+        """
+        progress = progress or (lambda stage, percent: None)
+        start_train = time.perf_counter()
+        previous = model.repository.get_last_trained('XGBRegressor')
+        if previous is None or getattr(previous, 'data_version', None) is None \
+                or getattr(previous, 'test_days', None) is None:
+            logging.info('Training - no XGBoost model with a data version and its test days, full training')
+            return self.run(progress)
+
+        progress('loading activities', 0)
+        dataset_ = self.dataset or Dataset.load()
+        if dataset_.version()['last_activity_id'] == previous.data_version['last_activity_id']:
+            logging.info(f'Training - no new activity since {previous.data_version}')
+            return []
+
+        progress('preparing data', 10)
+        model_ = Model(model=TypeModel.XGB, dataset_=dataset_)
+        x_new, y_new, x_test, y_test = model_.prepare_data(since=previous.data_version,
+                                                             test_days=previous.test_days)
+        if model_.features_train != previous.features_train or model_.processing != previous.processing:
+            logging.info('Training - features of the model changed, full training')
+            return self.run(progress)
+        if len(y_new) == 0:
+            logging.info('Training - no new segment in the train set')
+            return []
+
+        previous_estimator = previous.load_estimator()
+        y_new_label = np.exp(y_new) if "log_label" in model_.processing else y_new
+        mape_new = mean_absolute_percentage_error(y_new_label, previous.predict(previous_estimator, x_new))
+        logging.info(f'Training - MAPE of the model {previous.id} on {len(y_new)} new segments : '
+                     f'{round(mape_new, 4)} (at training : {round(previous.mape, 4)})')
+        if mape_new > previous.mape * (1 + self.drift_threshold):
+            logging.info(f'Training - drift above {self.drift_threshold}, full training')
+            return self.run(progress)
+
+        progress('fitting models', 30)
+        estimator = TypeModel.XGB.new_estimator(n_jobs=os.cpu_count(), params=getattr(previous, 'params', None))
+        estimator.set_params(n_estimators=self.incremental_rounds)
+        with Profiler(model_.profile).stage('fit_predict', rows_in=len(x_new)) as stage:
+            estimator.fit(x_new, y_new, xgb_model=previous_estimator.get_booster())
+            y_pred = estimator.predict(x_test)
+            stage['rows_out'] = len(y_pred)
+        logging.info(f'Training - {self.incremental_rounds} rounds added in {stage["wall_seconds"]}s')
+
+        progress('saving models', 90)
+        model_.training_mode = 'incremental'
+        model_.parent_id = str(previous.id)
+        model_.params = dict(getattr(previous, 'params', {}))
+        model_.end_training(estimator, y_test, y_pred, time.perf_counter() - start_train)
+        model.repository.save(model_)
+        return [model_]
@@ -0,0 +1,124 @@
+from datetime import date, datetime, timedelta
+from statistics import mean
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prediction.domain.activity import Activity
+
+
+def day_of(start_date_local: str) -> str:
+    """
+    day of a start_date_local of Strava, as YYYY-MM-DD
+    """
+    return start_date_local[:10]
+
+
+class TrainingLoad:
+    """
+    Ledger of the training load of an athlete, by day :
+    time of the activities, their average speeds, sum and number of the climb categories of the segments.
+    It is updated when activities are imported, the features of the last 30 days of a prediction
+    are read from the 31 days before it instead of from all the activities.
+    The values are the ones computed from the Dataset for the training :
+    the average speeds are kept (one or two by day) so that their mean is the same.
+    """
+
+    def __init__(self, athlete_id: int, days: Optional[Dict[str, Dict]] = None,
+                 activity_ids: Optional[List[int]] = None, last_activity_date: Optional[str] = None):
+        self.athlete_id = athlete_id
+        self.days = days or {}
+        # an activity is counted once, even if it is imported again
+        self.activity_ids = set(activity_ids or [])
+        self.last_activity_date = last_activity_date
+
+    @classmethod
+    def from_activities(cls, athlete_id: int, activities: Iterable[Activity]) -> 'TrainingLoad':
+        training_load = cls(athlete_id)
+        for activity_ in activities:
+            if activity_.athlete_id == athlete_id:
+                training_load.add_activity(activity_)
+        return training_load
+
+    def add_activity(self, activity_: Activity) -> bool:
+        """
+        Returns False if the activity was already in the ledger
+        """
+        if activity_.id in self.activity_ids:
+            return False
+        self.activity_ids.add(activity_.id)
+
+        activity_day = self.get_day(day_of(activity_.start_date_local))
+        activity_day['elapsed_time'] += activity_.elapsed_time
+        activity_day['average_speeds'].append(activity_.average_speed)
+        for segment in activity_.segment_efforts:
+            segment_day = self.get_day(day_of(segment.start_date_local))
+            segment_day['climb_category'] += segment.climb_category
+            segment_day['segments'] += 1
+
+        if self.last_activity_date is None or day_of(activity_.start_date_local) > self.last_activity_date:
+            self.last_activity_date = day_of(activity_.start_date_local)
+        return True
+
+    def version(self) -> Dict:
+        """
+        Version of the ledger : number of activities and day of the last one,
+        the features of the athlete are the same while it does not change
+        """
+        return {'activities': len(self.activity_ids), 'last_activity_date': self.last_activity_date}
+
+    def get_day(self, day: str) -> Dict:
+        if day not in self.days:
+            self.days[day] = {'elapsed_time': 0, 'average_speeds': [], 'climb_category': 0, 'segments': 0}
+        return self.days[day]
+
+    def last_30d(self, date_: date) -> List[Dict]:
+        """
+        days of the ledger in the 30 days before the date (the date itself excluded),
+        the same window as dataset.last_30d_bounds
+        """
+        days = [(date_ - timedelta(days=offset)).isoformat() for offset in range(1, 32)]
+        return [self.days[day] for day in days if day in self.days]
+
+    def time_activities_last_30d(self, date_: date) -> float:
+        return round(sum(day['elapsed_time'] for day in self.last_30d(date_)) / 60, 2)
+
+    def average_speed_last_30d(self, date_: date) -> float:
+        average_speeds = [speed for day in self.last_30d(date_) for speed in day['average_speeds']]
+        return round(mean(average_speeds), 2) if average_speeds else 0
+
+    def average_climb_cat_last_30d(self, date_: date) -> float:
+        days = self.last_30d(date_)
+        segments = sum(day['segments'] for day in days)
+        return round(sum(day['climb_category'] for day in days) / segments, 2) if segments else 0
+
+    def days_since_last_activity(self, date_: date) -> Optional[int]:
+        if self.last_activity_date is None:
+            return None
+        return (date_ - datetime.strptime(self.last_activity_date, '%Y-%m-%d').date()).days
+
+
+class TrainingLoadRepository:
+
+    def get(self, athlete_id) -> Optional[TrainingLoad]:
+        """
+        None if there is no ledger for the athlete
+        """
+        raise NotImplementedError()
+
+    def get_with_version(self, athlete_id) -> Tuple[Optional[TrainingLoad], Optional[Dict]]:
+        """
+        ledger of the athlete and the version of its document, (None, None) if there is none
+        """
+        raise NotImplementedError()
+
+    def save_if_unchanged(self, training_load: TrainingLoad, version: Optional[Dict]) -> bool:
+        """
+        Stores the ledger only if its document is still at the version read (created if version is None).
+        Returns False if another process wrote it in the meantime
+        """
+        raise NotImplementedError()
+
+    def delete_recreates_index(self) -> None:
+        raise NotImplementedError()
+
+
+repository: TrainingLoadRepository
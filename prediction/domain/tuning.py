@@ -0,0 +1,220 @@
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import mean
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.metrics import mean_absolute_percentage_error
+from sklearn.model_selection import GroupKFold, GroupShuffleSplit, ParameterGrid, ParameterSampler
+
+from prediction.domain import model
+from prediction.domain.dataset import Dataset
+from prediction.domain.model import Model, TypeModel
+from prediction.domain.profiler import Profiler
+
+# train set and folds (fit, early stopping and validation indices) of a worker process,
+# sent once when the process starts and shared by all the candidates evaluated in it
+_x_train: Optional[np.ndarray] = None
+_y_train: Optional[np.ndarray] = None
+_folds: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+
+def init_worker(x_train: np.ndarray, y_train: np.ndarray,
+                folds: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+    global _x_train, _y_train, _folds
+    _x_train, _y_train, _folds = x_train, y_train, folds
+
+
+def fit_fold(type_model_name: str, params: dict, fold: int, log_label: bool,
+             early_stopping_rounds: int) -> Tuple[float, Optional[int]]:
+    """
+    Fit of a candidate on the train part of a fold in a worker process.
+    XGBoost is fitted on the train part without its early stopping days, evaluated on them :
+    the validation part is never seen before its MAPE is measured.
+    Returns the MAPE on the validation part and, for XGBoost, the best iteration found by the early stopping
+    """
+    # the members of TypeModel are pickled by value, an estimator, and can not be found back
+    type_model = TypeModel[type_model_name]
+    fit_index, early_stopping_index, validation_index = _folds[fold]
+    x_validation, y_validation = _x_train[validation_index], _y_train[validation_index]
+
+    estimator = type_model.new_estimator(n_jobs=1, params=params)
+    best_iteration = None
+    if type_model is TypeModel.XGB and len(early_stopping_index):
+        x_train, y_train = _x_train[fit_index], _y_train[fit_index]
+        fit_params = {'eval_set': [(_x_train[early_stopping_index], _y_train[early_stopping_index])],
+                      'verbose': False}
+        # argument of fit up to xgboost 1.x, parameter of the estimator after
+        if 'early_stopping_rounds' in inspect.signature(estimator.fit).parameters:
+            fit_params['early_stopping_rounds'] = early_stopping_rounds
+        else:
+            estimator.set_params(early_stopping_rounds=early_stopping_rounds)
+        estimator.fit(x_train, y_train, **fit_params)
+        best_iteration = estimator.best_iteration
+    else:
+        train_index = np.concatenate([fit_index, early_stopping_index])
+        estimator.fit(_x_train[train_index], _y_train[train_index])
+
+    y_pred = estimator.predict(x_validation)
+    if log_label:
+        y_validation, y_pred = np.exp(y_validation), np.exp(y_pred)
+    return mean_absolute_percentage_error(y_validation, y_pred), best_iteration
+
+
+class Tuning:
+    """
+    Search of the hyperparameters of the types of models by cross validation.
+    The folds group the segments by calendar day, as the split train/test does.
+    The data is prepared once and sent once to each worker process,
+    all the fits (candidates x folds) are run on all the cpus.
+    """
+    param_grids = {
+        TypeModel.XGB: {
+            # upper bound, the number of trees is found by the early stopping
+            'n_estimators': [1000],
+            'learning_rate': [0.03, 0.1, 0.3],
+            'max_depth': [3, 5, 7, 9],
+            'min_child_weight': [1, 5, 10],
+            'subsample': [0.7, 1.0],
+            'colsample_bytree': [0.7, 1.0]
+        },
+        TypeModel.RFORREST: {
+            'n_estimators': [100, 300],
+            'max_depth': [None, 10, 20],
+            'min_samples_leaf': [1, 5, 10],
+            'max_features': [1.0, 0.5, 'sqrt']
+        }
+    }
+    early_stopping_rounds = 20
+    # part of the calendar days of the train part of a fold used for the early stopping
+    early_stopping_ratio = 0.2
+
+    def __init__(self, type_models: Optional[List[TypeModel]] = None, search: str = 'random',
+                 candidates: Optional[int] = None, folds: Optional[int] = None,
+                 workers: Optional[int] = None, dataset_: Optional[Dataset] = None):
+        """
+        search : 'grid' for all the combinations of the grids,
+        'random' for a sample of candidates combinations (TUNING_CANDIDATES env variable, 20 by default)
+        folds : number of folds, TUNING_FOLDS env variable or 5 by default
+        workers : number of fits at the same time, one per cpu by default
+        """
+        if search not in ('grid', 'random'):
+            raise ValueError(f"search must be 'grid' or 'random', not {search}")
+        self.type_models = type_models or list(TypeModel)
+        self.search = search
+        self.candidates = candidates or int(os.getenv("TUNING_CANDIDATES", 20))
+        self.folds = folds or int(os.getenv("TUNING_FOLDS", 5))
+        self.workers = workers or os.cpu_count() or 1
+        self.dataset = dataset_
+
+    def get_candidates(self, type_model: TypeModel) -> List[dict]:
+        grid = self.param_grids[type_model]
+        if self.search == 'grid':
+            return list(ParameterGrid(grid))
+        return list(ParameterSampler(grid, n_iter=min(self.candidates, len(ParameterGrid(grid))), random_state=42))
+
+    def split_folds(self, model_: Model, x_train: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Folds of the train set of the prepared model, the segments of a calendar day in the same part :
+        indices of the fit, of the early stopping and of the validation
+        """
+        calendar_day = model_.segments['start_date'].dt.strftime('%j%Y').to_numpy()
+        groups = calendar_day[~model_.is_test_set(model_.test_ratio)]
+        folds = []
+        for train_index, validation_index in GroupKFold(n_splits=min(self.folds, len(np.unique(groups)))) \
+                .split(x_train, groups=groups):
+            if len(np.unique(groups[train_index])) < 2:
+                folds.append((train_index, train_index[:0], validation_index))
+                continue
+            split = GroupShuffleSplit(n_splits=1, test_size=self.early_stopping_ratio, random_state=42)
+            fit, early_stopping = next(split.split(train_index, groups=groups[train_index]))
+            folds.append((train_index[fit], train_index[early_stopping], validation_index))
+        return folds
+
+    def run(self, progress: Optional[Callable[[str, float], None]] = None) -> List[Model]:
+        """
+        progress : called with the stage and the percentage done
+        Returns the models trained on the whole train set with the best params found
+        """
+        progress = progress or (lambda stage, percent: None)
+        start_tuning = time.perf_counter()
+        progress('loading activities', 0)
+        dataset_ = self.dataset or Dataset.load()
+
+        progress('preparing data', 5)
+        first_model = Model(model=self.type_models[0], dataset_=dataset_)
+        x_train, y_train, x_test, y_test = first_model.prepare_data()
+        models = [first_model] + [first_model.copy_for(type_model) for type_model in self.type_models[1:]]
+
+        folds = self.split_folds(first_model, x_train)
+        log_label = "log_label" in first_model.processing
+
+        candidates = {model_.model: self.get_candidates(model_.model) for model_ in models}
+        scores = {(type_model, index): [] for type_model, params in candidates.items() for index in range(len(params))}
+        logging.info(f'Tuning - {self.search} search of {sum(len(params) for params in candidates.values())} '
+                     f'candidates on {len(folds)} folds of {len(y_train)} segments with {self.workers} workers')
+
+        progress('cross validation', 10)
+        cv_profiler = Profiler()
+        with cv_profiler.stage('cross_validation', rows_in=len(y_train)):
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     initializer=init_worker,
+                                     initargs=(x_train, y_train, folds)) as executor:
+                futures = {
+                    executor.submit(fit_fold, type_model.name, params, fold, log_label, self.early_stopping_rounds):
+                        (type_model, index)
+                    for type_model, params_list in candidates.items()
+                    for index, params in enumerate(params_list)
+                    for fold in range(len(folds))
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    scores[futures[future]].append(future.result())
+                    progress('cross validation', 10 + (done * 70) / len(futures))
+        cv_time = time.perf_counter() - start_tuning
+
+        progress('fitting models', 80)
+        for model_ in models:
+            type_model = model_.model
+            index, cv_mape = self.best_candidate(type_model, scores)
+            params = dict(candidates[type_model][index])
+            best_iterations = [best_iteration for _, best_iteration in scores[(type_model, index)]
+                               if best_iteration is not None]
+            if best_iterations:
+                params['n_estimators'] = int(mean(best_iterations)) + 1
+
+            model_.params = params
+            model_.tuning = {
+                'search': self.search,
+                'candidates': len(candidates[type_model]),
+                'folds': len(folds),
+                'cv_mape': cv_mape,
+                'cv_time': round(cv_time, 2)
+            }
+            # the fits of the cross validation are in the worker processes, only their wall time is measured
+            model_.profile.extend(cv_profiler.stages)
+            estimator = type_model.new_estimator(n_jobs=self.workers, params=params)
+            with Profiler(model_.profile).stage('fit_predict', rows_in=len(x_train)) as stage:
+                estimator.fit(x_train, y_train)
+                y_pred = estimator.predict(x_test)
+                stage['rows_out'] = len(y_pred)
+            model_.training_mode = 'tuning'
+            model_.end_training(estimator, y_test, y_pred, cv_time + stage['wall_seconds'])
+            model.repository.save(model_)
+
+        return models
+
+    @staticmethod
+    def best_candidate(type_model: TypeModel, scores: Dict[Tuple[TypeModel, int], list]) -> Tuple[int, float]:
+        """
+        index of the candidate with the best mean MAPE on the folds, and this MAPE
+        """
+        cv_mapes = {
+            index: mean(mape for mape, _ in fold_scores)
+            for (type_model_, index), fold_scores in scores.items()
+            if type_model_ is type_model
+        }
+        index = min(cv_mapes, key=cv_mapes.get)
+        return index, float(cv_mapes[index])
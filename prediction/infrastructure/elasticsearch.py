@@ -1,14 +1,17 @@
 import json
 import logging
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Iterator, Tuple
 
 import elasticsearch
+import elasticsearch.helpers
 import jsonpickle
 
 from prediction.domain.activity import Activity, ActivityRepository
 from prediction.domain.athlete import Athlete, AthleteRepository
 from prediction.domain.model import Model, ModelRepository
 from prediction.domain.route import Route, RouteRepository
+from prediction.domain.route_prediction import RoutePrediction, RoutePredictionRepository
+from prediction.domain.training_load import TrainingLoad, TrainingLoadRepository
 from prediction.utils.functions import transforms_string_in_datetime
 
 
@@ -18,6 +21,69 @@ def read(obj):
     return obj
 
 
+class RouteHandler(jsonpickle.handlers.BaseHandler):
+    """
+    The geometry of a Route (gpx and points of the segmentation) is stored
+    encoded in the gpx_encoded and segmentation_encoded fields, not indexed by Elastic.
+    It is decoded by the Route only when it is accessed.
+    Documents saved before the encoding, with gpx and segmentation, are still read.
+    """
+
+    def flatten(self, obj: Route, data: dict) -> dict:
+        for key, value in obj.__dict__.items():
+            if not key.startswith('_'):
+                data[key] = self.context.flatten(value, reset=False)
+        # a route without gpx or segmentation is stored without the field
+        if obj.get_gpx_encoded() is not None:
+            data['gpx_encoded'] = obj.get_gpx_encoded()
+        if obj.get_segmentation_encoded() is not None:
+            data['segmentation_encoded'] = obj.get_segmentation_encoded()
+        return data
+
+    def restore(self, data: dict) -> Route:
+        route = Route.__new__(Route)
+        for key, value in data.items():
+            if not key.startswith('py/') and key not in ('gpx', 'segmentation', 'gpx_encoded', 'segmentation_encoded'):
+                setattr(route, key, self.context.restore(value, reset=False))
+
+        if 'gpx_encoded' in data:
+            route.set_gpx_encoded(data['gpx_encoded'])
+        else:
+            route.gpx = self.context.restore(data.get('gpx'), reset=False)
+
+        if 'segmentation_encoded' in data:
+            route.set_segmentation_encoded(data['segmentation_encoded'])
+        else:
+            route.segmentation = self.context.restore(data.get('segmentation'), reset=False)
+        return route
+
+
+RouteHandler.handles(Route)
+
+
+class TrainingLoadHandler(jsonpickle.handlers.BaseHandler):
+    """
+    The ids of the activities of a TrainingLoad, a set, are stored as a sorted list
+    """
+
+    def flatten(self, obj: TrainingLoad, data: dict) -> dict:
+        for key, value in obj.__dict__.items():
+            data[key] = self.context.flatten(value, reset=False)
+        data['activity_ids'] = sorted(obj.activity_ids)
+        return data
+
+    def restore(self, data: dict) -> TrainingLoad:
+        training_load = TrainingLoad.__new__(TrainingLoad)
+        for key, value in data.items():
+            if not key.startswith('py/'):
+                setattr(training_load, key, self.context.restore(value, reset=False))
+        training_load.activity_ids = set(data.get('activity_ids') or [])
+        return training_load
+
+
+TrainingLoadHandler.handles(TrainingLoad)
+
+
 class Elasticsearch:
     es_logger = logging.getLogger('elasticsearch')
     es_logger.setLevel(logging.WARNING)
@@ -30,11 +96,19 @@ class Elasticsearch:
             hosts = [{"host": 'elasticsearch', "port": 9200}]
         self.database = elasticsearch.Elasticsearch(hosts=hosts)
 
-    def add_index(self, index: str):
+    def add_index(self, index: str, mappings: Optional[dict] = None):
         try:
-            self.database.indices.create(index=index)
+            if mappings is not None:
+                self.database.indices.create(index=index, body={"mappings": mappings})
+            else:
+                self.database.indices.create(index=index)
         except elasticsearch.exceptions.RequestError:
-            pass
+            # index already exists, new fields can still be added to its mapping
+            if mappings is not None:
+                try:
+                    self.database.indices.put_mapping(index=index, body=mappings)
+                except elasticsearch.exceptions.RequestError:
+                    logging.warning(f'Mapping of {index} could not be updated')
 
     def store_data(self, data, index_name, id_data=None):
         if id_data is not None:
@@ -50,6 +124,31 @@ class Elasticsearch:
             )
         return es_object.get('_id')
 
+    def search_by_id_with_version(self, index_name, id_data) -> Optional[dict]:
+        """
+        document with its _seq_no and _primary_term, None if it does not exist
+        """
+        try:
+            return self.database.get(index=index_name, id=id_data)
+        except elasticsearch.exceptions.NotFoundError:
+            return None
+
+    def store_data_if_unchanged(self, data, index_name, id_data, seq_no=None, primary_term=None) -> bool:
+        """
+        Optimistic concurrency control : the document is created if seq_no is None,
+        otherwise replaced only if it was not modified since it was read.
+        Returns False if another process wrote it in the meantime.
+        """
+        try:
+            if seq_no is None:
+                self.database.create(index=index_name, id=id_data, body=data, refresh=True)
+            else:
+                self.database.index(index=index_name, id=id_data, body=data, refresh=True,
+                                    if_seq_no=seq_no, if_primary_term=primary_term)
+        except elasticsearch.exceptions.ConflictError:
+            return False
+        return True
+
     def update_data(self, index_name, id_data, body):
         self.database.update(index=index_name,
                              id=id_data,
@@ -65,12 +164,23 @@ class Elasticsearch:
         self.database.indices.refresh(index_name)
         return self.database.cat.count(index_name, params={"format": "json"})
 
-    def search_with_query(self, index_name, query: dict):
+    def search_with_query(self, index_name, query: dict, size: int = 2000):
         return self.database.search(
             index=index_name,
-            size=2000,
+            size=size,
             body=query)
 
+    def scan_with_query(self, index_name, query: dict, size: int = 500) -> Iterator[dict]:
+        """
+        all the hits of the query, read by pages of size hits, in the order of the sort of the query
+        """
+        return elasticsearch.helpers.scan(
+            self.database,
+            index=index_name,
+            query=query,
+            size=size,
+            preserve_order=True)
+
     def search_index(self, index_name):
         return self.database.search(
             index=index_name,
@@ -78,12 +188,29 @@ class Elasticsearch:
             body={"query": {"match_all": {}}}
         )
 
-    def search_by_id(self, index_name, id_data):
-        return self.database.get(index=index_name, id=id_data)
+    def search_by_id(self, index_name, id_data, excludes: Optional[List[str]] = None):
+        return self.database.get(index=index_name, id=id_data, _source_excludes=excludes)
 
-    def delete_recreates_index(self, index_name):
+    def store_bulk(self, documents: Dict, index_name) -> None:
+        """
+        documents by id, stored with one request
+        """
+        actions = [
+            {"_index": index_name, "_id": id_data, "_source": data}
+            for id_data, data in documents.items()
+        ]
+        elasticsearch.helpers.bulk(self.database, actions, refresh=True)
+
+    def search_by_ids(self, index_name, ids_data: List) -> List[dict]:
+        """
+        sources of the documents found, in the order of the ids
+        """
+        result = self.database.mget(index=index_name, body={"ids": [str(id_data) for id_data in ids_data]})
+        return [doc.get("_source") for doc in result.get("docs") if doc.get("found")]
+
+    def delete_recreates_index(self, index_name, mappings: Optional[dict] = None):
         self.database.indices.delete(index=index_name)
-        self.add_index(index=index_name)
+        self.add_index(index=index_name, mappings=mappings)
 
     def ping(self):
         return self.database.ping()
@@ -110,6 +237,9 @@ class ElasticActivityRepository(ActivityRepository):
         return activity
 
     def get_all_desc(self) -> List[Activity]:
+        return [activity_ for activities in self.get_chunks_desc() for activity_ in activities]
+
+    def get_chunks_desc(self, chunk_size: int = 500) -> Iterator[List[Activity]]:
         query = {
             "query": {
                 "match_all": {}
@@ -118,23 +248,41 @@ class ElasticActivityRepository(ActivityRepository):
                 {"start_date_local": "desc"}
             ]
         }
-        results = self.elastic.search_with_query(
+        hits = self.elastic.scan_with_query(
             index_name=self.index,
-            query=query
+            query=query,
+            size=chunk_size
         )
-        activities = [
-            jsonpickle.decode((read(hit.get("_source"))))
-            for hit in results.get("hits").get("hits")]
-        return activities
+        activities = []
+        for hit in hits:
+            activities.append(jsonpickle.decode(read(hit.get("_source"))))
+            if len(activities) == chunk_size:
+                yield activities
+                activities = []
+        if activities:
+            yield activities
 
     def get_general_info(self) -> Dict:
         if not self.is_empty():
-            activities = self.get_all_desc()
-            last_activity = activities[0]
-            activities_in_base = len(activities)
-            name_last_activity = last_activity.name
+            activities_in_base = int(self.elastic.get_index_docs_count(self.index)[0].get("count"))
+            query = {
+                "query": {
+                    "match_all": {}
+                },
+                "sort": [
+                    {"start_date_local": "desc"}
+                ],
+                "_source": ["name", "start_date_local"]
+            }
+            results = self.elastic.search_with_query(
+                index_name=self.index,
+                query=query,
+                size=1
+            )
+            last_activity = results.get("hits").get("hits")[0].get("_source")
+            name_last_activity = last_activity.get("name")
             date_last_activity = transforms_string_in_datetime(
-                last_activity.start_date_local)
+                last_activity.get("start_date_local"))
         else:
             activities_in_base = None
             name_last_activity = None
@@ -216,10 +364,18 @@ class ElasticAthleteRepository(AthleteRepository):
 
 class ElasticRouteRepository(RouteRepository):
     index = "index_route"
+    # encoded geometry and features, stored but not indexed
+    mappings = {
+        "properties": {
+            "gpx_encoded": {"type": "object", "enabled": False},
+            "segmentation_encoded": {"type": "object", "enabled": False},
+            "features": {"type": "object", "enabled": False}
+        }
+    }
 
     def __init__(self, local_connect: bool):
         self.elastic = Elasticsearch(local_connect=local_connect)
-        self.elastic.add_index(self.index)
+        self.elastic.add_index(self.index, mappings=self.mappings)
 
     def is_empty(self) -> bool:
         result = self.elastic.get_index_docs_count(self.index)
@@ -244,15 +400,21 @@ class ElasticRouteRepository(RouteRepository):
                     {"created_at": "desc"}
                 ]
             }
-            results = self.elastic.search_with_query(
+            hits = self.elastic.scan_with_query(
                 index_name=self.index,
                 query=query
             )
             routes = [
                 jsonpickle.decode((read(hit.get("_source"))))
-                for hit in results.get("hits").get("hits")]
+                for hit in hits]
             return routes
 
+    def get_by_ids(self, ids: List) -> List[Route]:
+        if not ids:
+            return []
+        return [jsonpickle.decode(read(source))
+                for source in self.elastic.search_by_ids(index_name=self.index, ids_data=ids)]
+
     def get_general_info(self) -> Dict:
         if not self.is_empty():
             routes = self.get_all_desc()
@@ -286,15 +448,21 @@ class ElasticRouteRepository(RouteRepository):
         )
 
     def delete_recreates_index(self) -> None:
-        return self.elastic.delete_recreates_index(self.index)
+        return self.elastic.delete_recreates_index(self.index, mappings=self.mappings)
 
 
 class ElasticModelRepository(ModelRepository):
     index = "index_model"
+    # training data embedded in the documents of the models trained before the lean documents
+    excludes = ["activities", "segments"]
+    # pointer to the champion, the model with the best MAPE
+    champion_index = "index_champion"
+    champion_id = "champion"
 
     def __init__(self, local_connect: bool):
         self.elastic = Elasticsearch(local_connect=local_connect)
         self.elastic.add_index(self.index)
+        self.elastic.add_index(self.champion_index)
 
     def is_empty(self) -> bool:
         result = self.elastic.get_index_docs_count(self.index)
@@ -305,7 +473,8 @@ class ElasticModelRepository(ModelRepository):
 
     def get(self, id_) -> Model:
         result = self.elastic.search_by_id(index_name=self.index,
-                                           id_data=id_)
+                                           id_data=id_,
+                                           excludes=self.excludes)
         model = jsonpickle.decode(read(result.get("_source")))
         return model
 
@@ -313,29 +482,37 @@ class ElasticModelRepository(ModelRepository):
         query = {
             "query": {
                 "match_all": {}
-            }
+            },
+            "_source": {"excludes": self.excludes}
         }
-        results = self.elastic.search_with_query(
+        hits = self.elastic.scan_with_query(
             index_name=self.index,
             query=query
         )
-        activities = [
+        models = [
             jsonpickle.decode((read(hit.get("_source"))))
-            for hit in results.get("hits").get("hits")]
-        return activities
+            for hit in hits]
+        return models
 
     def get_general_info(self) -> Optional[dict]:
         if not self.is_empty():
-            models = self.get_all()
-            for model_ in models:
-                model_.training_date = transforms_string_in_datetime(model_.training_date)
-
-            models = sorted(models, key=lambda model_: model_.training_date, reverse=True)
-            last_model_trained = models[0]
-
-            models_in_base = len(models)
-            date_last_model = last_model_trained.training_date
-
+            models_in_base = int(self.elastic.get_index_docs_count(self.index)[0].get("count"))
+            query = {
+                "query": {
+                    "match_all": {}
+                },
+                "sort": [
+                    {"training_date": "desc"}
+                ],
+                "_source": ["training_date"]
+            }
+            results = self.elastic.search_with_query(
+                index_name=self.index,
+                query=query,
+                size=1
+            )
+            last_model_trained = results.get("hits").get("hits")[0].get("_source")
+            date_last_model = transforms_string_in_datetime(last_model_trained.get("training_date"))
 
         else:
             models_in_base = None
@@ -346,34 +523,170 @@ class ElasticModelRepository(ModelRepository):
             'date_last_model': date_last_model
         }
 
-    def get_better_mape(self) -> Model:
-        """
-        returns the model with the best MAPE (the weakest one).
-        MAPE : Mean Absolut Percentage Error
-        """
+    def get_last_trained(self, model_name: str) -> Optional[Model]:
         query = {
             "query": {
-                "match_all": {}
+                "term": {"model.keyword": model_name}
+            },
+            "sort": [
+                {"training_date": "desc"}
+            ],
+            "_source": {"excludes": self.excludes}
+        }
+        results = self.elastic.search_with_query(
+            index_name=self.index,
+            query=query,
+            size=1
+        )
+        hits = results.get("hits").get("hits")
+        return jsonpickle.decode(read(hits[0].get("_source"))) if hits else None
+
+    def get_champion(self) -> Optional[Model]:
+        pointer = self.elastic.search_by_id_with_version(self.champion_index, self.champion_id)
+        if pointer is None:
+            # models saved before the pointer
+            return self.elect_champion()
+        model_id = pointer.get("_source").get("model_id")
+        if model_id is None:
+            # no model when the champion was elected
+            return None
+        try:
+            return self.get(model_id)
+        except elasticsearch.exceptions.NotFoundError:
+            logging.warning(f'Champion {model_id} not found in {self.index}')
+            return self.elect_champion(excluded_ids=[model_id])
+
+    def elect_champion(self, excluded_ids: List[str] = ()) -> Optional[Model]:
+        query = {
+            "query": {
+                "bool": {"must_not": {"ids": {"values": list(excluded_ids)}}}
             },
             "sort": [
                 {"mape": "asc"}
-            ]
+            ],
+            "_source": {"excludes": self.excludes}
         }
         results = self.elastic.search_with_query(
             index_name=self.index,
-            query=query
+            query=query,
+            size=1
         )
-        models = [
-            jsonpickle.decode((read(hit.get("_source"))))
-            for hit in results.get("hits").get("hits")]
-        return models[0]
+        hits = results.get("hits").get("hits")
+        champion = jsonpickle.decode(read(hits[0].get("_source"))) if hits else None
+        pointer = self.elastic.search_by_id_with_version(self.champion_index, self.champion_id)
+        self.elastic.store_data_if_unchanged(
+            data={"model_id": str(champion.id) if champion else None,
+                  "mape": champion.mape if champion else None},
+            index_name=self.champion_index,
+            id_data=self.champion_id,
+            seq_no=pointer.get("_seq_no") if pointer else None,
+            primary_term=pointer.get("_primary_term") if pointer else None
+        )
+        return champion
+
+    def update_champion(self, model: Model) -> None:
+        """
+        The pointer is replaced only if the model is better than the champion read,
+        and only if no other process replaced it since it was read.
+        """
+        while True:
+            pointer = self.elastic.search_by_id_with_version(self.champion_index, self.champion_id)
+            if pointer is not None:
+                champion_mape = pointer.get("_source").get("mape")
+                if champion_mape is not None and champion_mape <= model.mape:
+                    return
+            stored = self.elastic.store_data_if_unchanged(
+                data={"model_id": str(model.id), "mape": model.mape},
+                index_name=self.champion_index,
+                id_data=self.champion_id,
+                seq_no=pointer.get("_seq_no") if pointer else None,
+                primary_term=pointer.get("_primary_term") if pointer else None
+            )
+            if stored:
+                logging.info(f'Model {model.id} is the new champion, MAPE : {model.mape}')
+                return
 
     def save(self, model: Model):
-        return self.elastic.store_data(
+        id_ = self.elastic.store_data(
             data=jsonpickle.encode(model),
             index_name=self.index,
             id_data=model.id
         )
+        self.update_champion(model)
+        return id_
 
     def delete_recreates_index(self) -> None:
+        self.elastic.delete_recreates_index(self.champion_index)
         return self.elastic.delete_recreates_index(self.index)
+
+
+class ElasticTrainingLoadRepository(TrainingLoadRepository):
+    index = "index_training_load"
+    # days and ids of the activities of the ledger, stored but not indexed
+    mappings = {
+        "properties": {
+            "days": {"type": "object", "enabled": False},
+            "activity_ids": {"type": "object", "enabled": False}
+        }
+    }
+
+    def __init__(self, local_connect: bool):
+        self.elastic = Elasticsearch(local_connect=local_connect)
+        self.elastic.add_index(self.index, mappings=self.mappings)
+
+    def get(self, athlete_id) -> Optional[TrainingLoad]:
+        return self.get_with_version(athlete_id)[0]
+
+    def get_with_version(self, athlete_id) -> Tuple[Optional[TrainingLoad], Optional[Dict]]:
+        result = self.elastic.search_by_id_with_version(index_name=self.index, id_data=athlete_id)
+        if result is None:
+            return None, None
+        version = {"seq_no": result.get("_seq_no"), "primary_term": result.get("_primary_term")}
+        return jsonpickle.decode(read(result.get("_source"))), version
+
+    def save_if_unchanged(self, training_load: TrainingLoad, version: Optional[Dict]) -> bool:
+        return self.elastic.store_data_if_unchanged(
+            data=jsonpickle.encode(training_load),
+            index_name=self.index,
+            id_data=training_load.athlete_id,
+            seq_no=version.get("seq_no") if version else None,
+            primary_term=version.get("primary_term") if version else None
+        )
+
+    def delete_recreates_index(self) -> None:
+        return self.elastic.delete_recreates_index(self.index, mappings=self.mappings)
+
+
+class ElasticRoutePredictionRepository(RoutePredictionRepository):
+    index = "index_route_prediction"
+    # predictions and version of the ledger used stored but not indexed
+    mappings = {
+        "properties": {
+            "predictions": {"type": "object", "enabled": False},
+            "training_load_version": {"type": "object", "enabled": False}
+        }
+    }
+
+    def __init__(self, local_connect: bool):
+        self.elastic = Elasticsearch(local_connect=local_connect)
+        self.elastic.add_index(self.index, mappings=self.mappings)
+
+    def get(self, route_id) -> Optional[RoutePrediction]:
+        result = self.elastic.search_by_id_with_version(index_name=self.index, id_data=route_id)
+        if result is None:
+            return None
+        return jsonpickle.decode(read(result.get("_source")))
+
+    def get_all(self) -> List[RoutePrediction]:
+        hits = self.elastic.scan_with_query(index_name=self.index, query={"query": {"match_all": {}}})
+        return [jsonpickle.decode(read(hit.get("_source"))) for hit in hits]
+
+    def save_all(self, route_predictions: List[RoutePrediction]) -> None:
+        self.elastic.store_bulk(
+            documents={route_prediction.route_id: json.loads(jsonpickle.encode(route_prediction))
+                       for route_prediction in route_predictions},
+            index_name=self.index
+        )
+
+    def delete_recreates_index(self) -> None:
+        return self.elastic.delete_recreates_index(self.index, mappings=self.mappings)
@@ -2,19 +2,54 @@ import logging
 import os.path
 import time
 import sys
-from typing import List, Dict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from typing import List, Dict, Tuple, Optional, Callable
 
+import numpy as np
 import requests
 
-from prediction.domain import athlete, activity, route
+from prediction.domain import athlete, activity, route, training_load
+from prediction.domain.training_load import TrainingLoad
 from prediction.infrastructure import adapter_data
-from prediction.utils.functions import gpx_parser, compute_segmentation
+from prediction.infrastructure.segmentation_cache import cached_segmentation
+from prediction.utils.functions import gpx_stream_parser, gpx_arrays_to_points, simplify_segmentation
+
+
+def segment_gpx(gpx: str) -> Tuple[Tuple[np.ndarray, np.ndarray, np.ndarray], List[Dict], Dict]:
+    """
+    Parsing and segmentation of the gpx of a route, run in a worker process.
+    The segmentation is read from the segmentation cache if the route has already been segmented,
+    the points of the segments are simplified for storage.
+    Returns the arrays of the points of the route (latitudes, longitudes, elevations),
+    its segmentation and the time of each step.
+    The points are sent back as arrays, cheaper to pickle than a dict by point
+    """
+    start_parse = time.perf_counter()
+    latitudes, longitudes, elevations = gpx_stream_parser(gpx)
+    start_segmentation = time.perf_counter()
+    segmentation, cache_hit = cached_segmentation(latitudes, longitudes, elevations)
+    segmentation = simplify_segmentation(segmentation, route.Route.simplification_tolerances['storage'])
+    end_segmentation = time.perf_counter()
+
+    timings = {
+        'points': len(latitudes),
+        'parse_time': round(start_segmentation - start_parse, 3),
+        'segmentation_time': round(end_segmentation - start_segmentation, 3),
+        'cache_hit': cache_hit
+    }
+    return (latitudes, longitudes, elevations), segmentation, timings
 
 
 class ImportStrava:
 
-    def __init__(self, athlete_: athlete.Athlete):
+    def __init__(self, athlete_: athlete.Athlete, segmentation_workers: Optional[int] = None):
+        """
+        segmentation_workers : number of processes segmenting the routes,
+        SEGMENTATION_WORKERS env variable or number of cpus by default
+        """
         self.athlete = athlete_
+        self.segmentation_workers = segmentation_workers or int(os.getenv("SEGMENTATION_WORKERS", os.cpu_count()))
+        self.routes_timings = []
         self.refresh_token_if_not_valid()
 
     def check_if_token_is_valid(self) -> bool:
@@ -118,24 +153,62 @@ class ImportStrava:
         logging.info(f'{len(activities_ids_to_added)} new activities to be added to the database')
         return activities_ids_to_added
 
-    def storage_of_new_activities(self) -> int:
+    def storage_of_new_activities(self, progress: Optional[Callable[[str, float], None]] = None) -> int:
         """
         Stores on the database all new activities
+        progress : called with the stage and the percentage done
         Return number of activities added for frontend
         """
+        progress = progress or (lambda stage, percent: None)
+        progress('listing activities', 0)
         activities_ids_to_added = self.get_new_activities_ids()
         activities_added = 0
-        if len(activities_ids_to_added) != 0:
+        training_load_, version = self.get_training_load()
+        try:
             for activity_id in activities_ids_to_added:
                 activity_json = self.get_activity_by_id(activity_id=activity_id)
                 activity_ = adapter_data.AdapterActivity(activity_json).get()
                 activity.repository.save(activity_)
+                training_load_.add_activity(activity_)
                 activities_added += 1
+                progress('importing activities', (activities_added * 100) / len(activities_ids_to_added))
                 logging.info(f"Activity {activity_id} added in database "
                              f"[{round((activities_added * 100)/len(activities_ids_to_added),2)}%]")
+        finally:
+            # the activities saved are in the ledger, even if the import is interrupted
+            if activities_added or version is None:
+                self.save_training_load(training_load_, version, activities_ids_to_added[:activities_added])
+        if activities_added:
             logging.info(f'{activities_added} activities added to the database')
         return activities_added
 
+    def get_training_load(self) -> Tuple[TrainingLoad, Optional[Dict]]:
+        """
+        Ledger of the training load of the athlete and the version of its document,
+        built from the activities already in the database if there is none (version None)
+        """
+        training_load_, version = training_load.repository.get_with_version(self.athlete.id)
+        if training_load_ is None:
+            training_load_ = TrainingLoad.from_activities(
+                self.athlete.id,
+                (activity_ for activities in activity.repository.get_chunks_desc() for activity_ in activities))
+            logging.info(f'Training load of the athlete {self.athlete.id} built from '
+                         f'{len(training_load_.activity_ids)} activities')
+        return training_load_, version
+
+    def save_training_load(self, training_load_: TrainingLoad, version: Optional[Dict],
+                           activities_ids: List[int]) -> None:
+        """
+        Stores the ledger if no other import wrote it since it was read.
+        Otherwise the activities of this import are added to the ledger read again
+        """
+        while not training_load.repository.save_if_unchanged(training_load_, version):
+            logging.info(f'Training load of the athlete {self.athlete.id} written by another import, '
+                         f'{len(activities_ids)} activities added again')
+            training_load_, version = self.get_training_load()
+            for activity_id in activities_ids:
+                training_load_.add_activity(activity.repository.get(activity_id))
+
     # ROUTES
 
     def get_all_routes(self) -> List:
@@ -196,28 +269,76 @@ class ImportStrava:
         logging.info(f'{len(routes_ids_to_added)} new routes to be added to the database')
         return routes_ids_to_added
 
-    def storage_of_new_routes(self) -> int:
+    def storage_of_new_routes(self, progress: Optional[Callable[[str, float], None]] = None) -> int:
         """
         Stores on the database all new routes
+        The segmentation of the routes is done in a pool of processes
+        while the next routes are downloaded from Strava, each route is stored once segmented.
+        progress : called with the stage and the percentage done
         Return number of routes added for frontend
         """
+        progress = progress or (lambda stage, percent: None)
+        progress('listing routes', 0)
         routes_ids_to_added = self.get_new_routes_ids()
         routes_added = 0
+        self.routes_timings = []
         if len(routes_ids_to_added) != 0:
-            for route_id in routes_ids_to_added:
-                route_json = self.get_route_by_id(route_id=route_id)
-                gpx = self.get_route_gpx(route_id=route_id)
-                parsed_gpx = gpx_parser(gpx)
-                route_json['gpx'] = parsed_gpx
-                route_json['segmentation'] = compute_segmentation(parsed_gpx)
-                route_ = adapter_data.AdapterRoute(route_json).get()
-                route.repository.save(route_)
-                routes_added += 1
-                logging.info(f"Route {route_id} added in database "
-                             f"[{round((routes_added * 100)/len(routes_ids_to_added),2)}%]")
-            logging.info(f'{routes_added} routes added to the database')
+            # routes downloaded and not stored yet, their gpx are kept in memory
+            max_routes_in_flight = 2 * self.segmentation_workers
+            with ProcessPoolExecutor(max_workers=self.segmentation_workers) as executor:
+                futures = {}
+
+                def report() -> None:
+                    # half for the download, half for the segmentation and the storage
+                    progress('importing routes',
+                             ((2 * routes_added + len(futures)) * 50) / len(routes_ids_to_added))
+
+                def store(done) -> None:
+                    nonlocal routes_added
+                    for future in done:
+                        routes_added += 1
+                        self.store_segmented_route(future.result(), *futures.pop(future),
+                                                   percent=(routes_added * 100) / len(routes_ids_to_added))
+                        report()
+
+                try:
+                    for route_id in routes_ids_to_added:
+                        start_fetch = time.perf_counter()
+                        route_json = self.get_route_by_id(route_id=route_id)
+                        gpx = self.get_route_gpx(route_id=route_id)
+                        fetch_time = round(time.perf_counter() - start_fetch, 3)
+                        futures[executor.submit(segment_gpx, gpx)] = (route_id, route_json, fetch_time)
+                        report()
+                        if len(futures) >= max_routes_in_flight:
+                            store(wait(futures, return_when=FIRST_COMPLETED).done)
+                finally:
+                    # the routes already downloaded are stored, even if the import is interrupted
+                    store(as_completed(list(futures)))
+            logging.info(f'{routes_added} routes added to the database '
+                         f'with {self.segmentation_workers} segmentation workers')
         return routes_added
 
+    def store_segmented_route(self, result: Tuple, route_id: int, route_json: Dict, fetch_time: float,
+                              percent: float) -> None:
+        """
+        Stores a route with the result of segment_gpx
+        """
+        gpx_arrays, route_json['segmentation'], timings = result
+        route_json['gpx'] = gpx_arrays_to_points(*gpx_arrays)
+        route_ = adapter_data.AdapterRoute(route_json).get()
+        route_.compute_features()
+        route.repository.save(route_)
+
+        timings['route_id'] = route_id
+        timings['fetch_time'] = fetch_time
+        self.routes_timings.append(timings)
+        logging.info(f"Route {route_id} added in database "
+                     f"[{round(percent, 2)}%] - "
+                     f"{timings['points']} points, fetch : {fetch_time}s, "
+                     f"parse : {timings['parse_time']}s, "
+                     f"segmentation : {timings['segmentation_time']}s "
+                     f"(cache hit : {timings['cache_hit']})")
+
     def get_route_gpx(self, route_id) -> str:
         """
         Retrieve a gpx file of a route from its id
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence
+
+
+class JobStore:
+    """
+    State of the jobs in a local sqlite database, kept when the web process restarts
+    """
+    filename = './jobs/jobs.sqlite'
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename = filename or os.getenv("JOBS_DATABASE", self.filename)
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        self.lock = threading.Lock()
+        with self.lock, self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, stage TEXT, percent REAL, "
+                "created_at REAL, started_at REAL, updated_at REAL, result TEXT, error TEXT)"
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.filename)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def create(self, kind: str, params: Dict) -> str:
+        id_ = str(uuid.uuid4())
+        now = time.time()
+        with self.lock, self.connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, params, status, stage, percent, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'pending', 'waiting', 0, ?, ?)",
+                (id_, kind, json.dumps(params), now, now)
+            )
+        return id_
+
+    def update(self, id_: str, **values) -> None:
+        values['updated_at'] = time.time()
+        for key in ('params', 'result'):
+            if key in values:
+                values[key] = json.dumps(values[key])
+        columns = ', '.join(f'{key} = ?' for key in values)
+        with self.lock, self.connect() as connection:
+            connection.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*values.values(), id_))
+
+    def get(self, id_: str) -> Optional[Dict]:
+        with self.lock, self.connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (id_,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def get_unfinished(self) -> list:
+        with self.lock, self.connect() as connection:
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE status IN ('pending', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+
+class JobQueue:
+    """
+    Long tasks (imports from Strava, trainings) run by a pool of threads,
+    outside of the event loop of the web server.
+    Each task is a function registered under a kind, called with its params
+    and a progress(stage, percent) callback. Its result must be json serializable.
+    The store is opened at the first use, not when the queue is created (import of the web service).
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: Optional[int] = None):
+        self._store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers or int(os.getenv("JOB_WORKERS", 2)))
+        self.functions = {}
+        self.store_lock = threading.Lock()
+        # the check of the unfinished jobs and the submission are done at once
+        self.submit_lock = threading.Lock()
+
+    @property
+    def store(self) -> JobStore:
+        with self.store_lock:
+            if self._store is None:
+                self._store = JobStore()
+            return self._store
+
+    def register(self, kind: str, function: Callable) -> None:
+        self.functions[kind] = function
+
+    def submit(self, kind: str, **params) -> str:
+        id_ = self.store.create(kind, params)
+        self.executor.submit(self.run, id_, kind, params)
+        return id_
+
+    def submit_unless_unfinished(self, kind: str, kinds: Sequence[str] = (),
+                                 statuses: Sequence[str] = ('pending', 'running'), **params) -> str:
+        """
+        Submits the job unless a job of its kind or of kinds has one of the statuses :
+        the id of this job is then returned
+        """
+        with self.submit_lock:
+            for job in self.store.get_unfinished():
+                if job['kind'] in (kind, *kinds) and job['status'] in statuses:
+                    logging.info(f"Job {kind} not submitted, job {job['id']} ({job['kind']}) is {job['status']}")
+                    return job['id']
+            return self.submit(kind, **params)
+
+    def resume(self) -> None:
+        """
+        Jobs not finished when the web process stopped are run again
+        """
+        for job in self.store.get_unfinished():
+            logging.info(f"Job {job['id']} ({job['kind']}) resumed")
+            self.store.update(job['id'], status='pending', stage='waiting', percent=0)
+            self.executor.submit(self.run, job['id'], job['kind'], job['params'])
+
+    def run(self, id_: str, kind: str, params: Dict) -> None:
+        self.store.update(id_, status='running', started_at=time.time())
+
+        def progress(stage: str, percent: float) -> None:
+            self.store.update(id_, stage=stage, percent=round(percent, 2))
+
+        try:
+            result = self.functions[kind](progress=progress, **params)
+        except Exception as error:
+            logging.exception(f'Job {id_} ({kind}) failed')
+            self.store.update(id_, status='failed', error=repr(error))
+        else:
+            self.store.update(id_, status='done', stage='done', percent=100, result=result)
+
+    def status(self, id_: str) -> Optional[Dict]:
+        """
+        State of the job with its estimated remaining time in seconds
+        """
+        job = self.store.get(id_)
+        if job is None:
+            return None
+        job['eta_seconds'] = None
+        if job['status'] == 'running' and job['percent']:
+            elapsed = time.time() - job['started_at']
+            job['eta_seconds'] = round(elapsed * (100 - job['percent']) / job['percent'])
+        return job
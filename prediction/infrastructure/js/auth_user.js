@@ -11,6 +11,9 @@ jQuery(document).ready(function(){
             break;
     }
 
+    // number of jobs polled, the loading screen stays between two polls
+    var jobs_running = 0
+
     $(document).ajaxStart(function(){
         $("#authenticated_user").css("opacity",0.2)
         $("#circle_loading").show()
@@ -18,9 +21,50 @@ jQuery(document).ready(function(){
     })
 
     $(document).ajaxStop(function(){
-        $("#authenticated_user").css("opacity",1)
-        $("#circle_loading").hide()
-        $(".button").removeClass('disabled')
+        if (jobs_running == 0) {
+            $("#authenticated_user").css("opacity",1)
+            $("#circle_loading").hide()
+            $(".button").removeClass('disabled')
+        }
+    })
+
+//    Jobs : long tasks return a job id, its status is polled until the result is available
+
+    var wait_job = (function(response){
+        let deferred = $.Deferred()
+        if (response == null) {
+            return deferred.resolve(null).promise()
+        }
+        jobs_running += 1
+        let poll = function(){
+            $.ajax({method:'GET', url:'/job_status?job_id=' + response.job_id}).done(job => {
+                if (job.status == 'done' || job.status == 'failed') {
+                    jobs_running -= 1
+                    if (job.status == 'done') {
+                        deferred.resolve(job.result)
+                    } else {
+                        deferred.reject(job)
+                    }
+                } else {
+                    setTimeout(poll, 1000)
+                }
+            }).fail(() => {
+                jobs_running -= 1
+                deferred.reject({error: 'statut de la tâche indisponible'})
+            })
+        }
+        poll()
+        return deferred.promise()
+    })
+
+    // message of a failed job, shown in the info element of the button
+    var show_job_error = (function(selector){
+        return function(job){
+            // failed job, or jqXHR if the request starting the job failed
+            $(selector).text("La tâche a échoué : " + (job.error || job.statusText))
+            $(selector).css("opacity",1)
+            $(selector).delay(10000).fadeTo('slow',0)
+        }
     })
 
 //    Update Activities
@@ -31,7 +75,7 @@ jQuery(document).ready(function(){
             method:'GET',
             url: '/get_new_activities'
         }
-        $.ajax(options).done(response => {
+        $.ajax(options).then(wait_job).done(response => {
             if(response.activities_added > 0){
                 $(".activities_in_base").text(response.activities_in_base)
                 $(".name_last_activity").text(response.name_last_activity)
@@ -44,7 +88,7 @@ jQuery(document).ready(function(){
             }
             $(".info_last_activity").show()
             $(".no_activities").hide()
-        })
+        }).fail(show_job_error(".no_new_activities"))
     });
 
 //    Update Routes
@@ -55,7 +99,7 @@ jQuery(document).ready(function(){
             method:'GET',
             url: '/get_new_routes'
         }
-        $.ajax(options).done(response => {
+        $.ajax(options).then(wait_job).done(response => {
             if(response.routes_added > 0){
                 $(".routes_in_base").text(response.routes_in_base)
                 $(".name_last_route").text(response.name_last_route)
@@ -68,7 +112,7 @@ jQuery(document).ready(function(){
             }
             $(".info_last_route").show()
             $(".no_routes").hide()
-        })
+        }).fail(show_job_error(".no_new_routes"))
     });
 
 // Train Models
@@ -78,7 +122,7 @@ jQuery(document).ready(function(){
             method:'GET',
             url: '/train_models'
         }
-        $.ajax(options).done(response => {
+        $.ajax(options).then(wait_job).done(response => {
             if(response == null) {
                 $(".no_activities_for_train").text("Aucune activitée pour entrainer un modèle")
                 /* After a fadeTo opacity = 0  */
@@ -90,7 +134,7 @@ jQuery(document).ready(function(){
                 $(".info_last_model").show()
                 $(".no_models").hide()
             }
-        })
+        }).fail(show_job_error(".no_activities_for_train"))
     });
 
 
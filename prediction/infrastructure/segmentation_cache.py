@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from prediction.utils.functions import compute_segmentation_from_arrays
+
+
+class SegmentationCache:
+    """
+    Segmentations stored on disk, one json file per route geometry.
+    The name of the file is a hash of the points of the route and of the
+    segmentation parameters, so the same route imported twice is segmented once.
+    When the directory is larger than max_bytes, the least recently used
+    files are removed.
+    """
+    directory = './cache/segmentation/'
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or os.getenv("SEGMENTATION_CACHE_DIRECTORY", self.directory)
+        self.max_bytes = max_bytes or int(os.getenv("SEGMENTATION_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(latitudes: np.ndarray, longitudes: np.ndarray, elevations: np.ndarray, window: int) -> str:
+        geometry_hash = hashlib.sha256()
+        for values in (latitudes, longitudes, elevations):
+            geometry_hash.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        geometry_hash.update(f'window={window}'.encode())
+        return geometry_hash.hexdigest()
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        filename = self.filename(key)
+        try:
+            with open(filename, 'r') as file:
+                segmentation = json.load(file)
+            # last access time for eviction
+            os.utime(filename)
+        except (FileNotFoundError, ValueError):
+            return None
+        return segmentation
+
+    def set(self, key: str, segmentation: List[Dict]) -> None:
+        # written in a temporary file then renamed, other processes never read a partial file
+        temporary_filename = self.filename(f'{key}.{uuid.uuid4().hex}.tmp')
+        with open(temporary_filename, 'w') as file:
+            json.dump(segmentation, file)
+        os.replace(temporary_filename, self.filename(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used segmentations until the size of the
+        directory is under max_bytes
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            logging.info(f'Segmentation cache - {os.path.basename(path)} evicted')
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.directory):
+            os.remove(entry.path)
+
+
+def cached_segmentation(latitudes: np.ndarray, longitudes: np.ndarray, elevations: np.ndarray,
+                        window: int = 6, cache: Optional[SegmentationCache] = None) -> Tuple[List[Dict], bool]:
+    """
+    Segmentation of the route, read from the cache if this geometry has already been segmented.
+    Returns the segmentation and whether it was found in the cache
+    """
+    cache = cache or SegmentationCache()
+    key = cache.key(latitudes, longitudes, elevations, window)
+    segmentation = cache.get(key)
+    if segmentation is not None:
+        return segmentation, True
+
+    segmentation = compute_segmentation_from_arrays(latitudes, longitudes, elevations, window=window)
+    cache.set(key, segmentation)
+    return segmentation, False
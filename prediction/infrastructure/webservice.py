@@ -1,21 +1,25 @@
 import os
 import time
 import urllib.parse
-from typing import Optional
+from typing import List, Optional
 
+import elasticsearch
 import requests
-from fastapi import FastAPI, HTTPException, Request, Cookie, Form
+from fastapi import FastAPI, HTTPException, Request, Cookie, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.responses import RedirectResponse
 
-from prediction.domain import athlete, activity, route, model, predict
-from prediction.domain.model import TypeModel
+from prediction.domain import athlete, activity, route, model, predict, model_cache, prediction_cache, training_load, \
+    route_prediction
+from prediction.domain.training import Training
+from prediction.domain.tuning import Tuning
 from prediction.infrastructure.adapter_data import AdapterAthlete
 from prediction.infrastructure.elasticsearch import Elasticsearch
 from prediction.infrastructure.import_strava import ImportStrava
+from prediction.infrastructure.jobs import JobQueue
 
 app = FastAPI()
 
@@ -38,6 +42,13 @@ app.mount("/js", StaticFiles(directory="prediction/infrastructure/js"), name="js
 app.mount("/images", StaticFiles(directory="prediction/infrastructure/images"), name="images")
 templates = Jinja2Templates(directory="prediction/infrastructure/templates")
 
+jobs = JobQueue()
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    jobs.resume()
+
 
 ####DEBUG
 
@@ -58,12 +69,17 @@ async def delete_athletes():
 @app.get("/delete_activities")
 async def delete_activities():
     activity.repository.delete_recreates_index()
+    training_load.repository.delete_recreates_index()
+    # the stored predictions were computed with the features of the deleted activities
+    route_prediction.repository.delete_recreates_index()
+    prediction_cache.cache.clear()
     return 'Activity index has been deleted and recreated'
 
 
 @app.get("/delete_routes")
 async def delete_routes():
     route.repository.delete_recreates_index()
+    route_prediction.repository.delete_recreates_index()
     return 'Route index has been deleted and recreated'
 
 
@@ -71,6 +87,8 @@ async def delete_routes():
 async def delete_models():
     model.Model.delete_all()
     model.repository.delete_recreates_index()
+    model_cache.cache.clear()
+    prediction_cache.cache.clear()
     return 'Model index has been deleted and recreated / All pickles models have been removed '
 
 
@@ -118,34 +136,122 @@ async def authenticated_user(request: Request,
 @app.get("/road_prediction", response_class=HTMLResponse)
 async def road_prediction(request: Request):
     routes = route.repository.get_all_desc()
+    # predictions of the routes computed in advance by the champion, outdoor
+    predictions = {}
+    champion = model_cache.cache.get_champion()
+    if routes and champion is not None:
+        model_, _ = champion
+        # ledger of each athlete, read once
+        training_loads = {}
+        for route_prediction_ in route_prediction.repository.get_all():
+            athlete_id = route_prediction_.athlete_id
+            if athlete_id not in training_loads:
+                training_loads[athlete_id] = training_load.repository.get(athlete_id)
+            if route_prediction_.is_valid(model_.id, training_loads[athlete_id]):
+                predictions[route_prediction_.route_id] = route_prediction_.get(virtual_ride=False)
+        if len(predictions) < len(routes):
+            # predictions of a previous day or of routes just imported
+            submit_routes_prediction(skipped_if=('pending', 'running'))
     return templates.TemplateResponse("road_prediction.html", {"request": request,
-                                                               "routes": routes})
+                                                               "routes": routes,
+                                                               "predictions": predictions})
 
 
 #############
 
-@app.get("/get_new_activities")
-async def get_new_activities(athlete_id: str = Cookie(None)):
+# Long tasks run as jobs : the endpoint returns the id of the job,
+# its progress and its result are read with /job_status
+
+def import_new_activities(athlete_id: str, progress) -> dict:
     athlete_ = athlete.repository.get(athlete_id)
     import_strava = ImportStrava(athlete_)
-    activities_added = import_strava.storage_of_new_activities()
+    activities_added = import_strava.storage_of_new_activities(progress=progress)
+    if activities_added:
+        # the features of the athlete changed
+        prediction_cache.cache.clear()
+        submit_routes_prediction()
     info_activities = activity.repository.get_general_info()
     info_activities['activities_added'] = activities_added
     return info_activities
 
 
-@app.get("/get_new_routes")
-async def get_new_routes(athlete_id: str = Cookie(None)):
+def import_new_routes(athlete_id: str, progress) -> dict:
     athlete_ = athlete.repository.get(athlete_id)
     import_strava = ImportStrava(athlete_)
-    routes_added = import_strava.storage_of_new_routes()
+    routes_added = import_strava.storage_of_new_routes(progress=progress)
+    if routes_added:
+        submit_routes_prediction()
     info_routes = route.repository.get_general_info()
     info_routes['routes_added'] = routes_added
     return info_routes
 
 
+def train_all_models(progress, incremental: bool = False) -> dict:
+    if incremental:
+        Training().update(progress=progress)
+    else:
+        Training().run(progress=progress)
+    # the champion may have changed
+    model_cache.cache.clear()
+    prediction_cache.cache.clear()
+    submit_routes_prediction()
+    info_models = model.repository.get_general_info()
+    return info_models
+
+
+def tune_all_models(progress, search: str = 'random') -> dict:
+    Tuning(search=search).run(progress=progress)
+    model_cache.cache.clear()
+    prediction_cache.cache.clear()
+    submit_routes_prediction()
+    info_models = model.repository.get_general_info()
+    return info_models
+
+
+def predict_routes(progress) -> dict:
+    return {'routes_predicted': route_prediction.predict_all_routes(progress=progress)}
+
+
+def submit_routes_prediction(skipped_if: tuple = ('pending',)) -> None:
+    """
+    Predictions of all the routes computed again in a job,
+    unless a job waiting to start will already compute them with the last models and activities
+    skipped_if : status of a predict_routes job for which no other one is submitted
+    """
+    jobs.submit_unless_unfinished('predict_routes', statuses=skipped_if)
+
+
+def submit_training(kind: str, **params) -> str:
+    """
+    One training or tuning at a time, they write the same models and champion :
+    the id of the one waiting or running is returned instead of submitting another one
+    """
+    return jobs.submit_unless_unfinished(kind, kinds=('train_models', 'tune_models'), **params)
+
+
+jobs.register('get_new_activities', import_new_activities)
+jobs.register('get_new_routes', import_new_routes)
+jobs.register('train_models', train_all_models)
+jobs.register('tune_models', tune_all_models)
+jobs.register('predict_routes', predict_routes)
+
+
+@app.get("/get_new_activities")
+async def get_new_activities(athlete_id: str = Cookie(None)):
+    return {'job_id': jobs.submit('get_new_activities', athlete_id=athlete_id)}
+
+
+@app.get("/get_new_routes")
+async def get_new_routes(athlete_id: str = Cookie(None)):
+    return {'job_id': jobs.submit('get_new_routes', athlete_id=athlete_id)}
+
+
 @app.get("/train_models")
-async def train_models():
+async def train_models(incremental: bool = False):
+    """
+    incremental : the last XGBoost model continues its training on the new activities,
+    all the models are trained again if its error drifted
+    """
     if activity.repository.is_empty():
         # TODO: Very ugly method to avoid flashing on frontend
         #  The response is too fast which does not allow time
@@ -153,26 +259,92 @@ async def train_models():
         time.sleep(1.5)
         return None
     else:
-        for type_model in TypeModel:
-            model_ = model.Model(model=type_model)
-            model_.train()
-            model.repository.save(model_)
+        return {'job_id': submit_training('train_models', incremental=incremental)}
 
-        info_models = model.repository.get_general_info()
-        return info_models
+
+@app.get("/tune_models")
+async def tune_models(search: str = 'random'):
+    """
+    search of the hyperparameters by cross validation, 'grid' or 'random'
+    """
+    if search not in ('grid', 'random'):
+        raise HTTPException(status_code=400, detail="search must be 'grid' or 'random'")
+    if activity.repository.is_empty():
+        return None
+    return {'job_id': submit_training('tune_models', search=search)}
+
+
+@app.get("/job_status")
+async def job_status(job_id: str):
+    """
+    status (pending, running, done, failed), stage, percent, eta_seconds
+    and result of the job once done
+    """
+    job = jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/model_profile")
+async def model_profile(model_id: str):
+    """
+    wall time, cpu time, memory and rows of each stage of the training of the model.
+    The cpu time is the one of the whole process : it includes the other jobs run at the same time
+    """
+    try:
+        model_ = model.repository.get(model_id)
+    except elasticsearch.exceptions.NotFoundError:
+        raise HTTPException(status_code=404, detail="Unknown model")
+    return model_.get_profile()
 
 
 @app.get("/get_prediction")
 async def get_prediction(route_id: int, virtual_ride: bool):
-    if model.repository.is_empty():
+    champion = model_cache.cache.get_champion()
+    if champion is None:
         return None
     else:
+        model_, _ = champion
         route_ = route.repository.get(route_id)
-        model_ = model.repository.get_better_mape()
+        training_load_ = training_load.repository.get(route_.athlete_id)
+        # computed in advance after the last training or import
+        route_prediction_ = route_prediction.repository.get(route_id)
+        if route_prediction_ is not None and route_prediction_.is_valid(model_.id, training_load_):
+            return route_prediction_.get(virtual_ride)
+        # without ledger (activities not imported since), the activities are loaded
         predict_ = predict.Predict(model=model_,
                                    route=route_,
-                                   virtual_ride=virtual_ride)
-        return predict_.get_prediction()
+                                   virtual_ride=virtual_ride,
+                                   training_load_=training_load_)
+        return prediction_cache.cache.get_prediction(predict_)
+
+
+@app.get("/get_predictions")
+async def get_predictions(route_ids: Optional[List[int]] = Query(None), virtual_ride: Optional[bool] = None):
+    """
+    Predictions of the routes of route_ids (all the routes if not given),
+    in the virtual_ride mode given or in both, with the time of each segment.
+    The routes of an athlete are predicted with one call of the model
+    """
+    champion = model_cache.cache.get_champion()
+    if champion is None:
+        return None
+    model_, _ = champion
+    routes = route.repository.get_by_ids(route_ids) if route_ids else route.repository.get_all_desc() or []
+    virtual_rides = [False, True] if virtual_ride is None else [virtual_ride]
+
+    routes_by_athlete = {}
+    for route_ in routes:
+        routes_by_athlete.setdefault(route_.athlete_id, []).append(route_)
+    predictions = []
+    for athlete_id, athlete_routes in routes_by_athlete.items():
+        batch_predict = predict.BatchPredict(model=model_,
+                                             routes=athlete_routes,
+                                             virtual_rides=virtual_rides,
+                                             training_load_=training_load.repository.get(athlete_id))
+        predictions.extend(batch_predict.get_predictions())
+    return predictions
 
 
 @app.get("/get_map")
@@ -188,9 +360,11 @@ async def get_segmentation_map(route_id: int):
 
 
 @app.get("/get_segmentation")
-async def get_segmentation(route_id: int):
+async def get_segmentation(route_id: int, use: str = 'map'):
     route_ = route.repository.get(route_id)
-    return route_.segmentation
+    if use not in route_.simplification_tolerances:
+        raise HTTPException(status_code=400, detail=f"use must be one of {list(route_.simplification_tolerances)}")
+    return route_.get_segmentation(use)
 
 
 ############
@@ -1,7 +1,12 @@
+import base64
 import datetime
+import io
 import warnings
+import xml.etree.ElementTree as ElementTree
+import zlib
+from array import array
 from math import radians, cos, sin, asin, sqrt
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union, IO, Optional
 
 import gpxpy
 import numpy as np
@@ -47,6 +52,160 @@ def gpx_parser(gpx: str) -> List[Dict]:
     return data
 
 
+def gpx_stream_parser(gpx: Union[str, IO]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the track points of a gpx one by one without building the whole xml tree.
+    Returns three contiguous float64 arrays : latitudes, longitudes, elevations
+    (nan if a point has no elevation)
+    """
+    if isinstance(gpx, str):
+        gpx = io.StringIO(gpx)
+
+    latitudes, longitudes, elevations = array('d'), array('d'), array('d')
+    parents = []
+    for event, element in ElementTree.iterparse(gpx, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        # tag is {namespace}name
+        if element.tag.rpartition('}')[2] != 'trkpt':
+            continue
+
+        elevation = np.nan
+        for child in element:
+            if child.tag.rpartition('}')[2] == 'ele' and child.text:
+                elevation = float(child.text)
+        latitudes.append(float(element.get('lat')))
+        longitudes.append(float(element.get('lon')))
+        elevations.append(elevation)
+
+        # the point is no longer needed, only the arrays grow
+        element.clear()
+        parents[-1].remove(element)
+
+    return (np.frombuffer(latitudes, dtype=np.float64),
+            np.frombuffer(longitudes, dtype=np.float64),
+            np.frombuffer(elevations, dtype=np.float64))
+
+
+def gpx_arrays_to_points(latitudes: np.ndarray, longitudes: np.ndarray, elevations: np.ndarray) -> List[Dict]:
+    """
+    Returns the points of the route in the format of gpx_parser
+    """
+    return [
+        {"latitude": latitude, "longitude": longitude, "elevation": None if np.isnan(elevation) else elevation}
+        for latitude, longitude, elevation in zip(latitudes.tolist(), longitudes.tolist(), elevations.tolist())
+    ]
+
+
+def encode_array(values: np.ndarray, scale: float) -> Dict:
+    """
+    Compact encoding of an array of floats :
+    fixed point integers (values rounded to 1/scale), delta encoded,
+    compressed with zlib and stored as a base64 string. nan values are kept.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    is_nan = np.isnan(values)
+    fixed_point = np.round(np.where(is_nan, 0, values) * scale).astype(np.int64)
+    deltas = np.diff(fixed_point, prepend=0).astype('<i8')
+    encoded = {
+        'scale': scale,
+        'values': base64.b64encode(zlib.compress(deltas.tobytes())).decode('ascii')
+    }
+    if is_nan.any():
+        encoded['nan'] = base64.b64encode(np.packbits(is_nan).tobytes()).decode('ascii')
+    return encoded
+
+
+def decode_array(encoded: Dict) -> np.ndarray:
+    deltas = np.frombuffer(zlib.decompress(base64.b64decode(encoded['values'])), dtype='<i8')
+    values = np.cumsum(deltas) / encoded['scale']
+    if 'nan' in encoded:
+        is_nan = np.unpackbits(np.frombuffer(base64.b64decode(encoded['nan']), dtype=np.uint8),
+                               count=values.shape[0]).astype(bool)
+        values[is_nan] = np.nan
+    return values
+
+
+def encode_matrix(matrix: np.ndarray, columns: List[str]) -> Dict:
+    """
+    Compact encoding of a float32 matrix without loss : its bytes, compressed with zlib,
+    stored as a base64 string with the names of its columns
+    """
+    matrix = np.ascontiguousarray(matrix, dtype='<f4')
+    return {
+        'columns': list(columns),
+        'rows': matrix.shape[0],
+        'values': base64.b64encode(zlib.compress(matrix.tobytes())).decode('ascii')
+    }
+
+
+def decode_matrix(encoded: Dict) -> np.ndarray:
+    values = np.frombuffer(zlib.decompress(base64.b64decode(encoded['values'])), dtype='<f4')
+    return values.reshape(encoded['rows'], len(encoded['columns'])).astype(np.float32)
+
+
+def climb_category(average_grades, distances) -> np.ndarray:
+    """
+    Climb category is a feature of Strava
+    https://support.strava.com/hc/en-us/articles/216917057-Climb-Categorization
+    0 : <= 8000, 1 : <= 16000, 2 : <= 32000, 3 : <= 64000, 4 : <= 80000, 5 : > 80000
+    """
+    result = np.asarray(average_grades, dtype=np.float64) * np.asarray(distances, dtype=np.float64)
+    return np.digitize(result, [8000, 16000, 32000, 64000, 80000], right=True)
+
+
+def encode_gpx(gpx: List[Dict]) -> Dict:
+    """
+    Points of a route (format of gpx_parser) encoded with encode_array,
+    1e-7 degree for coordinates and millimeter for elevation
+    """
+    return {
+        'latitude': encode_array([point.get("latitude") for point in gpx], scale=1e7),
+        'longitude': encode_array([point.get("longitude") for point in gpx], scale=1e7),
+        'elevation': encode_array([point.get("elevation") for point in gpx], scale=1e3)
+    }
+
+
+def decode_gpx(encoded: Dict) -> List[Dict]:
+    return gpx_arrays_to_points(
+        decode_array(encoded['latitude']),
+        decode_array(encoded['longitude']),
+        decode_array(encoded['elevation'])
+    )
+
+
+def encode_segmentation(segmentation: List[Dict]) -> Dict:
+    """
+    Segmentation with the all_points of every segment concatenated and encoded with encode_array.
+    The other values of the segments are kept as they are
+    """
+    all_points = [point for segment in segmentation for point in segment.get("all_points", [])]
+    coordinates = np.asarray(all_points, dtype=np.float64).reshape(-1, 2)
+    return {
+        'segments': [
+            {key: value for key, value in segment.items() if key != "all_points"}
+            for segment in segmentation
+        ],
+        'sizes': [len(segment.get("all_points", [])) for segment in segmentation],
+        'latitude': encode_array(coordinates[:, 0], scale=1e7),
+        'longitude': encode_array(coordinates[:, 1], scale=1e7)
+    }
+
+
+def decode_segmentation(encoded: Dict) -> List[Dict]:
+    all_points = np.column_stack((decode_array(encoded['latitude']), decode_array(encoded['longitude'])))
+    ends = np.cumsum(encoded['sizes'])
+    segmentation = []
+    for segment, start, end in zip(encoded['segments'], ends - encoded['sizes'], ends):
+        segment = dict(segment)
+        segment['all_points'] = all_points[start:end].tolist()
+        segmentation.append(segment)
+    return segmentation
+
+
 def haversine(lon1, lat1, lon2, lat2):
     """
     Calculate the great circle distance between two points
@@ -65,6 +224,75 @@ def haversine(lon1, lat1, lon2, lat2):
     return m
 
 
+def haversine_array(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of haversine, distances in meters
+    between each pair of points of the arrays
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(a))
+    km = 6371 * c
+    m = km * 1000
+    return m
+
+
+def simplify_polyline(points: List[List[float]], tolerance: float) -> List[List[float]]:
+    """
+    Douglas-Peucker simplification of a list of [latitude, longitude].
+    Removes the points that are less than tolerance meters away from
+    the simplified line. The first and the last points are always kept.
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return [list(point) for point in points]
+
+    coordinates = np.asarray(points, dtype=np.float64)
+    # equirectangular projection in meters, precise enough at the scale of a segment
+    latitude_origin = np.radians(coordinates[:, 0].mean())
+    x = np.radians(coordinates[:, 1]) * np.cos(latitude_origin) * 6371000
+    y = np.radians(coordinates[:, 0]) * 6371000
+
+    keep = np.zeros(coordinates.shape[0], dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, coordinates.shape[0] - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return coordinates[keep].tolist()
+
+
+def simplify_segmentation(segmentation: List[Dict], tolerance: Optional[float]) -> List[Dict]:
+    """
+    Copy of the segmentation with the all_points of each segment simplified.
+    tolerance None : all_points are removed
+    The distance and the grade of the segments are not modified
+    """
+    simplified = []
+    for segment in segmentation:
+        simplified_segment = {key: value for key, value in segment.items() if key != "all_points"}
+        if tolerance is not None:
+            simplified_segment['all_points'] = simplify_polyline(segment.get("all_points", []), tolerance)
+        simplified.append(simplified_segment)
+    return simplified
+
+
 def convert_seconds_in_hms(seconds):
     duration = relativedelta(seconds=seconds)
     hours = int(duration.hours)
@@ -73,86 +301,76 @@ def convert_seconds_in_hms(seconds):
     return hours, minutes, seconds
 
 
-def compute_segmentation(gpx: List[Dict]) -> List[Dict]:
+def compute_segmentation(gpx: List[Dict], window: int = 6) -> List[Dict]:
     """
     Segmentation of a gpx route into logical segments (ascent, descent, flat).
     Explanation of this function here :
     notebooks_explanations/Explanation_route_segmentation.ipynb
     """
+    df = pd.DataFrame(gpx)
+    return compute_segmentation_from_arrays(
+        latitudes=df["latitude"].to_numpy(dtype=np.float64),
+        longitudes=df["longitude"].to_numpy(dtype=np.float64),
+        elevations=df["elevation"].to_numpy(dtype=np.float64),
+        window=window
+    )
+
+
+def compute_segmentation_from_arrays(latitudes: np.ndarray, longitudes: np.ndarray,
+                                     elevations: np.ndarray, window: int = 6) -> List[Dict]:
+    """
+    Same segmentation as compute_segmentation, computed with whole-array
+    operations on the columns of the route instead of a row by row walk.
+    """
     # TODO : adapt the window according to the profile of the route
-    window = 6
+    elevations = np.round(elevations, 2)
 
-    df = pd.DataFrame(gpx)
-    df["elevation"] = round(df["elevation"], 2)
+    # distance_to_last_point & total_distance
+    distance_to_last_point = np.zeros(latitudes.shape[0])
+    distance_to_last_point[1:] = np.round(
+        haversine_array(longitudes[1:], latitudes[1:], longitudes[:-1], latitudes[:-1]), 2)
+    total_distance = np.round(np.cumsum(distance_to_last_point), 2)
 
-    # compute distance_to_the_last_point
-    for i in range(df.shape[0]):
-        if i == 0:
-            df.loc[i, "distance_to_last_point"] = 0
-        else:
-            df.loc[i, "distance_to_last_point"] = round(
-                haversine(
-                    df['longitude'][i], df['latitude'][i],
-                    df['longitude'][i - 1], df['latitude'][i - 1]
-                ), 2)
-
-    # total_distance
-    df['total_distance'] = round(df['distance_to_last_point'].cumsum(), 2)
-
-    # rolling_windows
-    df['rw_altitude_gain'] = \
-        df['elevation'].rolling(window=window).apply(lambda x: x.iloc[window - 1] - x.iloc[0])
-
-    # segmentation
-    df_na = df[df['rw_altitude_gain'].isna()]
-    df_na['segment'] = 0
-    df = df.dropna().reset_index(drop=True)
-
-    for i in range(df.shape[0]):
-        if i == 0:
-            df.loc[i, "segment"] = 0
-        else:
-            if not sign_equal(df.loc[i - 1, 'rw_altitude_gain'], df.loc[i, "rw_altitude_gain"]):
-                df.loc[i, "segment"] = df.loc[i - 1, "segment"] + 1
-            else:
-                df.loc[i, "segment"] = df.loc[i - 1, "segment"]
+    # rolling_windows : gain between the first and the last point of the window
+    rw_altitude_gain = np.full(elevations.shape[0], np.nan)
+    if elevations.shape[0] >= window:
+        rw_altitude_gain[window - 1:] = elevations[window - 1:] - elevations[:elevations.shape[0] - window + 1]
+
+    # points without a complete window are placed at the start of segment 0
+    is_na = np.isnan(rw_altitude_gain)
+    order = np.concatenate((np.flatnonzero(is_na), np.flatnonzero(~is_na)))
+    latitudes, longitudes = latitudes[order], longitudes[order]
+    elevations, total_distance = elevations[order], total_distance[order]
 
-    df = df_na.append(df, ignore_index=True)
+    # segmentation : a new segment each time the sign of the gain changes
+    signs = np.sign(rw_altitude_gain[~is_na])
+    segment = np.zeros(order.shape[0], dtype=np.int64)
+    segment[is_na.sum() + 1:] = np.cumsum(signs[1:] != signs[:-1])
 
     # start & end of each segment
-    all_segments_index = []
-    for i in df['segment'].unique():
-        segment_index = {}
-        segment_df = df.loc[df['segment'] == i]
-        if i == 0:
-            segment_index['start'] = segment_df.head(1).index.values[0]
-        else:
-            segment_index['start'] = segment_df.head(1).index.values[0] - 1
-        segment_index['end'] = segment_df.tail(1).index.values[0]
-        all_segments_index.append(segment_index)
+    boundaries = np.flatnonzero(np.diff(segment)) + 1
+    starts = np.concatenate(([0], boundaries - 1))
+    ends = np.concatenate((boundaries - 1, [segment.shape[0] - 1]))
 
     # compute information about segments
+    distances = total_distance[ends] - total_distance[starts]
+    distances[0] = total_distance[ends[0]]
+    altitude_gains = elevations[ends] - elevations[starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_grades = (altitude_gains * 100) / distances
+
+    distances = np.round(distances, 2)
+    altitude_gains = np.round(altitude_gains, 2)
+    average_grades = np.round(average_grades, 2)
+
     segments = []
-    for i in range(len(all_segments_index)):
-        segment = {}
-        segment_df = df.loc[all_segments_index[i].get("start"):all_segments_index[i].get("end")]
-        if i == 0:
-            distance = segment_df.tail(1)['total_distance'].values[0]
-        else:
-            distance = segment_df.tail(1)['total_distance'].values[0] - segment_df.head(1)['total_distance'].values[0]
-        altitude_gain = segment_df.tail(1)['elevation'].values[0] - segment_df.head(1)['elevation'].values[0]
-        average_grade = (altitude_gain * 100) / distance
-
-        # all points of a segment
-        all_points = []
-        for latitude, longitude in zip(segment_df['latitude'].values, segment_df['longitude'].values):
-            point = [float(latitude), float(longitude)]
-            all_points.append(point)
-
-        segment['distance'] = float(round(distance, 2))
-        segment['altitude_gain'] = float(round(altitude_gain, 2))
-        segment['average_grade'] = float(round(average_grade, 2))
-        segment['all_points'] = list(all_points)
-        segments.append(segment)
+    for i in range(starts.shape[0]):
+        segment_slice = slice(starts[i], ends[i] + 1)
+        segments.append({
+            'distance': float(distances[i]),
+            'altitude_gain': float(altitude_gains[i]),
+            'average_grade': float(average_grades[i]),
+            'all_points': np.column_stack((latitudes[segment_slice], longitudes[segment_slice])).tolist()
+        })
 
     return segments
@@ -0,0 +1,87 @@
+import os
+import pickle
+import tempfile
+import unittest
+import uuid
+import warnings
+from unittest import mock
+
+import numpy as np
+
+from prediction.domain.artifact_store import ArtifactStore
+from prediction.domain.model import TypeModel
+
+warnings.filterwarnings('ignore')
+
+
+class ArtifactStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ArtifactStore(self.directory.name)
+        random = np.random.RandomState(42)
+        self.x = random.uniform(0, 100, size=(200, 3))
+        self.y = self.x @ np.array([1.0, 2.0, 0.5]) + random.normal(size=200)
+        self.features = ['distance', 'climb_category', 'type_virtual_ride']
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fitted(self, type_model: TypeModel):
+        estimator = type_model.new_estimator(n_jobs=1, params={'n_estimators': 10})
+        return estimator.fit(self.x, self.y)
+
+    def test_same_predictions_after_loading(self):
+        for type_model, estimator_format in ((TypeModel.XGB, 'xgboost-json'), (TypeModel.RFORREST, 'joblib')):
+            id_ = uuid.uuid4()
+            estimator = self.fitted(type_model)
+            self.store.save(id_, estimator, self.features, ['log_label'])
+
+            loaded, manifest = self.store.load(id_)
+            self.assertEqual(manifest['format'], estimator_format)
+            self.assertEqual(manifest['features'], self.features)
+            self.assertEqual(manifest['processing'], ['log_label'])
+            self.assertEqual(self.store.size(id_), manifest['bytes'])
+            np.testing.assert_allclose(loaded.predict(self.x), estimator.predict(self.x), rtol=1e-6)
+
+    def test_corrupted_artifact(self):
+        id_ = uuid.uuid4()
+        manifest = self.store.save(id_, self.fitted(TypeModel.RFORREST), self.features, [])
+        with open(os.path.join(self.directory.name, manifest['filename']), 'ab') as file:
+            file.write(b'0')
+
+        with self.assertRaises(ValueError):
+            self.store.load(id_)
+
+    def test_checksum_only_if_changed(self):
+        id_ = uuid.uuid4()
+        manifest = self.store.save(id_, self.fitted(TypeModel.RFORREST), self.features, [])
+        filename = os.path.join(self.directory.name, manifest['filename'])
+        with mock.patch.object(ArtifactStore, 'checksum', wraps=ArtifactStore.checksum) as checksum:
+            self.store.load(id_)
+            checksum.assert_not_called()
+            self.store.load(id_, full_check=True)
+            self.assertEqual(checksum.call_count, 1)
+
+            # same content, other modification time
+            os.utime(filename, ns=(manifest['mtime_ns'] + 10 ** 9, manifest['mtime_ns'] + 10 ** 9))
+            self.store.load(id_)
+            self.assertEqual(checksum.call_count, 2)
+
+    def test_pickle_saved_before_manifests(self):
+        id_ = uuid.uuid4()
+        estimator = self.fitted(TypeModel.RFORREST)
+        with open(os.path.join(self.directory.name, str(id_)), 'wb') as file:
+            pickle.dump(estimator, file)
+
+        loaded, manifest = self.store.load(id_)
+        self.assertIsNone(manifest)
+        np.testing.assert_array_equal(loaded.predict(self.x), estimator.predict(self.x))
+
+    def test_missing_artifact(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.load(uuid.uuid4())
+
+
+if __name__ == '__main__':
+    unittest.main()
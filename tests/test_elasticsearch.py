@@ -0,0 +1,84 @@
+import unittest
+import warnings
+
+from prediction.domain.training_load import TrainingLoad
+from prediction.infrastructure.elasticsearch import ElasticModelRepository, ElasticTrainingLoadRepository
+from test_model import history
+
+warnings.filterwarnings('ignore')
+
+
+class InMemoryElasticsearch:
+    """
+    documents of the indices in memory, with the calls of Elasticsearch used by the champion and the ledgers
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.seq_no = 0
+
+    def search_by_id_with_version(self, index_name, id_data):
+        return self.documents.get((index_name, id_data))
+
+    def store_data_if_unchanged(self, data, index_name, id_data, seq_no=None, primary_term=None) -> bool:
+        stored = self.documents.get((index_name, id_data))
+        if (stored.get("_seq_no") if stored else None) != seq_no:
+            return False
+        self.seq_no += 1
+        self.documents[(index_name, id_data)] = {"_source": data, "_seq_no": self.seq_no, "_primary_term": 1}
+        return True
+
+    def search_with_query(self, index_name, query, size=2000):
+        return {"hits": {"hits": []}}
+
+
+class ChampionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.repository = ElasticModelRepository.__new__(ElasticModelRepository)
+        self.repository.elastic = InMemoryElasticsearch()
+
+    def get(self, id_):
+        raise AssertionError(f'model {id_} read')
+
+    def test_no_model(self):
+        """
+        without model, the pointer elected is empty and no model is read
+        """
+        self.repository.get = self.get
+        self.assertIsNone(self.repository.get_champion())
+        pointer = self.repository.elastic.search_by_id_with_version(self.repository.champion_index,
+                                                                    self.repository.champion_id)
+        self.assertIsNone(pointer["_source"]["model_id"])
+        self.assertIsNone(self.repository.get_champion())
+
+
+class TrainingLoadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.repository = ElasticTrainingLoadRepository.__new__(ElasticTrainingLoadRepository)
+        self.repository.elastic = InMemoryElasticsearch()
+        self.activities = history()
+
+    def test_concurrent_imports(self):
+        """
+        the ledger read by two imports is written once, the second one must read it again
+        """
+        self.assertEqual(self.repository.get_with_version(1), (None, None))
+        self.assertTrue(self.repository.save_if_unchanged(TrainingLoad.from_activities(1, self.activities[:5]), None))
+
+        first, first_version = self.repository.get_with_version(1)
+        second, second_version = self.repository.get_with_version(1)
+        first.add_activity(self.activities[5])
+        second.add_activity(self.activities[6])
+        self.assertTrue(self.repository.save_if_unchanged(first, first_version))
+        self.assertFalse(self.repository.save_if_unchanged(second, second_version))
+
+        second, second_version = self.repository.get_with_version(1)
+        second.add_activity(self.activities[6])
+        self.assertTrue(self.repository.save_if_unchanged(second, second_version))
+        self.assertEqual(self.repository.get(1).activity_ids, {activity_.id for activity_ in self.activities[:7]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+import warnings
+from types import SimpleNamespace
+from unittest import mock
+
+from prediction.domain import route
+from prediction.infrastructure.import_strava import ImportStrava
+
+warnings.filterwarnings('ignore')
+
+
+class StorageOfNewRoutesTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            self.gpx = gpx_file.read()
+        self.saved = []
+        for patcher in (mock.patch.dict(os.environ, {'SEGMENTATION_CACHE_DIRECTORY': directory.name}),
+                        mock.patch.object(route, 'repository', SimpleNamespace(save=self.saved.append), create=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # without the refresh of the token of the athlete
+        self.import_strava = ImportStrava.__new__(ImportStrava)
+        self.import_strava.segmentation_workers = 1
+        self.import_strava.get_new_routes_ids = lambda: list(range(1, 7))
+        self.import_strava.get_route_by_id = lambda route_id: {
+            'id_str': route_id, 'athlete': {'id': 1}, 'description': None, 'distance': 13800,
+            'elevation_gain': 1090, 'name': 'route', 'created_at': '2021-03-01T10:00:00Z',
+            'estimated_moving_time': 3600
+        }
+
+    def test_routes_stored_while_downloading(self):
+        """
+        no more than 2 routes by worker are downloaded and not stored
+        """
+        def get_route_gpx(route_id):
+            self.assertLessEqual((route_id - 1) - len(self.saved), 2)
+            return self.gpx
+
+        self.import_strava.get_route_gpx = get_route_gpx
+        self.assertEqual(self.import_strava.storage_of_new_routes(), 6)
+        self.assertEqual(sorted(route_.id for route_ in self.saved), list(range(1, 7)))
+        self.assertEqual(len(self.import_strava.routes_timings), 6)
+
+    def test_routes_downloaded_stored_after_an_error(self):
+        def get_route_gpx(route_id):
+            if route_id == 4:
+                raise ConnectionError('Strava')
+            return self.gpx
+
+        self.import_strava.get_route_gpx = get_route_gpx
+        with self.assertRaises(ConnectionError):
+            self.import_strava.storage_of_new_routes()
+        self.assertEqual(sorted(route_.id for route_ in self.saved), [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
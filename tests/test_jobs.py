@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prediction.infrastructure.jobs import JobStore, JobQueue
+
+
+def addition(a, b, progress):
+    progress('adding', 50)
+    return {'sum': a + b}
+
+
+def failure(progress):
+    raise ValueError('no activities')
+
+
+class JobQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JobStore(filename=os.path.join(self.directory.name, 'jobs.sqlite'))
+        self.queue = JobQueue(store=self.store, workers=1)
+        self.queue.register('addition', addition)
+        self.queue.register('failure', failure)
+
+    def tearDown(self):
+        self.queue.executor.shutdown(wait=True)
+        self.directory.cleanup()
+
+    def test_result_of_done_job(self):
+        id_ = self.queue.submit('addition', a=1, b=2)
+        self.queue.executor.shutdown(wait=True)
+
+        job = self.queue.status(id_)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['percent'], 100)
+        self.assertEqual(job['result'], {'sum': 3})
+
+    def test_error_of_failed_job(self):
+        id_ = self.queue.submit('failure')
+        self.queue.executor.shutdown(wait=True)
+
+        job = self.queue.status(id_)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('no activities', job['error'])
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.queue.status('unknown'))
+
+    def test_resume_unfinished_job(self):
+        # job created by a web process stopped before running it
+        id_ = self.store.create('addition', {'a': 2, 'b': 3})
+
+        self.queue.resume()
+        self.queue.executor.shutdown(wait=True)
+
+        self.assertEqual(self.queue.status(id_)['result'], {'sum': 5})
+
+    def test_job_not_submitted_twice(self):
+        """
+        the id of the unfinished job of the same or of a conflicting kind is returned
+        """
+        id_ = self.store.create('failure', {})
+        self.assertEqual(self.queue.submit_unless_unfinished('addition', kinds=('failure',), a=1, b=2), id_)
+        self.assertEqual(self.queue.submit_unless_unfinished('failure'), id_)
+        self.assertNotEqual(self.queue.submit_unless_unfinished('addition', a=1, b=2), id_)
+        self.queue.executor.shutdown(wait=True)
+        self.assertEqual(len(self.store.get_unfinished()), 1)
+
+    def test_store_opened_at_first_use(self):
+        filename = os.path.join(self.directory.name, 'lazy', 'jobs.sqlite')
+        with mock.patch.dict(os.environ, {'JOBS_DATABASE': filename}):
+            queue = JobQueue(workers=1)
+            self.assertFalse(os.path.exists(filename))
+            self.assertIsNone(queue.status('unknown'))
+        self.assertTrue(os.path.exists(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+import warnings
+from datetime import date, timedelta
+from statistics import mean, StatisticsError
+
+import pandas as pd
+
+from prediction.domain.activity import Activity
+from prediction.domain.dataset import Dataset
+from prediction.domain.model import Model, TypeModel
+from prediction.domain.segment import Segment
+
+warnings.filterwarnings('ignore')
+
+
+def history(days: int = 400, seed: int = 42):
+    """
+    activities of the athlete, the most recent first
+    """
+    random.seed(seed)
+    activities = []
+    for day in range(days):
+        if random.random() < 0.5:
+            continue
+        start_date_local = (date(2019, 1, 1) + timedelta(days=day)).strftime('%Y-%m-%dT') + '08:30:00Z'
+        activity_id = len(activities) + 1
+        segments = [
+            Segment(id_=random.randint(1, 50), activity_id=activity_id, athlete_id=1, name='segment',
+                    type_=random.choice(['Ride', 'VirtualRide']), elapsed_time=random.randint(60, 1200),
+                    moving_time=600, start_date_local=start_date_local, distance=random.choice([800.5, 3000, 30000]),
+                    average_cadence=85, average_watts=200, average_grade=random.uniform(-5, 10),
+                    maximum_grade=random.choice([3.2, 12.5, 60.0]), climb_category=random.choice([0, 0, 0, 1, 3, 5]),
+                    average_heart_rate=random.choice([None, 90.1, 145.3]))
+            for _ in range(random.randint(0, 8))
+        ]
+        activities.append(Activity(
+            id_=activity_id, athlete_id=1, name='ride', distance=40000, moving_time=5000,
+            elapsed_time=random.randint(1800, 18000), total_elevation_gain=300, type_='Ride',
+            start_date_local=start_date_local, average_speed=round(random.uniform(5, 10), 3), average_cadence=85,
+            average_watts=200, max_watts=600, suffer_score=50, calories=1000, segment_efforts=segments
+        ))
+    return list(reversed(activities))
+
+
+def as_dicts(frame: pd.DataFrame):
+    """
+    rows as the dicts used before the dataset, missing values as None
+    """
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    for record in records:
+        record['start_date'] = record['start_date'].date()
+    return records
+
+
+def items_last_30d(items, date_):
+    end_date = date_ - timedelta(days=1)
+    start_date = end_date - timedelta(days=30)
+    return [item for item in items if start_date <= item.get("start_date") <= end_date]
+
+
+class RollingFeaturesTests(unittest.TestCase):
+    """
+    The features must be the same as the ones computed
+    with a scan of the whole history for every segment
+    """
+
+    def setUp(self):
+        self.model = Model(TypeModel.XGB, dataset_=Dataset.from_activities(history()))
+        self.activities = as_dicts(self.model.activities)
+        self.segments = as_dicts(self.model.segments)
+
+    def test_time_activities_last_30d(self):
+        self.model.time_activities_last_30d()
+        for actual, segment in zip(self.model.segments['time_activities_last_30d'], self.segments):
+            activities = items_last_30d(self.activities, segment['start_date'])
+            expected = round(sum(activity['elapsed_time'] for activity in activities) / 60, 2)
+            self.assertEqual(actual, expected)
+
+    def test_average_climb_cat_last_30d(self):
+        self.model.average_climb_cat_last_30d()
+        for actual, segment in zip(self.model.segments['average_climb_cat_last_30d'], self.segments):
+            segments = items_last_30d(self.segments, segment['start_date'])
+            try:
+                expected = round(mean(seg['climb_category'] for seg in segments), 2)
+            except StatisticsError:
+                expected = 0
+            self.assertEqual(actual, expected)
+
+    def test_average_speed_last_30d(self):
+        self.model.average_speed_last_30d()
+        for actual, segment in zip(self.model.segments['average_speed_last_30d'], self.segments):
+            activities = items_last_30d(self.activities, segment['start_date'])
+            try:
+                expected = round(mean(activity['average_speed'] for activity in activities), 2)
+            except StatisticsError:
+                expected = 0
+            self.assertEqual(actual, expected)
+
+    def test_days_since_last_activity(self):
+        self.model.days_since_last_activity()
+        activities_ids = [activity['id'] for activity in self.activities]
+        for actual, segment in zip(self.model.segments['days_since_last_activity'], self.segments):
+            index_activity = activities_ids.index(segment['activity_id'])
+            try:
+                expected = (self.activities[index_activity]['start_date']
+                            - self.activities[index_activity + 1]['start_date']).days
+            except IndexError:
+                expected = 0
+            self.assertEqual(actual, expected)
+
+
+class CleanDataTests(unittest.TestCase):
+
+    def test_same_segments_as_successive_filters(self):
+        activities = history()
+        # double segments in the same activity
+        for activity in activities[::3]:
+            activity.segment_efforts += activity.segment_efforts[:2]
+
+        model = Model(TypeModel.XGB, dataset_=Dataset.from_activities(activities))
+        segments = as_dicts(model.segments)
+
+        expected = [segment for segment in segments if segment.get('maximum_grade') < 50]
+        unique_segments = []
+        for segment in expected:
+            if segment not in unique_segments:
+                unique_segments.append(segment)
+        expected = [segment for segment in unique_segments if segment.get('distance') < 25000]
+        expected = [segment for segment in expected
+                    if segment.get('average_heart_rate') is None or segment.get('average_heart_rate') > 100]
+
+        model.clean_data()
+        self.assertEqual(as_dicts(model.segments), expected)
+
+        dropped = model.cleaning_result['dropped']
+        self.assertGreater(dropped['duplicate'], 0)
+        self.assertEqual(sum(dropped.values()), len(segments) - len(expected))
+        self.assertEqual(dropped['maximum_grade'],
+                         len([segment for segment in segments if segment['maximum_grade'] >= 50]))
+
+
+class IncrementalSplitTests(unittest.TestCase):
+
+    def setUp(self):
+        activities = history()
+        self.new_activities = activities[:20]
+        self.last_activity_id = activities[20].id
+        self.parent = Model(TypeModel.XGB, dataset_=Dataset.from_activities(activities[20:]))
+        self.parent.prepare_data()
+        self.incremental = Model(TypeModel.XGB, dataset_=Dataset.from_activities(activities))
+
+    def test_train_set_limited_to_new_activities(self):
+        self.assertEqual(self.parent.data_version['last_activity_id'], self.last_activity_id)
+        x_new, _, _, _ = self.incremental.prepare_data(since=self.parent.data_version,
+                                                       test_days=self.parent.test_days)
+
+        new_ids = {activity.id for activity in self.new_activities}
+        is_new = self.incremental.segments['activity_id'].isin(new_ids).to_numpy()
+        self.assertGreater(len(x_new), 0)
+        self.assertLessEqual(len(x_new), int(is_new.sum()))
+
+    def test_test_set_of_the_parent_kept(self):
+        """
+        the test days of the parent stay in the test set, the days it trained on never enter it
+        """
+        calendar_days = self.parent.segments['start_date'].dt.strftime('%j%Y')
+        parent_train_days = set(calendar_days) - set(self.parent.test_days)
+        self.incremental.prepare_data(since=self.parent.data_version, test_days=self.parent.test_days)
+
+        self.assertTrue(set(self.parent.test_days) <= set(self.incremental.test_days))
+        self.assertEqual(parent_train_days & set(self.incremental.test_days), set())
+        self.assertGreater(len(self.incremental.test_days), len(self.parent.test_days))
+
+
+class TrainingSetTests(unittest.TestCase):
+
+    def test_one_training_set_by_training(self):
+        """
+        the models of the types of a training share the file of their training set
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            model = Model(TypeModel.XGB, dataset_=Dataset.from_activities(history()))
+            model.directory_models = directory + '/'
+            model.prepare_data()
+            other_model = model.copy_for(TypeModel.RFORREST)
+
+            filename = model.dump_training_set()
+            self.assertEqual(other_model.dump_training_set(), filename)
+            self.assertEqual(os.listdir(directory), [os.path.basename(filename)])
+            model.training_set = filename
+            pd.testing.assert_frame_equal(model.load_training_set(), model.segments)
+
+
+class ProfileTests(unittest.TestCase):
+
+    def test_stages_of_the_preparation(self):
+        model = Model(TypeModel.XGB, dataset_=Dataset.from_activities(history()))
+        initial_rows = len(model.segments)
+        x_train, _, _, _ = model.prepare_data()
+
+        stages = {record['stage']: record for record in model.profile}
+        self.assertEqual(list(stages)[:3], ['load_activities', 'concat', 'clean_data'])
+        self.assertIn('average_speed_last_30d', stages)
+        self.assertEqual(stages['clean_data']['rows_in'], initial_rows)
+        self.assertEqual(stages['clean_data']['rows_out'], len(model.segments))
+        self.assertEqual(stages['split_train_test']['rows_out'], len(x_train))
+        for record in model.profile:
+            self.assertGreaterEqual(record['wall_seconds'], 0)
+            self.assertGreater(record['max_rss_bytes'], 0)
+
+        profile = json.loads(model.export_profile())
+        self.assertEqual(profile['id'], str(model.id))
+        self.assertEqual(len(profile['stages']), len(model.profile))
+
+
+class DatasetChunksTests(unittest.TestCase):
+
+    def test_same_dataset_from_chunks(self):
+        activities = history()
+        whole = Dataset.from_activities(activities)
+        for chunk_size in (1, 7, 1000):
+            chunks = (activities[start:start + chunk_size] for start in range(0, len(activities), chunk_size))
+            dataset = Dataset.from_chunks(chunks)
+            pd.testing.assert_frame_equal(dataset.activities, whole.activities)
+            pd.testing.assert_frame_equal(dataset.segments, whole.segments)
+
+    def test_float32_design_matrix(self):
+        model = Model(TypeModel.XGB, dataset_=Dataset.from_activities(history()))
+        x_train, _, x_test, _ = model.prepare_data()
+        self.assertEqual(x_train.dtype, 'float32')
+        self.assertEqual(x_train.shape[1], len(model.features_train))
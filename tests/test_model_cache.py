@@ -0,0 +1,122 @@
+import os
+import pickle
+import tempfile
+import unittest
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from prediction.domain import model
+from prediction.domain.model import Model
+from prediction.domain.model_cache import ModelCache
+
+
+def saved_model(directory: str, estimator) -> Model:
+    # metadata only, the model is not trained
+    model_ = Model.__new__(Model)
+    model_.id = uuid.uuid4()
+    model_.directory_models = directory
+    with open(directory + str(model_.id), 'wb') as file:
+        pickle.dump(estimator, file)
+    return model_
+
+
+class ModelCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.models_directory = self.directory.name + '/'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def patch_repository(self, **methods) -> None:
+        """
+        model repository replaced by the methods given during the test
+        """
+        patcher = mock.patch.object(model, 'repository', SimpleNamespace(**methods), create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_estimator_loaded_once(self):
+        cache = ModelCache(max_models=2)
+        model_ = saved_model(self.models_directory, {'trees': 10})
+
+        estimator = cache.get_estimator(model_)
+        os.remove(self.models_directory + str(model_.id))
+        self.assertIs(cache.get_estimator(model_), estimator)
+
+    def test_least_recently_used_evicted_by_count(self):
+        cache = ModelCache(max_models=2)
+        models = [saved_model(self.models_directory, index) for index in range(3)]
+
+        cache.get_estimator(models[0])
+        cache.get_estimator(models[1])
+        cache.get_estimator(models[0])
+        cache.get_estimator(models[2])
+
+        self.assertIsNotNone(cache.get(models[0].id))
+        self.assertIsNone(cache.get(models[1].id))
+        self.assertIsNotNone(cache.get(models[2].id))
+
+    def test_evicted_by_bytes(self):
+        cache = ModelCache(max_models=10, max_bytes=1500)
+        models = [saved_model(self.models_directory, bytes(1000)) for _ in range(2)]
+
+        cache.get_estimator(models[0])
+        cache.get_estimator(models[1])
+
+        self.assertIsNone(cache.get(models[0].id))
+        self.assertIsNotNone(cache.get(models[1].id))
+        self.assertLessEqual(cache.total_bytes, 1500)
+
+    def test_champion_read_until_clear(self):
+        cache = ModelCache(refresh_seconds=60)
+        model_ = saved_model(self.models_directory, 'estimator')
+        calls = []
+
+        def get_champion():
+            calls.append(1)
+            return model_
+
+        self.patch_repository(get_champion=get_champion)
+        self.assertEqual(cache.get_champion(), (model_, 'estimator'))
+        self.assertEqual(cache.get_champion(), (model_, 'estimator'))
+        self.assertEqual(len(calls), 1)
+
+        cache.clear()
+        cache.get_champion()
+        self.assertEqual(len(calls), 2)
+
+    def test_champion_read_again_after_refresh(self):
+        cache = ModelCache(refresh_seconds=0)
+        champions = [saved_model(self.models_directory, 'first'), saved_model(self.models_directory, 'second')]
+        self.patch_repository(get_champion=lambda: champions[0])
+
+        self.assertEqual(cache.get_champion()[1], 'first')
+        champions.pop(0)
+        self.assertEqual(cache.get_champion()[1], 'second')
+
+    def test_champion_without_pickle_replaced(self):
+        cache = ModelCache()
+        champion = saved_model(self.models_directory, 'removed')
+        os.remove(self.models_directory + str(champion.id))
+        next_best = saved_model(self.models_directory, 'next')
+        elections = []
+
+        def elect_champion(excluded_ids):
+            elections.append(excluded_ids)
+            return next_best
+
+        self.patch_repository(get_champion=lambda: champion, elect_champion=elect_champion)
+        self.assertEqual(cache.get_champion(), (next_best, 'next'))
+        self.assertEqual(elections, [[str(champion.id)]])
+
+    def test_no_champion(self):
+        cache = ModelCache()
+        self.patch_repository(get_champion=lambda: None)
+        self.assertIsNone(cache.get_champion())
+
+
+if __name__ == '__main__':
+    unittest.main()
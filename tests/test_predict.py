@@ -0,0 +1,103 @@
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+from prediction.domain import model_cache
+from prediction.domain.model import Model
+from prediction.domain.predict import Predict, BatchPredict
+from prediction.domain.route import Route
+from prediction.domain.training_load import TrainingLoad
+from prediction.utils.functions import gpx_parser, compute_segmentation, simplify_segmentation
+from test_model import history
+
+warnings.filterwarnings('ignore')
+
+
+def fitted_model(id_: str = 'predict-test') -> Model:
+    """
+    model with all the features, its estimator is put in the model cache
+    """
+    model_ = Model.__new__(Model)
+    model_.id = id_
+    model_.features_train = ['distance', 'climb_category', 'type_virtual_ride', 'time_activities_last_30d',
+                             'days_since_last_activity', 'average_climb_cat_last_30d', 'average_speed_last_30d']
+    model_.processing = ['log_label']
+    random = np.random.RandomState(42)
+    x = random.uniform(0, 10, size=(200, len(model_.features_train)))
+    estimator = LinearRegression().fit(x, random.uniform(3, 6, size=200))
+    model_cache.cache.put(model_, estimator, 0)
+    return model_
+
+
+class BatchPredictTests(unittest.TestCase):
+
+    def setUp(self):
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            gpx = gpx_parser(gpx_file.read())
+        segmentation = simplify_segmentation(compute_segmentation(gpx), tolerance=1.0)
+        route_info = {
+            'athlete_id': 1, 'description': None, 'elevation_gain': 1090,
+            'name': "Alpe d'huez", 'created_at': '2021-03-01T10:00:00Z', 'estimated_moving_time': 3600
+        }
+        self.routes = [
+            Route(id_=1, distance=13800, gpx=gpx, segmentation=segmentation, **route_info),
+            Route(id_=2, distance=5000, gpx=gpx, segmentation=segmentation[:3], **route_info)
+        ]
+        self.model = fitted_model()
+        self.training_load = TrainingLoad.from_activities(1, history())
+
+    def tearDown(self):
+        model_cache.cache.remove(self.model.id)
+
+    def test_same_as_one_route(self):
+        """
+        the batch gives the predictions of the routes predicted one by one
+        """
+        predictions = BatchPredict(self.model, self.routes, training_load_=self.training_load).get_predictions()
+        self.assertEqual([(prediction['route_id'], prediction['virtual_ride']) for prediction in predictions],
+                         [(1, False), (2, False), (1, True), (2, True)])
+        for prediction in predictions:
+            route_ = self.routes[prediction['route_id'] - 1]
+            expected = Predict(self.model, route_, prediction['virtual_ride'],
+                               training_load_=self.training_load).get_prediction()
+            self.assertEqual(len(prediction['segments_seconds']), len(route_.get_segmentation('prediction')))
+            for key in ('hours', 'minutes', 'seconds'):
+                self.assertEqual(prediction[key], expected[key])
+            self.assertAlmostEqual(prediction['avg_speed_kmh'], expected['avg_speed_kmh'], delta=0.01)
+
+    def test_route_features(self):
+        """
+        the matrix from the features stored with the route is the one built from its segments
+        """
+        for route_ in self.routes:
+            for virtual_ride in (False, True):
+                predict_ = Predict(self.model, route_, virtual_ride, training_load_=self.training_load)
+                expected = predict_.features_matrix(pd.DataFrame(route_.get_segmentation('prediction')))
+                route_.compute_features()
+                np.testing.assert_array_equal(predict_.prepare_data(), expected)
+
+    def test_one_mode(self):
+        predictions = BatchPredict(self.model, self.routes, virtual_rides=[True],
+                                   training_load_=self.training_load).get_predictions()
+        self.assertEqual([prediction['virtual_ride'] for prediction in predictions], [True, True])
+        self.assertEqual(BatchPredict(self.model, [], training_load_=self.training_load).get_predictions(), [])
+
+    def test_route_without_segmentation(self):
+        """
+        a route without segmentation is predicted without time, the other routes of the batch are predicted
+        """
+        route_ = Route(id_=3, distance=1000, gpx=None, segmentation=None, athlete_id=1, description=None,
+                       elevation_gain=0, name='empty', created_at='2021-03-01T10:00:00Z', estimated_moving_time=0)
+        predictions = BatchPredict(self.model, self.routes + [route_], virtual_rides=[False],
+                                   training_load_=self.training_load).get_predictions()
+        self.assertEqual([prediction['route_id'] for prediction in predictions], [1, 2, 3])
+        self.assertEqual(predictions[2]['segments_seconds'], [])
+        self.assertEqual(Predict(self.model, route_, False, training_load_=self.training_load).get_prediction(),
+                         {'hours': 0, 'minutes': 0, 'seconds': 0, 'avg_speed_kmh': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import warnings
+from unittest import mock
+
+from prediction.domain import model_cache
+from prediction.domain.predict import Predict
+from prediction.domain.prediction_cache import PredictionCache
+from prediction.domain.route import Route
+from prediction.domain.training_load import TrainingLoad
+from prediction.utils.functions import gpx_parser, compute_segmentation, simplify_segmentation
+from test_model import history
+from test_predict import fitted_model
+
+warnings.filterwarnings('ignore')
+
+
+class PredictionCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            gpx = gpx_parser(gpx_file.read())
+        self.route = Route(id_=1, athlete_id=1, description=None, distance=13800, elevation_gain=1090,
+                           name="Alpe d'huez", created_at='2021-03-01T10:00:00Z', estimated_moving_time=3600,
+                           gpx=gpx, segmentation=simplify_segmentation(compute_segmentation(gpx), tolerance=1.0))
+        self.model = fitted_model()
+        self.activities = history()
+
+    def tearDown(self):
+        model_cache.cache.remove(self.model.id)
+
+    def predict(self, activities=None, virtual_ride=False) -> Predict:
+        training_load_ = TrainingLoad.from_activities(1, activities or self.activities)
+        return Predict(self.model, self.route, virtual_ride, training_load_=training_load_)
+
+    def test_hit(self):
+        cache = PredictionCache()
+        prediction = cache.get_prediction(self.predict())
+        with mock.patch.object(Predict, 'get_prediction') as get_prediction:
+            self.assertEqual(cache.get_prediction(self.predict()), prediction)
+            get_prediction.assert_not_called()
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_key(self):
+        """
+        another virtual_ride mode or other features of the athlete are other predictions
+        """
+        cache = PredictionCache()
+        keys = {
+            cache.key(self.predict()),
+            cache.key(self.predict(virtual_ride=True)),
+            cache.key(self.predict(activities=self.activities[10:]))
+        }
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(cache.key(self.predict()), cache.key(self.predict()))
+
+    def test_ttl(self):
+        cache = PredictionCache(ttl_seconds=10)
+        with mock.patch('prediction.domain.prediction_cache.time.monotonic', return_value=100):
+            cache.put(('route', 'model', False, 'features'), {'hours': 1})
+        with mock.patch('prediction.domain.prediction_cache.time.monotonic', return_value=105):
+            self.assertEqual(cache.get(('route', 'model', False, 'features')), {'hours': 1})
+        with mock.patch('prediction.domain.prediction_cache.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get(('route', 'model', False, 'features')))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_lru(self):
+        cache = PredictionCache(max_entries=2)
+        cache.put(('1',), {'hours': 1})
+        cache.put(('2',), {'hours': 2})
+        cache.get(('1',))
+        cache.put(('3',), {'hours': 3})
+        self.assertEqual(list(cache.entries), [('1',), ('3',)])
+        cache.clear()
+        self.assertIsNone(cache.get(('1',)))
+
+
+if __name__ == '__main__':
+    unittest.main()
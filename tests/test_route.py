@@ -0,0 +1,99 @@
+import json
+import unittest
+import warnings
+
+import jsonpickle
+import numpy as np
+
+from prediction.domain.route import Route
+from prediction.infrastructure import elasticsearch  # noqa: F401 registers the jsonpickle handler of Route
+from prediction.utils.functions import gpx_parser, compute_segmentation, simplify_segmentation
+
+warnings.filterwarnings('ignore')
+
+
+class RouteEncodingTests(unittest.TestCase):
+
+    def setUp(self):
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            self.gpx = gpx_parser(gpx_file.read())
+        self.segmentation = simplify_segmentation(compute_segmentation(self.gpx), tolerance=1.0)
+        self.route_info = {
+            'id_': 1, 'athlete_id': 2, 'description': None, 'distance': 13800, 'elevation_gain': 1090,
+            'name': "Alpe d'huez", 'created_at': '2021-03-01T10:00:00Z', 'estimated_moving_time': 3600
+        }
+
+    def assert_same_points(self, actual, expected):
+        for key in ('latitude', 'longitude', 'elevation'):
+            np.testing.assert_allclose([point[key] for point in actual],
+                                       [point[key] for point in expected], rtol=0, atol=1e-6)
+
+    def test_encoded_document(self):
+        """
+        makes sure that the geometry is stored encoded and decoded when accessed
+        """
+        route = Route(gpx=self.gpx, segmentation=self.segmentation, **self.route_info)
+        document = json.loads(jsonpickle.encode(route))
+        self.assertNotIn('gpx', document)
+        self.assertIn('gpx_encoded', document)
+        self.assertEqual(document['created_at'], '2021-03-01T10:00:00Z')
+
+        decoded_route = jsonpickle.decode(json.dumps(document))
+        self.assertIsNone(decoded_route._gpx)
+        self.assert_same_points(decoded_route.gpx, self.gpx)
+        self.assertEqual(decoded_route.get_segmentation('prediction'),
+                         simplify_segmentation(self.segmentation, tolerance=None))
+        self.assertIsNone(decoded_route._segmentation)
+        for segment, expected in zip(decoded_route.segmentation, self.segmentation):
+            self.assertEqual(segment['distance'], expected['distance'])
+            np.testing.assert_allclose(segment['all_points'], expected['all_points'], rtol=0, atol=1e-6)
+
+    def test_document_without_encoding(self):
+        """
+        makes sure that routes saved before the encoding are still read
+        """
+        document = {'py/object': 'prediction.domain.route.Route', 'gpx': self.gpx,
+                    'segmentation': self.segmentation, **self.route_info}
+        document['id'] = document.pop('id_')
+        route = jsonpickle.decode(json.dumps(document))
+        self.assertEqual(route.gpx, self.gpx)
+        self.assertEqual(route.segmentation, self.segmentation)
+        self.assertEqual(route.id, 1)
+        self.assertEqual(route.name, "Alpe d'huez")
+
+    def test_features(self):
+        """
+        makes sure that the features computed at import are stored and read back without loss
+        """
+        route = Route(gpx=self.gpx, segmentation=self.segmentation, **self.route_info)
+        expected = route.get_features()
+        route.compute_features()
+        document = json.loads(jsonpickle.encode(route))
+        self.assertEqual(document['features']['columns'], Route.feature_columns)
+
+        decoded_route = jsonpickle.decode(json.dumps(document))
+        features = decoded_route.get_features()
+        self.assertEqual(features.dtype, np.float32)
+        self.assertEqual(features.shape, (len(self.segmentation), len(Route.feature_columns)))
+        np.testing.assert_array_equal(features, expected)
+        self.assertIsNone(decoded_route._segmentation)
+
+    def test_route_without_gpx(self):
+        """
+        makes sure that a route without gpx is stored without the encoded field
+        """
+        route = Route(gpx=None, segmentation=self.segmentation, **self.route_info)
+        document = json.loads(jsonpickle.encode(route))
+        self.assertNotIn('gpx_encoded', document)
+        self.assertIn('segmentation_encoded', document)
+
+        decoded_route = jsonpickle.decode(json.dumps(document))
+        self.assertIsNone(decoded_route.gpx)
+        self.assertEqual(decoded_route.get_segmentation('prediction'),
+                         simplify_segmentation(self.segmentation, tolerance=None))
+
+    def test_route_without_segmentation(self):
+        route = Route(gpx=self.gpx, segmentation=None, **self.route_info)
+        self.assertEqual(route.get_segmentation('prediction'), [])
+        self.assertEqual(route.get_segmentation('map'), [])
+        self.assertEqual(route.segments_features().shape, (0, len(Route.feature_columns)))
@@ -0,0 +1,124 @@
+import unittest
+import warnings
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+from prediction.domain import model_cache, route, route_prediction, training_load
+from prediction.domain.predict import Predict
+from prediction.domain.route import Route
+from prediction.domain.route_prediction import RoutePrediction, SerialRuns, predict_all_routes
+from prediction.domain.training_load import TrainingLoad
+from prediction.utils.functions import gpx_parser, compute_segmentation, simplify_segmentation
+from test_model import history
+from test_predict import fitted_model
+
+warnings.filterwarnings('ignore')
+
+
+class RoutePredictionTests(unittest.TestCase):
+
+    def setUp(self):
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            gpx = gpx_parser(gpx_file.read())
+        segmentation = simplify_segmentation(compute_segmentation(gpx), tolerance=1.0)
+        route_info = {
+            'description': None, 'distance': 13800, 'elevation_gain': 1090,
+            'name': "Alpe d'huez", 'created_at': '2021-03-01T10:00:00Z', 'estimated_moving_time': 3600
+        }
+        self.routes = [
+            Route(id_=1, athlete_id=1, gpx=gpx, segmentation=segmentation, **route_info),
+            Route(id_=2, athlete_id=1, gpx=gpx, segmentation=segmentation[:4], **route_info),
+            Route(id_=3, athlete_id=2, gpx=gpx, segmentation=segmentation[2:], **route_info)
+        ]
+        self.model = fitted_model()
+        self.training_loads = {1: TrainingLoad.from_activities(1, history()),
+                               2: TrainingLoad.from_activities(1, history(days=100, seed=7))}
+        self.saved = []
+
+        self.patch_repository(route, get_all_desc=lambda: self.routes)
+        self.patch_repository(training_load, get=self.training_loads.get)
+        self.patch_repository(route_prediction, save_all=self.saved.extend)
+
+    def tearDown(self):
+        model_cache.cache.remove(self.model.id)
+
+    def patch_repository(self, module, **methods) -> None:
+        """
+        repository of the module replaced by the methods given during the test
+        """
+        patcher = mock.patch.object(module, 'repository', SimpleNamespace(**methods), create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_all_routes_predicted(self):
+        with mock.patch.object(model_cache.cache, 'get_champion', return_value=(self.model, None)):
+            self.assertEqual(predict_all_routes(), 3)
+
+        self.assertEqual([route_prediction_.route_id for route_prediction_ in self.saved], [1, 2, 3])
+        for route_prediction_, route_ in zip(self.saved, self.routes):
+            self.assertTrue(route_prediction_.is_valid(self.model.id, self.training_loads[route_.athlete_id]))
+            self.assertEqual(route_prediction_.athlete_id, route_.athlete_id)
+            for virtual_ride in (False, True):
+                expected = Predict(self.model, route_, virtual_ride,
+                                   training_load_=self.training_loads[route_.athlete_id]).get_prediction()
+                prediction = route_prediction_.get(virtual_ride)
+                self.assertEqual((prediction['hours'], prediction['minutes'], prediction['seconds']),
+                                 (expected['hours'], expected['minutes'], expected['seconds']))
+
+    def test_no_champion(self):
+        with mock.patch.object(model_cache.cache, 'get_champion', return_value=None):
+            self.assertEqual(predict_all_routes(), 0)
+        self.assertEqual(self.saved, [])
+
+    def test_validity(self):
+        training_load_ = self.training_loads[1]
+        route_prediction_ = RoutePrediction(1, 1, 'model', date.today().isoformat(), {'false': {'hours': 1}},
+                                            training_load_version=training_load_.version())
+        self.assertTrue(route_prediction_.is_valid('model', training_load_))
+        self.assertFalse(route_prediction_.is_valid('other model', training_load_))
+        self.assertEqual(route_prediction_.get(virtual_ride=False), {'hours': 1})
+        self.assertIsNone(route_prediction_.get(virtual_ride=True))
+        route_prediction_.date = '2021-03-01'
+        self.assertFalse(route_prediction_.is_valid('model', training_load_))
+
+    def test_invalid_after_import(self):
+        """
+        the predictions computed before activities were added to the ledger are computed again
+        """
+        with mock.patch.object(model_cache.cache, 'get_champion', return_value=(self.model, None)):
+            predict_all_routes()
+        training_load_ = self.training_loads[1]
+        self.assertTrue(self.saved[0].is_valid(self.model.id, training_load_))
+        training_load_.add_activity(history(days=450, seed=3)[0])
+        self.assertFalse(self.saved[0].is_valid(self.model.id, training_load_))
+
+
+class SerialRunsTests(unittest.TestCase):
+
+    def test_run_asked_during_a_run(self):
+        """
+        a run asked while another one runs is done after it, by the running one
+        """
+        serial_runs = SerialRuns()
+        runs = []
+
+        def compute():
+            runs.append(len(runs))
+            if len(runs) == 1:
+                self.assertEqual(serial_runs.run(compute), 0)
+            return len(runs)
+
+        self.assertEqual(serial_runs.run(compute), 2)
+        self.assertEqual(runs, [0, 1])
+        self.assertFalse(serial_runs.running)
+
+    def test_failed_run(self):
+        serial_runs = SerialRuns()
+        with self.assertRaises(ValueError):
+            serial_runs.run(mock.Mock(side_effect=ValueError))
+        self.assertEqual(serial_runs.run(lambda: 3), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
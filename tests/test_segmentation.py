@@ -3,11 +3,88 @@ import warnings
 
 import pandas as pd
 
-from prediction.utils.functions import gpx_parser, compute_segmentation, haversine
+from prediction.utils.functions import gpx_parser, compute_segmentation, haversine, sign_equal, \
+    gpx_stream_parser, gpx_arrays_to_points, compute_segmentation_from_arrays, simplify_segmentation
 
 warnings.filterwarnings('ignore')
 
 
+def legacy_compute_segmentation(gpx):
+    """
+    Row by row segmentation, as it was before the vectorized version.
+    Kept as a reference for the regression test.
+    """
+    window = 6
+
+    df = pd.DataFrame(gpx)
+    df["elevation"] = round(df["elevation"], 2)
+
+    for i in range(df.shape[0]):
+        if i == 0:
+            df.loc[i, "distance_to_last_point"] = 0
+        else:
+            df.loc[i, "distance_to_last_point"] = round(
+                haversine(
+                    df['longitude'][i], df['latitude'][i],
+                    df['longitude'][i - 1], df['latitude'][i - 1]
+                ), 2)
+
+    df['total_distance'] = round(df['distance_to_last_point'].cumsum(), 2)
+
+    df['rw_altitude_gain'] = \
+        df['elevation'].rolling(window=window).apply(lambda x: x.iloc[window - 1] - x.iloc[0])
+
+    df_na = df[df['rw_altitude_gain'].isna()]
+    df_na['segment'] = 0
+    df = df.dropna().reset_index(drop=True)
+
+    for i in range(df.shape[0]):
+        if i == 0:
+            df.loc[i, "segment"] = 0
+        else:
+            if not sign_equal(df.loc[i - 1, 'rw_altitude_gain'], df.loc[i, "rw_altitude_gain"]):
+                df.loc[i, "segment"] = df.loc[i - 1, "segment"] + 1
+            else:
+                df.loc[i, "segment"] = df.loc[i - 1, "segment"]
+
+    df = pd.concat([df_na, df], ignore_index=True)
+
+    all_segments_index = []
+    for i in df['segment'].unique():
+        segment_index = {}
+        segment_df = df.loc[df['segment'] == i]
+        if i == 0:
+            segment_index['start'] = segment_df.head(1).index.values[0]
+        else:
+            segment_index['start'] = segment_df.head(1).index.values[0] - 1
+        segment_index['end'] = segment_df.tail(1).index.values[0]
+        all_segments_index.append(segment_index)
+
+    segments = []
+    for i in range(len(all_segments_index)):
+        segment = {}
+        segment_df = df.loc[all_segments_index[i].get("start"):all_segments_index[i].get("end")]
+        if i == 0:
+            distance = segment_df.tail(1)['total_distance'].values[0]
+        else:
+            distance = segment_df.tail(1)['total_distance'].values[0] - segment_df.head(1)['total_distance'].values[0]
+        altitude_gain = segment_df.tail(1)['elevation'].values[0] - segment_df.head(1)['elevation'].values[0]
+        average_grade = (altitude_gain * 100) / distance
+
+        all_points = []
+        for latitude, longitude in zip(segment_df['latitude'].values, segment_df['longitude'].values):
+            point = [float(latitude), float(longitude)]
+            all_points.append(point)
+
+        segment['distance'] = float(round(distance, 2))
+        segment['altitude_gain'] = float(round(altitude_gain, 2))
+        segment['average_grade'] = float(round(average_grade, 2))
+        segment['all_points'] = list(all_points)
+        segments.append(segment)
+
+    return segments
+
+
 class SegmentationTests(unittest.TestCase):
 
     def setUp(self):
@@ -15,6 +92,7 @@ class SegmentationTests(unittest.TestCase):
         gpx_file = open(road_directory, 'r')
         gpx = gpx_file.read()
         self.road = gpx_parser(gpx)
+        self.road_arrays = gpx_stream_parser(gpx)
         gpx_file.close()
 
     def test_segmentation_distance(self):
@@ -36,3 +114,55 @@ class SegmentationTests(unittest.TestCase):
         distance_segmentation = [segment.get("distance") for segment in segmentation]
         actual = sum(distance_segmentation)
         self.assertEqual(actual, expected)
+
+    def test_segmentation_same_as_row_by_row(self):
+        """
+        makes sure that the vectorized segmentation gives exactly
+        the same segments as the row by row one
+        """
+        expected = legacy_compute_segmentation(self.road)
+        actual = compute_segmentation(self.road)
+        self.assertEqual(actual, expected)
+
+    def test_segmentation_short_route(self):
+        """
+        a route shorter than the rolling window is a single segment
+        """
+        expected = legacy_compute_segmentation(self.road[:4])
+        actual = compute_segmentation(self.road[:4])
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(actual), 1)
+
+    def test_stream_parser_same_points(self):
+        """
+        makes sure that the streaming parser reads the same points as gpxpy
+        """
+        latitudes, longitudes, elevations = self.road_arrays
+        self.assertEqual(latitudes.dtype, 'float64')
+        self.assertEqual(gpx_arrays_to_points(latitudes, longitudes, elevations), self.road)
+
+    def test_segmentation_from_arrays(self):
+        """
+        makes sure that the segmentation of the parsed arrays is the same
+        as the one of the list of points
+        """
+        expected = compute_segmentation(self.road)
+        actual = compute_segmentation_from_arrays(*self.road_arrays)
+        self.assertEqual(actual, expected)
+
+    def test_simplification_keeps_distance_and_grade(self):
+        """
+        makes sure that the simplification only reduces the points of the segments,
+        keeping the first and the last point of each one
+        """
+        segmentation = compute_segmentation(self.road)
+        simplified = simplify_segmentation(segmentation, tolerance=5.0)
+        for segment, simplified_segment in zip(segmentation, simplified):
+            self.assertEqual(simplified_segment['distance'], segment['distance'])
+            self.assertEqual(simplified_segment['average_grade'], segment['average_grade'])
+            self.assertLessEqual(len(simplified_segment['all_points']), len(segment['all_points']))
+            self.assertEqual(simplified_segment['all_points'][0], segment['all_points'][0])
+            self.assertEqual(simplified_segment['all_points'][-1], segment['all_points'][-1])
+
+        self.assertEqual(simplify_segmentation(segmentation, tolerance=0), segmentation)
+        self.assertNotIn('all_points', simplify_segmentation(segmentation, tolerance=None)[0])
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+import warnings
+
+from prediction.infrastructure.segmentation_cache import SegmentationCache, cached_segmentation
+from prediction.utils.functions import gpx_stream_parser, compute_segmentation_from_arrays
+
+warnings.filterwarnings('ignore')
+
+
+class SegmentationCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SegmentationCache(directory=self.directory.name)
+        with open('./datas/example.gpx', 'r') as gpx_file:
+            self.road_arrays = gpx_stream_parser(gpx_file.read())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit_after_first_segmentation(self):
+        expected = compute_segmentation_from_arrays(*self.road_arrays)
+
+        segmentation, cache_hit = cached_segmentation(*self.road_arrays, cache=self.cache)
+        self.assertFalse(cache_hit)
+        self.assertEqual(segmentation, expected)
+
+        segmentation, cache_hit = cached_segmentation(*self.road_arrays, cache=self.cache)
+        self.assertTrue(cache_hit)
+        self.assertEqual(segmentation, expected)
+
+    def test_window_is_part_of_the_key(self):
+        self.assertNotEqual(self.cache.key(*self.road_arrays, window=6),
+                            self.cache.key(*self.road_arrays, window=8))
+
+    def test_eviction_of_least_recently_used(self):
+        self.cache.set('old', [{'distance': 1.0}])
+        os.utime(self.cache.filename('old'), (0, 0))
+        self.cache.max_bytes = os.path.getsize(self.cache.filename('old'))
+        self.cache.set('new', [{'distance': 2.0}])
+
+        self.assertIsNone(self.cache.get('old'))
+        self.assertEqual(self.cache.get('new'), [{'distance': 2.0}])
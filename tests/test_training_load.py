@@ -0,0 +1,79 @@
+import json
+import unittest
+import warnings
+from datetime import date, timedelta
+
+import jsonpickle
+import numpy as np
+
+from prediction.domain import dataset
+from prediction.domain.dataset import Dataset
+from prediction.domain.training_load import TrainingLoad
+from prediction.infrastructure import elasticsearch  # noqa: F401 registers the jsonpickle handler of TrainingLoad
+from test_model import history
+
+warnings.filterwarnings('ignore')
+
+
+class TrainingLoadTests(unittest.TestCase):
+    """
+    The features read from the ledger must be the ones computed from the dataset
+    """
+
+    def setUp(self):
+        self.activities = history()
+        self.dataset = Dataset.from_activities(self.activities)
+        self.training_load = TrainingLoad.from_activities(1, self.activities)
+        self.dates = [date(2019, 1, 1) + timedelta(days=day) for day in range(0, 440, 3)]
+
+    def as_dates(self):
+        return np.array(self.dates, dtype='datetime64[ns]')
+
+    def test_time_activities_last_30d(self):
+        expected = dataset.time_activities_last_30d(self.dataset.activities, self.as_dates())
+        actual = [self.training_load.time_activities_last_30d(date_) for date_ in self.dates]
+        self.assertEqual(actual, expected.tolist())
+
+    def test_average_speed_last_30d(self):
+        expected = dataset.average_speed_last_30d(self.dataset.activities, self.as_dates())
+        actual = [self.training_load.average_speed_last_30d(date_) for date_ in self.dates]
+        self.assertEqual(actual, expected.tolist())
+
+    def test_average_climb_cat_last_30d(self):
+        expected = dataset.average_climb_cat_last_30d(self.dataset.segments, self.as_dates())
+        actual = [self.training_load.average_climb_cat_last_30d(date_) for date_ in self.dates]
+        self.assertEqual(actual, expected.tolist())
+
+    def test_days_since_last_activity(self):
+        today = date(2020, 6, 1)
+        last_activity_date = self.dataset.activities['start_date'].max()
+        self.assertEqual(self.training_load.days_since_last_activity(today), (today - last_activity_date.date()).days)
+
+    def test_incremental_update(self):
+        """
+        activities added one by one, some of them twice, give the same ledger
+        """
+        training_load = TrainingLoad(1)
+        for activity_ in reversed(self.activities):
+            training_load.add_activity(activity_)
+        self.assertFalse(training_load.add_activity(self.activities[0]))
+        self.assertEqual(training_load.days, self.training_load.days)
+        self.assertEqual(training_load.last_activity_date, self.training_load.last_activity_date)
+
+    def test_stored_ids(self):
+        """
+        the ids of the activities are stored as a sorted list and read back as a set
+        """
+        document = json.loads(jsonpickle.encode(self.training_load))
+        self.assertEqual(document['activity_ids'], sorted(activity_.id for activity_ in self.activities))
+        training_load = jsonpickle.decode(json.dumps(document))
+        self.assertEqual(training_load.activity_ids, self.training_load.activity_ids)
+        self.assertEqual(training_load.days, self.training_load.days)
+
+    def test_other_athlete(self):
+        self.assertEqual(TrainingLoad.from_activities(2, self.activities).days, {})
+        self.assertIsNone(TrainingLoad(2).days_since_last_activity(date.today()))
+
+
+if __name__ == '__main__':
+    unittest.main()
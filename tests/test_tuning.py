@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+import warnings
+from statistics import mean
+from types import SimpleNamespace
+from unittest import mock
+
+from sklearn.model_selection import ParameterGrid
+
+from prediction.domain import model
+from prediction.domain.dataset import Dataset
+from prediction.domain.model import Model, TypeModel
+from prediction.domain.tuning import Tuning
+from test_model import history
+
+warnings.filterwarnings('ignore')
+
+
+class TuningTests(unittest.TestCase):
+
+    def test_grid_search_candidates(self):
+        tuning = Tuning(search='grid')
+        candidates = tuning.get_candidates(TypeModel.RFORREST)
+        self.assertEqual(len(candidates), len(ParameterGrid(Tuning.param_grids[TypeModel.RFORREST])))
+
+    def test_random_search_candidates(self):
+        tuning = Tuning(search='random', candidates=5)
+        candidates = tuning.get_candidates(TypeModel.XGB)
+        self.assertEqual(len(candidates), 5)
+        # same sample for each search
+        self.assertEqual(candidates, tuning.get_candidates(TypeModel.XGB))
+        for params in candidates:
+            for key, value in params.items():
+                self.assertIn(value, Tuning.param_grids[TypeModel.XGB][key])
+
+    def test_unknown_search(self):
+        with self.assertRaises(ValueError):
+            Tuning(search='bayesian')
+
+    def test_best_candidate_on_mean_of_folds(self):
+        scores = {
+            (TypeModel.XGB, 0): [(0.3, 10), (0.1, 12)],
+            (TypeModel.XGB, 1): [(0.15, 40), (0.15, 50)],
+            (TypeModel.RFORREST, 0): [(0.05, None), (0.05, None)]
+        }
+        self.assertEqual(Tuning.best_candidate(TypeModel.XGB, scores), (1, 0.15))
+
+
+class TuningRunTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.saved = []
+        param_grids = {
+            TypeModel.XGB: {'n_estimators': [50], 'max_depth': [2, 4]},
+            TypeModel.RFORREST: {'n_estimators': [10], 'max_depth': [3, None]}
+        }
+        for patcher in (mock.patch.object(Model, 'directory_models', directory.name + '/'),
+                        mock.patch.object(Model, 'keep_training_set', False),
+                        mock.patch.object(model, 'repository', SimpleNamespace(save=self.saved.append), create=True),
+                        mock.patch.object(Tuning, 'param_grids', param_grids)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dataset = Dataset.from_activities(history())
+        self.tuning = Tuning(search='grid', folds=3, workers=2, dataset_=self.dataset)
+
+    def test_folds_by_calendar_day(self):
+        """
+        the fit, early stopping and validation parts of a fold never share a calendar day
+        """
+        model_ = Model(TypeModel.XGB, dataset_=self.dataset)
+        x_train, _, _, _ = model_.prepare_data()
+        calendar_day = model_.segments['start_date'].dt.strftime('%j%Y').to_numpy()
+        days = calendar_day[~model_.is_test_set(model_.test_ratio)]
+
+        folds = self.tuning.split_folds(model_, x_train)
+        self.assertEqual(len(folds), 3)
+        for fit_index, early_stopping_index, validation_index in folds:
+            parts = [set(days[index]) for index in (fit_index, early_stopping_index, validation_index)]
+            self.assertTrue(all(parts))
+            self.assertEqual(parts[0] & parts[1], set())
+            self.assertEqual((parts[0] | parts[1]) & parts[2], set())
+            self.assertEqual(len(fit_index) + len(early_stopping_index) + len(validation_index), len(x_train))
+
+    def test_best_candidate_from_cv_mape(self):
+        with mock.patch.object(Tuning, 'best_candidate', wraps=Tuning.best_candidate) as best_candidate:
+            models = self.tuning.run()
+        self.assertEqual(self.saved, models)
+
+        for model_, call in zip(models, best_candidate.call_args_list):
+            type_model, scores = call.args
+            cv_mapes = [mean(mape for mape, _ in scores[(type_model, index)])
+                        for index in range(len(self.tuning.get_candidates(type_model)))]
+            best = cv_mapes.index(min(cv_mapes))
+            self.assertEqual(model_.tuning['cv_mape'], min(cv_mapes))
+            expected = dict(self.tuning.get_candidates(type_model)[best])
+            for params in (model_.params, expected):
+                params.pop('n_estimators')
+            self.assertEqual(model_.params, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()